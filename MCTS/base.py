@@ -21,6 +21,7 @@ class treeNode(object):
         self.summary = ''
         self.he = 0  # hard estimation
         self.se = 0  # soft estimation
+        self.prior = 0.0  # share of the parent's PUCT exploration bonus, set on expansion
 
     def __str__(self):
         s = ["numVisits: %d" % self.numVisits, f'V:{self.V}', "possibleActions: %s" % (self.children.keys())]
@@ -56,6 +57,14 @@ class treeNode(object):
                 max_node = subNode
         return max_node, max_V
 
+    def subtree_size(self):  # number of nodes in the subtree, self included
+        return 1 + sum(child.subtree_size() for child in self.children.values())
+
+    def to_dict(self):  # subtree as nested dicts, the steps of a node are the concatenated pcds from the root
+        return {'pcd': self.pcd, 'V': self.V, 'numVisits': self.numVisits, 'reflection': self.reflection,
+                'summary': self.summary, 'visit_sequence': self.visit_sequence,
+                'children': [child.to_dict() for child in self.children.values()]}
+
     def trace_route(self):  # trace route from terminal node to root
         cur_node = self
         while cur_node is not None:
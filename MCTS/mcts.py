@@ -1,3 +1,5 @@
+import json
+import logging
 import time
 import math
 import random
@@ -5,18 +7,32 @@ import numpy
 from functools import partial
 import copy
 from MCTS.base import treeNode
+from MCTS.profiler import RoundProfiler, profile_phase
+from utils import trace, deadline
+from utils.deadline import Deadline
+from utils.dedup import step_filter
+
+logger = logging.getLogger(__name__)
+
+PRUNE_TARGET = 0.9  # once over max_nodes, prune down to this share of it so pruning does not run every round
 
 
 def get_next_steps_roll(y: str, step_n: int, mcts_task):
     next_steps = []
+    dedup = step_filter(mcts_task)
     for i in range(mcts_task.roll_branch):
         proposal = ''
         cnt = 3
         while not proposal and cnt:
+            if mcts_task.budget_exhausted():
+                return next_steps
             proposal = mcts_task.get_next_step(y, step_n)
             cnt -= 1
         if not proposal:
             continue
+        if dedup is not None and not dedup.add(proposal):
+            logger.debug('Near-duplicate proposal dropped.')
+            continue
         next_steps.append(proposal)
     return next_steps
 
@@ -24,10 +40,13 @@ def get_next_steps_roll(y: str, step_n: int, mcts_task):
 def get_next_steps_expand(node: treeNode, mcts_task):
     next_steps = []
     reflection = node.reflection
+    dedup = step_filter(mcts_task, node.children.keys())
     for i in range(mcts_task.branch):
         proposal = ''
         cnt = 3
         while not proposal and cnt:
+            if mcts_task.budget_exhausted():
+                return next_steps
             if mcts_task.use_reflection == 'common':
                 proposal = mcts_task.get_next_step_use_reflection(node.y, node.depth + 1, reflection)
             else:
@@ -35,6 +54,9 @@ def get_next_steps_expand(node: treeNode, mcts_task):
             cnt -= 1
         if not proposal:
             continue
+        if dedup is not None and not dedup.add(proposal):
+            logger.debug('Near-duplicate proposal dropped.')
+            continue
         next_steps.append(proposal)
     return next_steps
 
@@ -43,24 +65,34 @@ def randomPolicy(node: treeNode, mcts_task):
     max_V = mcts_task.low
     strs = node.y
     cur_step = node.depth + 1
+    if mcts_task.budget_exhausted():
+        return node.V
     if mcts_task.use_reflection == 'common':
         reflection = mcts_task.get_reflection(strs, cur_step)
     else:
         reflection = mcts_task.get_simple_reflection(strs, cur_step)
+    if deadline.expired():
+        return node.V
     node.update_reflection(reflection)
     if reflection == '<end>':
-        print('This step has been resolved and does not require simulation.\n')
+        logger.debug('This step has been resolved and does not require simulation.')
         return node.V
     for i in range(mcts_task.roll_forward_steps):
+        if mcts_task.budget_exhausted() or deadline.expired():
+            break
         next_steps = get_next_steps_roll(strs, cur_step, mcts_task)
         if not next_steps:
             break
+        if mcts_task.budget_exhausted():
+            break
         action = random.choice(next_steps)  # str
         strs = strs + action
         cur_step += 1
         value = mcts_task.get_step_value(strs)
         if value > max_V:
             max_V = value
+        if mcts_task.budget_exhausted():
+            break
         if mcts_task.use_reflection == 'common':
             cur_ref = mcts_task.get_reflection(strs, cur_step)
         else:
@@ -74,26 +106,40 @@ def greedyPolicy(node: treeNode, mcts_task):
     max_V = mcts_task.low
     strs = node.y
     cur_step = node.depth + 1
+    if mcts_task.budget_exhausted():
+        return node.V
     if mcts_task.use_reflection == 'common':
         reflection = mcts_task.get_reflection(strs, cur_step)
     else:
         reflection = mcts_task.get_simple_reflection(strs, cur_step)
+    if deadline.expired():
+        return node.V
     node.update_reflection(reflection)
     if reflection == '<end>':
-        print('This step has been resolved and does not require simulation.\n')
+        logger.debug('This step has been resolved and does not require simulation.')
         return node.V
     for i in range(mcts_task.roll_forward_steps):
+        if mcts_task.budget_exhausted() or deadline.expired():
+            break
         actions = get_next_steps_roll(strs, cur_step, mcts_task)  # str_list
         if not actions:
             break
-        new_ys = [strs + action for action in actions]
+        values = []
+        for action in actions:
+            if mcts_task.budget_exhausted():
+                break
+            values.append(mcts_task.get_step_value(strs + action))
+        if not values:
+            break
+        new_ys = [strs + action for action in actions[:len(values)]]
         cur_step += 1
-        values = [mcts_task.get_step_value(new_y) for new_y in new_ys]
         idx = numpy.argmax(values)
         strs = new_ys[idx]
         value = values[idx]
         if value > max_V:
             max_V = value
+        if mcts_task.budget_exhausted():
+            break
         if mcts_task.use_reflection == 'common':
             cur_ref = mcts_task.get_reflection(strs, cur_step)
         else:
@@ -103,61 +149,156 @@ def greedyPolicy(node: treeNode, mcts_task):
     return max_V
 
 
-def MCTS_search(mcts_task):
+def search_progress(root, node, round_idx, elapsed, solved, profiler, consensus=None):
+    # anytime snapshot of a search after a round; 'node' is the best answer so far (the solution once solved,
+    # the winning end leaf once the search stops on a consensus, which is also kept as 'consensus')
+    if consensus is not None:
+        node = consensus
+    elif not solved:
+        node, _ = root.getBestV()
+    return {'round': round_idx, 'elapsed': elapsed, 'node': node, 'V': node.V, 'solution': node.y, 'solved': solved,
+            'consensus': consensus, 'tree_size': profiler.mcts_task.node_count, 'tree_depth': profiler.tree_depth,
+            'root': root}
+
+
+def consensus_check(root, mcts_task):
+    # early stop once the end leaves agree on an answer, returns the winning leaf (see MCTS_Task.consensus_reached)
+    if not mcts_task.use_consensus():
+        return None
+    with profile_phase(mcts_task, 'consensus'):
+        winner = mcts_task.consensus_reached(root)
+    if winner is not None:
+        logger.info('Consensus reached among end leaves, stopping search.')
+    return winner
+
+
+def tree_exhausted(root):
+    # True when no round can make progress: every unexpanded node is an end leaf (below end_gate, or the
+    # search would have stopped on it)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.isFullyExpanded:
+            stack.extend(node.children.values())
+        elif node.reflection != '<end>':
+            return False
+    return True
+
+
+def search_limit_reached(mcts_task, rounds, time_start):
+    # time / iteration limit of the search, plus the task's call and token budgets (see MCTS_Task.budget_limits)
+    if mcts_task.limit_type == 'time' and time.time() >= time_start + mcts_task.time_limit / 1000:
+        return True
+    if mcts_task.limit_type == 'iterations' and rounds >= mcts_task.iteration_limit:
+        return True
+    if mcts_task.budget_exhausted():
+        logger.info('Search budget exhausted after %d rounds: %s', rounds, mcts_task.budget_usage())
+        return True
+    if deadline.expired():
+        logger.info('Run deadline passed after %d rounds.', rounds)
+        return True
+    return False
+
+
+def iter_MCTS_search(mcts_task, snapshots=True):
+    # generator form of MCTS_search: yields search_progress() after every round, closing it stops the search.
+    # its return value (StopIteration.value) is MCTS_search's (root, solution node, finish), finish being the
+    # elapsed time in time mode and the number of rounds otherwise; after a consensus stop the node is the
+    # winning end leaf and finish is None
+    # snapshots=False yields None instead: the best-node lookup walks the whole tree, skip it when nobody reads it
     root = treeNode('')
-
-    if mcts_task.limit_type == 'time':
-        timeLimit = time.time() + mcts_task.time_limit / 1000
-        time_start = time.time()
-        while time.time() < timeLimit:
-            print(f'<Start new search round, total time elapsed: {time.time() - time_start}>\n')
-            flag, node, root = executeRound(root, mcts_task)
-            if flag:
-                print('Solution found!\n')
-                return root, node, time.time() - time_start
-    else:
-        for i in range(mcts_task.iteration_limit):
-            print(f'<Start new search round, rounds completed: {i}>\n')
-            flag, node, root = executeRound(root, mcts_task)
+    profiler = RoundProfiler(mcts_task, mcts_task.hooks)
+    mcts_task.profiler = profiler
+    profiler.start_search(root)
+    time_start = time.time()
+    # in time mode the limit also bounds the calls of the last round, not just the start of a new one
+    search_deadline = Deadline(time_start + mcts_task.time_limit / 1000) if mcts_task.limit_type == 'time' else None
+    try:
+        i = 0
+        while not search_limit_reached(mcts_task, i, time_start):
+            if mcts_task.limit_type == 'time':
+                logger.info('<Start new search round, total time elapsed: %s>', time.time() - time_start)
+            else:
+                logger.info('<Start new search round, rounds completed: %s>', i)
+            profiler.start_round(root)
+            node_count = mcts_task.node_count
+            with deadline.activate(search_deadline):
+                flag, node, root = executeRound(root, mcts_task)
+                winner = None if flag else consensus_check(root, mcts_task)
+            if not flag:
+                prune_check(root, mcts_task)
+            # a round that grew nothing may have hit a tree with only end leaves left, which no limit but time
+            # or iterations would ever stop
+            exhausted = not flag and winner is None and mcts_task.node_count == node_count and tree_exhausted(root)
+            profiler.end_round(node, flag)
+            yield search_progress(root, node, i, time.time() - time_start, flag, profiler, winner) if snapshots else None
+            i += 1
             if flag:
-                print('Solution found!\n')
-                return root, node, i + 1
-    return root, None, None
-
-
+                logger.info('Solution found!')
+                return root, node, time.time() - time_start if mcts_task.limit_type == 'time' else i
+            if winner is not None:
+                return root, winner, None
+            if exhausted:
+                logger.info('No expandable node left after %d rounds, stopping search.', i)
+                return root, None, None
+        return root, None, None
+    finally:
+        profiler.end_search()
+
+
+@trace.traced('MCTS_search')
+def MCTS_search(mcts_task):
+    # mcts_task.on_progress(progress) is called after every round, returning True stops the search early
+    # (the best node so far is then used as if the limit had been reached, or the consensus winner of that round)
+    on_progress = getattr(mcts_task, 'on_progress', None)
+    search = iter_MCTS_search(mcts_task, snapshots=on_progress is not None)
+    try:
+        while True:
+            progress = next(search)
+            if on_progress is not None and on_progress(progress) and not progress['solved']:
+                logger.info('Search stopped by progress callback after %d rounds.', progress['round'] + 1)
+                search.close()
+                return progress['root'], progress['consensus'], None
+    except StopIteration as stop:
+        return stop.value
+
+
+@trace.traced('executeRound')
 def executeRound(root, mcts_task):
     # execute a selection-expansion-simulation-backpropagation round
 
-    print('-' * 40)
-    print('Selection phase\n')
-    flag, node = selectNode(root, mcts_task)
+    logger.debug('-' * 40 + '\nSelection phase')
+    with profile_phase(mcts_task, 'selection'):
+        flag, node = selectNode(root, mcts_task)
     if flag:
         if mcts_task.sample_value != 'full':
             return True, node, root
         else:
             node.reflection = '<end>'
 
-    print('-' * 40)
-    print('Expansion phase\n')
+    logger.debug('-' * 40 + '\nExpansion phase')
     if node.reflection == '<end>':
-        print('Skip this phase.\n')
+        logger.debug('Skip this phase.')
     else:
-        node = expand(node, mcts_task)
+        with profile_phase(mcts_task, 'expansion'):
+            node = expand(node, mcts_task)
 
     if mcts_task.reward_model_type == 'vm':
-        print('-' * 40)
-        print('Simulation phase\n')
+        logger.debug('-' * 40 + '\nSimulation phase')
         if node.reflection == '<end>':
-            print('Skip this phase.\n')
+            logger.debug('Skip this phase.')
+        elif deadline.expired() or mcts_task.budget_exhausted():
+            logger.debug('Deadline passed or budget exhausted, skip this phase.')
         else:
-            roll_node = getBestChild(node, mcts_task)
-            best_V = greedyPolicy(roll_node, mcts_task) if mcts_task.roll_policy == 'greedy' else randomPolicy(roll_node, mcts_task)
-            roll_node.V = roll_node.V * (1 - mcts_task.alpha) + best_V * mcts_task.alpha
-            roll_node.numVisits += 1
-
-    print('-' * 40)
-    print('Backpropagation phase\n')
-    back_propagate(node)
+            with profile_phase(mcts_task, 'simulation'):
+                roll_node = getBestChild(node, mcts_task)
+                best_V = greedyPolicy(roll_node, mcts_task) if mcts_task.roll_policy == 'greedy' else randomPolicy(roll_node, mcts_task)
+                roll_node.V = roll_node.V * (1 - mcts_task.alpha) + best_V * mcts_task.alpha
+                roll_node.numVisits += 1
+
+    logger.debug('-' * 40 + '\nBackpropagation phase')
+    with profile_phase(mcts_task, 'backpropagation'):
+        back_propagate(node)
     return False, node, root
 
 
@@ -179,33 +320,49 @@ def selectNode(node, mcts_task):
 
 
 def expand(node: treeNode, mcts_task):
+    # budgets are checked before every model call, a node left half-done is finished if selected again
+    if mcts_task.budget_exhausted():
+        return node
     if not node.reflection:
         if mcts_task.use_reflection == 'common':
             reflection = mcts_task.get_reflection(node.y, node.depth + 1)
         else:  # simple
             reflection = mcts_task.get_simple_reflection(node.y, node.depth + 1)
+        # replies cut off by the deadline must not be taken for '<end>' (that would make this an end leaf)
+        if deadline.expired():
+            return node
         node.update_reflection(reflection)
     if node.reflection == '<end>':
         return node
     actions = get_next_steps_expand(node, mcts_task)
     if not actions:
-        node.update_reflection('<end>')
+        if not deadline.expired() and not mcts_task.budget_exhausted():
+            node.update_reflection('<end>')
         return node
 
     for action in actions:
         if action not in node.children.keys():
+            if mcts_task.budget_exhausted():
+                break
+            value = mcts_task.get_step_value(node.y + action)
+            if deadline.expired():
+                break
             node.append_children(action)
             child = node.children[action]
-            value = mcts_task.get_step_value(child.y)
             child.update_value(value)
-            if mcts_task.sample_value == 'full':
+            if mcts_task.sample_value == 'full' and not mcts_task.budget_exhausted():
                 if mcts_task.use_reflection == 'common':
-                    child.update_reflection(mcts_task.get_reflection(child.y, child.depth + 1))
+                    reflection = mcts_task.get_reflection(child.y, child.depth + 1)
                 else:
-                    child.update_reflection(mcts_task.get_simple_reflection(child.y, child.depth + 1))
+                    reflection = mcts_task.get_simple_reflection(child.y, child.depth + 1)
+                if not deadline.expired():
+                    child.update_reflection(reflection)
             child.visit_sequence = mcts_task.node_count
             mcts_task.update_count()
-    node.isFullyExpanded = True
+    if node.children:
+        node.isFullyExpanded = True
+        if mcts_task.selection == 'puct':
+            set_priors(node, mcts_task)
     return node
 
 
@@ -220,12 +377,42 @@ def back_propagate(node):
         node = node.parent
 
 
+def set_priors(node, mcts_task):
+    # PUCT priors of freshly expanded children: their initial values ('value', shifted by low) or 'uniform',
+    # normalized over the siblings
+    children = list(node.children.values())
+    if mcts_task.prior_source == 'value':
+        weights = [max(0.0, child.V - mcts_task.low) for child in children]
+    else:
+        weights = [1.0] * len(children)
+    total = sum(weights)
+    for child, weight in zip(children, weights):
+        child.prior = weight / total if total > 0 else 1.0 / len(children)
+
+
+def uct_score(node, child, mcts_task):
+    if child.numVisits > 0:
+        return child.V + mcts_task.exploration_constant * math.sqrt(2 * math.log(node.numVisits) / child.numVisits)
+    return child.V + mcts_task.INF
+
+
+def puct_score(node, child, mcts_task):
+    return child.V + mcts_task.puct_constant * child.prior * math.sqrt(max(1, node.numVisits)) / (1 + child.numVisits)
+
+
+def selection_score(node, child, mcts_task):
+    if mcts_task.selection == 'puct':
+        return puct_score(node, child, mcts_task)
+    return uct_score(node, child, mcts_task)
+
+
 def getBestChild(node, mcts_task):
+    if mcts_task.selection == 'puct':
+        return getBestChildPUCT(node, mcts_task)
     bestValue = mcts_task.low
     bestNodes = []
     for child in node.children.values():
-        nodeValue = child.V + mcts_task.exploration_constant * math.sqrt(
-            2 * math.log(node.numVisits) / child.numVisits) if child.numVisits > 0 else child.V + mcts_task.INF
+        nodeValue = uct_score(node, child, mcts_task)
         if nodeValue > bestValue:
             bestValue = nodeValue
             bestNodes = [child]
@@ -234,22 +421,124 @@ def getBestChild(node, mcts_task):
     return random.choice(bestNodes)
 
 
+def getBestChildPUCT(node, mcts_task):
+    # Q + c * P * sqrt(N) / (1 + n): unvisited children are ranked by their initial value and prior instead of
+    # all getting +INF, so low-prior children need not be simulated before the search can tell them apart
+    bestValue = None
+    bestNodes = []
+    for child in node.children.values():
+        nodeValue = puct_score(node, child, mcts_task)
+        if bestValue is None or nodeValue > bestValue:
+            bestValue = nodeValue
+            bestNodes = [child]
+        elif nodeValue == bestValue:
+            bestNodes.append(child)
+    return random.choice(bestNodes)
+
+
+def is_end_leaf(node, mcts_task):
+    # the leaves get_all_end_root_nodes_vm / _prm collect for summaries and samples
+    if node.isFullyExpanded:
+        return False
+    if mcts_task.reward_model_type == 'vm':
+        return node.V >= mcts_task.end_gate or node.reflection == '<end>'
+    return node.reflection == '<end>'
+
+
+def prune_candidates(root, mcts_task):
+    # [(selection score, node)] for expanded subtrees that can be collapsed into their root: the root visited,
+    # not on the path to the best-valued node and, when end leaves are collected for samples, a consensus or
+    # a final vote (sample_value='full', prm, consensus_margin/share, weighted_verify), without an end leaf inside
+    keep_ends = mcts_task.sample_value == 'full' or mcts_task.reward_model_type != 'vm' \
+        or mcts_task.use_consensus() or mcts_task.weighted_verify
+    best_node, _ = root.getBestV()
+    protected = set()
+    while best_node is not None:
+        protected.add(id(best_node))
+        best_node = best_node.parent
+    candidates = []
+
+    def walk(node):
+        has_end = keep_ends and is_end_leaf(node, mcts_task)
+        for child in node.children.values():
+            has_end = walk(child) or has_end
+        if node.parent is not None and node.children and node.numVisits > 0 and not has_end \
+                and id(node) not in protected:
+            candidates.append((selection_score(node.parent, node, mcts_task), node))
+        return has_end
+
+    walk(root)
+    candidates.sort(key=lambda item: item[0])
+    return candidates
+
+
+def collapse(node, mcts_task, spill=None):
+    # drop the subtree below node, which keeps its own statistics and is re-expanded if selected again
+    if spill is not None:
+        spill.write(json.dumps({'question': mcts_task.question, 'steps': node.y, 'subtree': node.to_dict()},
+                               ensure_ascii=False) + '\n')
+    freed = node.subtree_size() - 1
+    node.children = {}
+    node.isFullyExpanded = False
+    return freed
+
+
+def prune_tree(root, mcts_task):
+    # collapse the lowest-scoring subtrees until the live tree fits PRUNE_TARGET of max_nodes, returns nodes freed
+    target = int(mcts_task.max_nodes * PRUNE_TARGET)
+    freed = 0
+    collapsed = set()
+    spill = open(mcts_task.spill_path, 'a', encoding='utf-8') if mcts_task.spill_path else None
+    try:
+        for _, node in prune_candidates(root, mcts_task):
+            if mcts_task.live_node_count() <= target:
+                break
+            ancestor = node.parent
+            while ancestor is not None and id(ancestor) not in collapsed:
+                ancestor = ancestor.parent
+            if ancestor is not None:
+                continue
+            collapsed.add(id(node))
+            count = collapse(node, mcts_task, spill)
+            mcts_task.pruned_count += count
+            freed += count
+    finally:
+        if spill is not None:
+            spill.close()
+    return freed
+
+
+def prune_check(root, mcts_task):
+    if mcts_task.max_nodes is None or mcts_task.live_node_count() <= mcts_task.max_nodes:
+        return
+    with profile_phase(mcts_task, 'pruning'):
+        freed = prune_tree(root, mcts_task)
+    logger.info('Tree over budget, pruned %d nodes, %d live.', freed, mcts_task.live_node_count())
+    if mcts_task.live_node_count() > mcts_task.max_nodes:
+        logger.debug('Could not prune the tree below max_nodes=%d.', mcts_task.max_nodes)
+
+
 def MCTS(mcts_task):
     root, node, finish = MCTS_search(mcts_task)
 
     if mcts_task.sample_value == 'full':
-        print('Sampling completed.\n')
-        return None, -1, root
+        logger.info('Sampling completed.')
+        # node: the consensus winner if the search stopped on one, used as the final answer
+        return node, -1, root
     else:
         if mcts_task.reward_model_type == 'vm':
             if finish is not None:
-                print(f'Final solution found!\nSolution:{node.y}\n')
+                logger.info('Final solution found!\nSolution:%s', node.y)
                 return node, finish, root
 
+            elif node is not None:
+                logger.info('Consensus reached, using the best solution of the agreed answer.\nSolution:%s', node.y)
+                return node, -1, root
+
             else:
                 best_node, best_V = root.getBestV()
-                print(f'No solution with required value found within time/iteration limit, using best value solution instead.\nSolution:{best_node.y}\n')
+                logger.info('No solution with required value found within time/iteration limit, using best value solution instead.\nSolution:%s', best_node.y)
                 return best_node, -1, root
         else:
-            print('Answer selection not supported yet, sampling finished.\n')
+            logger.info('Answer selection not supported yet, sampling finished.')
             return None, -1, root
@@ -0,0 +1,130 @@
+import time
+from contextlib import contextmanager
+from utils import metrics, trace
+
+PHASES = ['selection', 'expansion', 'simulation', 'backpropagation', 'consensus', 'pruning']
+
+
+class SearchHooks(object):
+    # subclass and override any of these to observe a search; all callbacks run synchronously in the search thread
+    def on_search_start(self, mcts_task, root):
+        pass
+
+    def on_round_start(self, round_idx, root):
+        pass
+
+    def on_phase_end(self, round_idx, phase, stats):
+        # stats: {'time', 'llm_calls', 'value_calls', 'cache_hits', 'tokens'}
+        pass
+
+    def on_round_end(self, round_idx, stats):
+        # stats: {'round', 'time', 'phases', 'tree_size', 'tree_depth', 'solved'}
+        pass
+
+    def on_search_end(self, summary):
+        pass
+
+
+class RoundProfiler(object):
+    def __init__(self, mcts_task, hooks=None):
+        self.mcts_task = mcts_task
+        if hooks is None:
+            hooks = []
+        elif not isinstance(hooks, (list, tuple)):
+            hooks = [hooks]
+        self.hooks = list(hooks)
+        self.rounds = []  # per-round stats
+        self.round_idx = 0
+        self.cur_round = None
+        self.round_start = 0.0
+        self.search_start = 0.0
+        self.tree_depth = 0
+        self.summary = None
+
+    def _emit(self, name, *args):
+        for hook in self.hooks:
+            callback = getattr(hook, name, None)
+            if callback is not None:
+                callback(*args)
+
+    def _counts(self, phase):
+        collector = metrics.current()
+        if collector is None:
+            return 0, 0, 0, 0
+        proposal = collector.total(phase=phase, kind='proposal')
+        value = collector.total(phase=phase, kind='value')
+        tokens = proposal.prompt_tokens + proposal.completion_tokens + value.prompt_tokens + value.completion_tokens
+        return proposal.calls, value.calls, proposal.cache_hits + value.cache_hits, tokens
+
+    def start_search(self, root):
+        self.search_start = time.time()
+        self._emit('on_search_start', self.mcts_task, root)
+
+    def start_round(self, root):
+        self.cur_round = {'round': self.round_idx, 'time': 0.0, 'phases': {}, 'tree_size': 0, 'tree_depth': 0,
+                          'solved': False}
+        self.round_start = time.time()
+        self._emit('on_round_start', self.round_idx, root)
+
+    @contextmanager
+    def phase(self, name):
+        before = self._counts(name)
+        start = time.time()
+        with metrics.phase(name), trace.span(name, 'phase', round=self.round_idx):
+            yield
+        after = self._counts(name)
+        stats = {'time': time.time() - start, 'llm_calls': after[0] - before[0], 'value_calls': after[1] - before[1],
+                 'cache_hits': after[2] - before[2], 'tokens': after[3] - before[3]}
+        if self.cur_round is not None:
+            self.cur_round['phases'][name] = stats
+        self._emit('on_phase_end', self.round_idx, name, stats)
+
+    def end_round(self, node, solved):
+        if node is not None:
+            self.tree_depth = max(self.tree_depth, node.depth + (1 if node.children else 0))
+        self.cur_round['time'] = time.time() - self.round_start
+        self.cur_round['tree_size'] = self.mcts_task.node_count
+        self.cur_round['tree_depth'] = self.tree_depth
+        self.cur_round['solved'] = solved
+        trace.counter('tree', size=self.mcts_task.node_count, depth=self.tree_depth)
+        self.rounds.append(self.cur_round)
+        self._emit('on_round_end', self.round_idx, self.cur_round)
+        self.cur_round = None
+        self.round_idx += 1
+
+    def end_search(self):
+        elapsed = time.time() - self.search_start
+        phases = {}
+        for name in PHASES:
+            items = [r['phases'][name] for r in self.rounds if name in r['phases']]
+            phase_time = sum(item['time'] for item in items)
+            llm_calls = sum(item['llm_calls'] for item in items)
+            value_calls = sum(item['value_calls'] for item in items)
+            cache_hits = sum(item['cache_hits'] for item in items)
+            lookups = value_calls + cache_hits
+            phases[name] = {'time': phase_time, 'share': phase_time / elapsed if elapsed > 0 else 0.0,
+                            'runs': len(items), 'llm_calls': llm_calls, 'value_calls': value_calls,
+                            'cache_hits': cache_hits, 'cache_hit_rate': cache_hits / lookups if lookups else 0.0,
+                            'tokens': sum(item['tokens'] for item in items)}
+        self.summary = {
+            'limit_type': self.mcts_task.limit_type,
+            'rounds': len(self.rounds),
+            'elapsed': elapsed,
+            'rounds_per_sec': len(self.rounds) / elapsed if elapsed > 0 else 0.0,
+            'mean_round_time': elapsed / len(self.rounds) if self.rounds else 0.0,
+            'solved_in_round': next((r['round'] for r in self.rounds if r['solved']), None),
+            'tree_size': self.mcts_task.node_count,
+            'tree_depth': self.tree_depth,
+            'hot_phase': max(PHASES, key=lambda p: phases[p]['time']) if self.rounds else None,
+            'phases': phases,
+        }
+        self._emit('on_search_end', self.summary)
+        return self.summary
+
+
+def profile_phase(mcts_task, name):
+    # phase context for executeRound, falls back to plain metrics tagging outside MCTS_search
+    profiler = getattr(mcts_task, 'profiler', None)
+    if profiler is None:
+        return metrics.phase(name)
+    return profiler.phase(name)
@@ -1,21 +1,37 @@
+import logging
 import random
 from tasks.science import SearchTask
 from MCTS.base import treeNode
 from models.get_response import *
+from utils import metrics, deadline
+from utils.deadline import Deadline
+from utils.metrics import MetricsCollector
+from utils.parallel import map_in_context
+from utils.step_normalizer import StepNormalizer, join_reply
 from MCTS.mcts import MCTS
 from utils.verify_MATH import exact_match_score, grade_answer, extract_answer
 from utils.verify_llm import llm_verify
 from utils.solution_summary_extractor import extract_summary_from_solution
 
+logger = logging.getLogger(__name__)
+
 
 class MCTS_Task(SearchTask):
     def __init__(self, data, propose_method='glm', value_method='glm', branch=3, end_gate=0.9, roll_policy='greedy',
                  roll_branch=1, roll_forward_steps=3, time_limit=None, iteration_limit=None, exploration_constant=0.7,
                  alpha=0.5, inf=1.0, temperature=0.7, max_tokens=2048, seed=170, max_length=2048, truncation=True,
                  do_sample=True, max_new_tokens=256, use_case_prompt=False, use_reflection='simple', low=0, high=1,
-                 evaluate='', sample_value='simple', answer=None, verify_method='string', lang='en', weighted_verify=False):
+                 evaluate='', sample_value='simple', answer=None, verify_method='string', lang='en', weighted_verify=False,
+                 hooks=None, profile=False, shared_value_cache=None, on_progress=None,
+                 consensus_margin=None, consensus_share=None, consensus_min_leaves=3, summary_workers=1,
+                 dedup_threshold=None, llm_call_limit=None, token_limit=None, value_call_limit=None,
+                 hard_time_limit=None, selection='uct', prior_source='value', puct_constant=0.5,
+                 max_nodes=None, spill_path=None):
         super().__init__(data, propose_method, value_method)
         assert 0 <= low < high, "Inappropriate value range!"
+        assert selection in ['uct', 'puct'], f"Unsupported selection rule {selection}!"
+        assert prior_source in ['value', 'uniform'], f"Unsupported prior source {prior_source}!"
+        assert max_nodes is None or max_nodes > 1, "max_nodes must leave room for the root and its children!"
         self.mode = 'mcts'
         self.temperature = temperature
         self.max_tokens = max_tokens
@@ -47,25 +63,96 @@ class MCTS_Task(SearchTask):
         self.reward_model_type = 'prm' if USE_PRM else 'vm'
         self.lang = 'en'
         self.weighted_verify = weighted_verify
+        self.metrics = MetricsCollector('MCTS_Task')
+        self.hooks = hooks  # SearchHooks or list of them, see MCTS/profiler.py
+        self.profile = profile
+        self.profiler = None
+        self.shared_value_cache = shared_value_cache  # {y: value} kept across runs, e.g. by the sweep runner
+        self.on_progress = on_progress  # anytime callback, see MCTS_search in MCTS/mcts.py
+        # stop once the V-weighted vote of end leaves settles on one extracted answer (off if both are None)
+        self.consensus_margin = consensus_margin  # min lead of the top answer's weight over the runner-up
+        self.consensus_share = consensus_share  # min share of the total weight held by the top answer
+        self.consensus_min_leaves = consensus_min_leaves
+        self.summary_workers = summary_workers  # end leaves summarized concurrently (safe backends only)
+        self.summary_cache = {}  # {y: summary}
+        self.leaf_answers = {}  # {id(leaf): (leaf, extracted answer)} of the end leaves seen by consensus_reached
+        self.dedup_threshold = dedup_threshold  # drop near-duplicate sibling proposals, see utils/dedup.py
+        self.step_normalizer = StepNormalizer('en')
+        # compute budgets for the whole run (search and summaries), counted by self.metrics; None means no limit
+        self.llm_call_limit = llm_call_limit  # proposal model calls
+        self.token_limit = token_limit  # prompt + completion tokens of all backend calls
+        self.value_call_limit = value_call_limit  # value model calls (cache hits are free)
+        # wall-clock limit of the whole run (ms), search and summaries included; in-flight backend calls get their
+        # timeouts from the time left, see utils/deadline.py
+        self.hard_time_limit = hard_time_limit
+        self.selection = selection  # child selection rule, 'uct' or 'puct', see getBestChild in MCTS/mcts.py
+        self.prior_source = prior_source  # PUCT priors from the children's initial values or uniform
+        self.puct_constant = puct_constant
+        # live tree node budget: over it, low-scoring fully visited subtrees are collapsed after a round and
+        # optionally appended to spill_path (jsonl) first, see prune_tree in MCTS/mcts.py
+        self.max_nodes = max_nodes
+        self.spill_path = spill_path
+        self.pruned_count = 0
 
     def update_count(self):
         self.node_count += 1
 
+    def live_node_count(self):
+        return self.node_count - self.pruned_count
+
     def clear_cache(self):
-        self.value_cache = {}
+        self.value_cache = self.shared_value_cache if self.shared_value_cache is not None else {}
+        self.summary_cache = {}
+        self.leaf_answers = {}
+        self.step_normalizer.reset()
         self.node_count = 1
+        self.pruned_count = 0
+        self.metrics.reset()
 
     def set_limit_type(self):
+        for name, limit in self.budget_limits().items():
+            if limit < 1:
+                raise ValueError(f"{name} limit must be at least one")
         if self.time_limit is not None:
             if self.iteration_limit is not None:
                 raise ValueError("Cannot have both a time limit and an iteration limit")
             self.limit_type = 'time'
-        else:
-            if self.iteration_limit is None:
-                raise ValueError("Must have either a time limit or an iteration limit")
+        elif self.iteration_limit is not None:
             if self.iteration_limit < 1:
                 raise ValueError("Iteration limit must be greater than one")
             self.limit_type = 'iterations'
+        else:
+            if not self.budget_limits() and self.hard_time_limit is None:
+                raise ValueError("Must have either a time limit, an iteration limit or a call/token budget")
+            self.limit_type = 'budget'
+
+    def run_deadline(self):
+        if self.hard_time_limit is None:
+            return None
+        return Deadline.after(self.hard_time_limit / 1000)
+
+    def budget_limits(self):
+        limits = {'llm_calls': self.llm_call_limit, 'tokens': self.token_limit, 'value_calls': self.value_call_limit}
+        return {name: limit for name, limit in limits.items() if limit is not None}
+
+    def budget_usage(self):
+        proposal = self.metrics.total(kind='proposal')
+        value = self.metrics.total(kind='value')
+        tokens = proposal.prompt_tokens + proposal.completion_tokens + value.prompt_tokens + value.completion_tokens
+        return {'llm_calls': proposal.calls, 'tokens': tokens, 'value_calls': value.calls}
+
+    def budget_exhausted(self):
+        # budgets apply on top of the time/iteration limit; calls are only counted while run() is active
+        limits = self.budget_limits()
+        if not limits:
+            return False
+        usage = self.budget_usage()
+        return any(usage[name] >= limit for name, limit in limits.items())
+
+    def attach_profile(self, final_answer):
+        if self.profile and self.profiler is not None:
+            final_answer.update({'profile': self.profiler.summary, 'metrics': self.metrics.report()})
+        return final_answer
 
     def get_next_step(self, y, step_n):
         if self.use_case_prompt:
@@ -82,58 +169,10 @@ class MCTS_Task(SearchTask):
                                 self.max_length,
                                 self.truncation, self.do_sample, self.max_new_tokens)
         if not response:
-            print('Failed to get next step!\n')
+            logger.warning('Failed to get next step!')
             return ''
 
-        if len(response) > 5:
-            response = response[:5]
-
-        p = ''
-        for _ in response:
-            p = p + _ + ' '
-        p = p.strip()
-
-        if "Next step:" in p:
-            stp = p.split('Next step:')[1].strip()
-            if len(stp) < 2:
-                print('Step output too short!\n')
-                return ''
-            if stp in y:
-                print('Step output repeated!\n')
-                return ''
-
-            revised_ = 'Step ' + str(step_n) + ': ' + stp
-            print(f'Normalized new step:{revised_}\n')
-            return revised_ + '\n'
-
-        elif "Step" in p and ":" in p:
-            pre_len = len(p.split(':')[0])
-            p_ = p[pre_len:]
-            p_ = p_.split('Step')[0].strip()
-            if len(p_) < 4:
-                print('Step output too short!\n')
-                return ''
-            p_ = p_[1:].strip()
-            if p_ in y:
-                print('Step output repeated!\n')
-                return ''
-
-            revised_ = 'Step ' + str(step_n) + ': ' + p_
-            print(f'Normalized new step:{revised_}\n')
-            return revised_ + '\n'
-
-        else:
-            p_ = p.strip()
-            if len(p_) < 3:
-                print('Step output too short!\n')
-                return ''
-            if p_ in y:
-                print('Step output repeated!\n')
-                return ''
-
-            revised_ = 'Step ' + str(step_n) + ': ' + p_
-            print(f'Normalized new step:{revised_}\n')
-            return revised_ + '\n'
+        return self.step_normalizer.normalize(response, y, step_n)
 
     def get_next_step_use_reflection(self, y, step_n, reflection):
         if self.propose_method == 'gpt' or self.propose_method == 'local':
@@ -146,49 +185,10 @@ class MCTS_Task(SearchTask):
                                 self.max_length,
                                 self.truncation, self.do_sample, self.max_new_tokens)
         if not response:
-            print('Failed to get next step!\n')
+            logger.warning('Failed to get next step!')
             return ''
 
-        if len(response) > 5:
-            response = response[:5]
-
-        p = ''
-        for _ in response:
-            p = p + _ + ' '
-        p = p.strip()
-
-        if "Next step:" in p:
-            stp = p.split('Next step:')[1].strip()
-            if len(stp) < 2:
-                print('Step output too short!\n')
-                return ''
-            if stp in y:
-                print('Step output repeated!\n')
-                return ''
-
-            revised_ = 'Step ' + str(step_n) + ': ' + stp
-            print(f'Normalized new step:{revised_}\n')
-            return revised_ + '\n'
-
-        elif "Step" in p and ":" in p:
-            pre_len = len(p.split(':')[0])
-            p_ = p[pre_len:]
-            p_ = p_.split('Step')[0].strip()
-            if len(p_) < 4:
-                print('Step output too short!\n')
-                return ''
-            p_ = p_[1:].strip()
-            if p_ in y:
-                print('Step output repeated!\n')
-                return ''
-
-            revised_ = 'Step ' + str(step_n) + ': ' + p_
-            print(f'Normalized new step:{revised_}\n')
-            return revised_ + '\n'
-
-        else:
-            print('Output format error!\n')
-            return ''
+        return self.step_normalizer.normalize(response, y, step_n, allow_plain=False)
 
     def get_simple_reflection(self, y, step_n):
         if step_n == 1:
@@ -201,31 +201,24 @@ class MCTS_Task(SearchTask):
             reflection_prompt = self.single_reflection_wrap_simple_mistral(self.question, y, step_n)
         else:
             reflection_prompt = self.single_reflection_wrap_simple(self.question, y, step_n, self.lang)
-        cnt = 3
-        response = []
-        while not response and cnt:
-            response = get_proposal(reflection_prompt, self.propose_method, self.temperature, self.max_tokens,
-                                    self.seed,
-                                    self.max_length,
-                                    self.truncation, self.do_sample, 128)
-            cnt -= 1
+        response = get_proposal(reflection_prompt, self.propose_method, self.temperature, self.max_tokens,
+                                self.seed,
+                                self.max_length,
+                                self.truncation, self.do_sample, 128)
         if not response:
-            print('Failed to get reflection!\n')
+            logger.warning('Failed to get reflection!')
             return '<end>'
 
-        p = ''
-        for _ in response:
-            p = p + _ + ' '
-        p = p.strip()
+        p = join_reply(response)
 
         if 'unsolved' in p or step_n <= 1:
-            print('Normalized reflection: <continue>\n')
+            logger.debug('Normalized reflection: <continue>')
             return '<continue>'
         elif 'solved' in p:
-            print('Normalized reflection: <end>\n')
+            logger.debug('Normalized reflection: <end>')
             return '<end>'
         else:
-            print('Normalized reflection: <continue>\n')
+            logger.debug('Normalized reflection: <continue>')
             return '<continue>'
 
     def get_reflection(self, y, step_n):
@@ -235,44 +228,39 @@ class MCTS_Task(SearchTask):
 
         reflection_prompt = self.single_reflection_wrap(self.question, y, step_n, self.lang)
 
-        cnt = 3
-        response = []
-        while not response and cnt:
-            response = get_proposal(reflection_prompt, self.propose_method, self.temperature, self.max_tokens,
-                                    self.seed,
-                                    self.max_length,
-                                    self.truncation, self.do_sample, self.max_new_tokens)
-            cnt -= 1
+        response = get_proposal(reflection_prompt, self.propose_method, self.temperature, self.max_tokens,
+                                self.seed,
+                                self.max_length,
+                                self.truncation, self.do_sample, self.max_new_tokens)
         if not response:
-            print('Failed to get reflection!\n')
+            logger.warning('Failed to get reflection!')
             return ''
 
-        p = ''
-        for _ in response:
-            p = p + _ + ' '
-        p = p.strip()
+        p = join_reply(response)
 
         if 'Problem solved' in p:
-            print('Normalized reflection: <end>\n')
+            logger.debug('Normalized reflection: <end>')
             return '<end>'
         else:
             if 'Analysis:' not in p:
-                print('Output format error!\n')
+                logger.info('Output format error!')
                 return ''
             revised_ = p.split('Analysis:')[1].strip()
-            print(f'Normalized reflection:{revised_}\n')
+            logger.debug('Normalized reflection:%s', revised_)
             return revised_
 
     def get_step_value(self, y):
         if y in self.value_cache.keys():
+            metrics.record_cache_hit('value')
             return self.value_cache[y]
 
-        if self.value_method == 'local':
+        if is_direct_value(self.value_method):
             prompt_answer = 'Problem: ' + self.question + '\nSolution:\n' + y
             value = get_value(prompt_answer, self.value_method, self.temperature, self.max_tokens, self.seed,
                               self.max_length, self.low, self.high)
-            print(f'Got value:{value}\n')
-            self.value_cache.update({y: value})
+            logger.debug('Got value:%s', value)
+            if not deadline.expired():
+                self.value_cache.update({y: value})
             return value
 
         else:
@@ -280,8 +268,9 @@ class MCTS_Task(SearchTask):
             response = get_value(prompt, self.value_method, self.temperature, self.max_tokens, self.seed,
                                  self.max_length, self.low, self.high)
             value = self.value_outputs_unwrap(response, self.low, self.high)
-            print(f'Got value:{value}\n')
-            self.value_cache.update({y: value})
+            logger.debug('Got value:%s', value)
+            if not deadline.expired():
+                self.value_cache.update({y: value})
             return value
 
     def get_summary(self, y):
@@ -290,13 +279,13 @@ class MCTS_Task(SearchTask):
                                 self.max_length,
                                 self.truncation, self.do_sample, 128)
         if not response:
-            print('Failed to get summary!\n')
+            logger.warning('Failed to get summary!')
             return ''
         p = ''
         for _ in response:
             p = p + _
         summ = p.strip()
-        print(f'Got summary:{summ}\n')
+        logger.debug('Got summary:%s', summ)
         return summ
 
     def get_MATH_summary(self, y):
@@ -305,14 +294,14 @@ class MCTS_Task(SearchTask):
                                 self.max_length,
                                 self.truncation, self.do_sample, 128)
         if not response:
-            print('Failed to get summary!\n')
+            logger.warning('Failed to get summary!')
             return ''
         p = ''
         for _ in response:
             p = p + _ + ' '
         p = p.strip()
 
-        print(f'Got summary:{p}\n')
+        logger.debug('Got summary:%s', p)
         return p
 
     def verify_end_nodes(self, root):
@@ -321,24 +310,10 @@ class MCTS_Task(SearchTask):
         else:
             end_leaf_nodes = root.get_all_end_root_nodes_prm()
         flag = False
+        self.summarize_leaves(end_leaf_nodes)
         for leaf in end_leaf_nodes:
             leaf.on_final_route = True
-            cnt = 5
-            summ = ''
-            while cnt:
-                if self.verify_method == 'string':
-                    summ = self.get_MATH_summary(leaf.y)
-                else:
-                    summ = self.get_summary(leaf.y)
-                if summ:
-                    leaf.summary = summ
-                    break
-                else:
-                    cnt -= 1
-            if not summ:
-                summ = extract_summary_from_solution(leaf.y)
-                leaf.summary = summ
-
+            summ = leaf.summary
             if self.verify_method == 'string':
                 result = exact_match_score(summ, self.answer)
             else:
@@ -351,6 +326,81 @@ class MCTS_Task(SearchTask):
                 flag = True
         return flag, end_leaf_nodes
 
+    def summarize_solution(self, y):
+        # summary of a solution path, computed once per run and cached by path
+        if y in self.summary_cache:
+            return self.summary_cache[y]
+        cnt = 5
+        summ = ''
+        if self.budget_exhausted() or deadline.expired():
+            logger.debug('Budget exhausted or deadline passed, extracting summary without the model.')
+            cnt = 0
+        while cnt and not deadline.expired():
+            if self.verify_method == 'string':
+                summ = self.get_MATH_summary(y)
+            else:
+                summ = self.get_summary(y)
+            if summ:
+                break
+            else:
+                cnt -= 1
+        if not summ:
+            summ = extract_summary_from_solution(y)
+        self.summary_cache[y] = summ
+        return summ
+
+    def summarize_leaf(self, leaf):
+        # summary of an end leaf, kept on the node
+        if not leaf.summary:
+            leaf.summary = self.summarize_solution(leaf.y)
+        return leaf.summary
+
+    def summarize_leaves(self, leaves):
+        # summarize all leaves without a summary concurrently (each distinct path once)
+        pending = list(dict.fromkeys(leaf.y for leaf in leaves if not leaf.summary and leaf.y not in self.summary_cache))
+        workers = self.summary_workers if allows_concurrency(self.propose_method) else 1
+        map_in_context(self.summarize_solution, pending, workers)
+        for leaf in leaves:
+            self.summarize_leaf(leaf)
+
+    def use_consensus(self):
+        return self.consensus_margin is not None or self.consensus_share is not None
+
+    def consensus_reached(self, root):
+        # called after every search round, returns the best end leaf of the winning answer or None;
+        # only leaves not seen in an earlier round are summarized, votes are re-weighted with the current V.
+        # leaves without an extractable answer do not vote and do not count towards consensus_min_leaves
+        if self.reward_model_type == 'vm':
+            end_leaf_nodes = root.get_all_end_root_nodes_vm(self.end_gate)
+        else:
+            end_leaf_nodes = root.get_all_end_root_nodes_prm()
+        if len(end_leaf_nodes) < self.consensus_min_leaves:
+            return None
+        new_leaves = [leaf for leaf in end_leaf_nodes if id(leaf) not in self.leaf_answers]
+        self.summarize_leaves(new_leaves)
+        for leaf in new_leaves:
+            # the leaf is kept in the entry so its id is not reused
+            self.leaf_answers[id(leaf)] = (leaf, extract_answer(self.summarize_leaf(leaf)))
+        voters = [leaf for leaf in end_leaf_nodes if self.leaf_answers[id(leaf)][1]]
+        if len(voters) < self.consensus_min_leaves:
+            return None
+        votes = {}
+        best_leaves = {}  # {answer: its highest-valued leaf}
+        for leaf in voters:
+            answer = self.leaf_answers[id(leaf)][1]
+            votes[answer] = votes.get(answer, 0) + leaf.V
+            if answer not in best_leaves or leaf.V > best_leaves[answer].V:
+                best_leaves[answer] = leaf
+        ranked = sorted(votes.items(), key=lambda item: item[1], reverse=True)
+        winner, top = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else 0
+        total = sum(votes.values())
+        if self.consensus_margin is not None and top - second >= self.consensus_margin:
+            return best_leaves[winner]
+        if self.consensus_share is not None and total > 0 and top / total >= self.consensus_share:
+            return best_leaves[winner]
+        return None
+
     def get_final_solution(self, root, weighted):
         if self.reward_model_type == 'vm':
             end_leaf_nodes = root.get_all_end_root_nodes_vm(self.end_gate)
@@ -364,42 +414,14 @@ class MCTS_Task(SearchTask):
                 sorted_nodes = sorted(end_leaf_nodes, key=lambda x: x.V, reverse=True)
                 best_node = sorted_nodes[0]
             solution = best_node.y
-            cnt = 5
-            summ = ''
-            while cnt:
-                if self.verify_method == 'string':
-                    summ = self.get_MATH_summary(solution)
-                else:
-                    summ = self.get_summary(solution)
-                if summ:
-                    best_node.summary = summ
-                    break
-                else:
-                    cnt -= 1
-            if not summ:
-                summ = extract_summary_from_solution(solution)
-                best_node.summary = summ
+            summ = self.summarize_leaf(best_node)
             return solution, summ
 
         else:
             all_answers = {}  # {answer: [solution, summ, value]}
+            self.summarize_leaves(end_leaf_nodes)
             for leaf in end_leaf_nodes:
-                cnt = 5
-                summ = ''
-                while cnt:
-                    if self.verify_method == 'string':
-                        summ = self.get_MATH_summary(leaf.y)
-                    else:
-                        summ = self.get_summary(leaf.y)
-                    if summ:
-                        leaf.summary = summ
-                        break
-                    else:
-                        cnt -= 1
-                if not summ:
-                    summ = extract_summary_from_solution(leaf.y)
-                    leaf.summary = summ
-
+                summ = self.summarize_leaf(leaf)
                 extracted_answer = extract_answer(summ)
                 if extracted_answer in all_answers.keys():
                     all_answers[extracted_answer][2] += leaf.V
@@ -411,16 +433,22 @@ class MCTS_Task(SearchTask):
             summ = best_answer[1]
             return solution, summ
 
+    @metrics.collect
+    @deadline.bounded
     def run(self):
         self.clear_cache()
         self.set_limit_type()
         node, finish, root = MCTS(self)
+        metrics.set_phase('summary')
         # vm
         if self.reward_model_type == 'vm':
             if self.sample_value != 'full':
                 if self.evaluate == 'scibench':
                     solution = node.y
-                    summary = self.get_summary(solution)
+                    if self.budget_exhausted() or deadline.expired():
+                        summary = extract_summary_from_solution(solution)
+                    else:
+                        summary = self.get_summary(solution)
                     final_answer = {'content': self.question, 'solution': solution, 'summary': summary,
                                     'finish': finish}
                     if self.sample_value == 'simple':
@@ -429,27 +457,11 @@ class MCTS_Task(SearchTask):
                         final_answer.update({'value_samples': new_value_samples})
                 else:
                     solution = node.y
-                    cnt = 5
-                    summ = ''
-                    while cnt:
-                        if self.verify_method == 'string':
-                            summ = self.get_MATH_summary(solution)
-                        else:
-                            summ = self.get_summary(solution)
-                        if summ:
-                            node.summary = summ
-                            break
-                        else:
-                            cnt -= 1
-
-                    if not summ:
-                        summ = extract_summary_from_solution(solution)
-                        node.summary = summ
-
+                    summ = self.summarize_leaf(node)
                     result = exact_match_score(summ, self.answer)
                     final_answer = {'content': self.question, 'solution': solution, 'summary': summ, 'finish': finish,
                                     'accurate': result, 'real_answer': self.answer}
-                return final_answer, root
+                return self.attach_profile(final_answer), root
             else:
                 if not self.evaluate:
                     assert self.answer is not None, 'Answer is None!\n'
@@ -469,17 +481,21 @@ class MCTS_Task(SearchTask):
                         new_value_samples = []
                     final_answer = {'content': self.question, 'policy_samples': new_policy_samples,
                                     'value_samples': new_value_samples, 'real_answer': self.answer}
-                    return final_answer, root
+                    return self.attach_profile(final_answer), root
                 else:
                     assert self.answer is not None, 'Answer is None!\n'
-                    solution, summ = self.get_final_solution(root, self.weighted_verify)
+                    if node is not None:
+                        # the search stopped on a consensus, node is the best leaf of the agreed answer
+                        solution, summ = node.y, self.summarize_leaf(node)
+                    else:
+                        solution, summ = self.get_final_solution(root, self.weighted_verify)
                     if not summ:
                         result = False
                     else:
                         result = exact_match_score(summ, self.answer)
                     final_answer = {'content': self.question, 'solution': solution, 'summary': summ, 'finish': finish,
                                     'accurate': result, 'real_answer': self.answer}
-                    return final_answer, root
+                    return self.attach_profile(final_answer), root
 
         else:
             assert self.sample_value, 'Only sampling is supported for prm!\n'
@@ -500,4 +516,4 @@ class MCTS_Task(SearchTask):
                 new_value_samples = []
             final_answer = {'content': self.question, 'policy_samples': new_policy_samples,
                             'value_samples': new_value_samples, 'real_answer': self.answer}
-            return final_answer, root
+            return self.attach_profile(final_answer), root
@@ -29,16 +29,7 @@ class Node(object):
         self.V = value
 
     def getBestV(self):  # Gets the subtree maximum value node
-        if not self.children:
-            return self, self.V
-        max_V = self.V
-        max_node = self
-        for child in self.children:
-            subNode, subValue = child.getBestV()
-            if subValue >= max_V:
-                max_V = subValue
-                max_node = subNode
-        return max_node, max_V
+        return best_in_subtree(self)
 
     def get_multiply_value(self):
         if self.depth == 0:
@@ -51,6 +42,71 @@ class Node(object):
         return multi_value
 
 
+class CompactNode(object):
+    # drop-in for Node in large trees (ToT_Task(compact_nodes=True)): no per-node copy of the path text,
+    # y is rebuilt from the pcds on the path when read (O(depth), the engines read it once per expansion);
+    # the running path product of V makes get_multiply_value O(1), V is expected to be set once per node
+    # as in the ToT engines
+    __slots__ = ('pcd', 'children', 'V', 'parent', 'depth', 'visit_sequence', 'final_ans_flag', 'path_product')
+
+    def __init__(self, pcd: str, parent=None, depth=0):
+        self.pcd = pcd
+        self.children = []
+        self.V = 0
+        self.parent = parent
+        self.depth = depth
+        self.visit_sequence = 0
+        self.final_ans_flag = 0
+        self.path_product = 0  # product of V over the path without the root
+
+    @property
+    def y(self):
+        parts = []
+        node = self
+        while node is not None:
+            parts.append(node.pcd)
+            node = node.parent
+        return ''.join(reversed(parts))
+
+    def append_children(self, new_pcd: str):
+        node = CompactNode(new_pcd, self, self.depth + 1)
+        self.children.append(node)
+        return self, node
+
+    def update_y_from_parent(self):
+        pass
+
+    def update_value(self, value):
+        self.V = value
+        if self.depth > 0:
+            self.path_product = value * (self.parent.path_product if self.parent.depth > 0 else 1)
+
+    def getBestV(self):
+        return best_in_subtree(self)
+
+    def get_multiply_value(self):
+        return self.path_product
+
+
+def best_in_subtree(node):
+    # pre-order walk with an explicit stack, deep trees are not bound by the recursion limit;
+    # ties go to the later node in pre-order, as with the former recursive getBestV
+    max_node = node
+    stack = [node]
+    while stack:
+        cur = stack.pop()
+        if cur.V >= max_node.V:
+            max_node = cur
+        stack.extend(reversed(cur.children))
+    return max_node, max_node.V
+
+
+def make_root(tot_task):
+    if getattr(tot_task, 'compact_nodes', False):
+        return CompactNode('')
+    return Node('')
+
+
 class SolutionStep(object):
     def __init__(self, x, stp, all_steps, score, step_num):
         self.x = x
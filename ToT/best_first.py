@@ -0,0 +1,63 @@
+import heapq
+import logging
+from ToT.base import make_root
+from ToT.dfs import propose_candidates
+from utils import trace
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ['value', 'multiply']
+
+
+def priority(tot_task, node):
+    # 'value': the node's own V, 'multiply': product of V along the path (get_multiply_value)
+    if tot_task.priority == 'multiply':
+        return node.get_multiply_value()
+    return node.V
+
+
+def budget_exhausted(tot_task, pending=0):
+    # pending: children proposed in the current expansion but not in the tree yet
+    if tot_task.node_budget is not None and tot_task.node_count + pending >= tot_task.node_budget:
+        return 'Node budget exhausted!'
+    if tot_task.call_budget is not None and tot_task.call_count >= tot_task.call_budget:
+        return 'LLM call budget exhausted!'
+    return None
+
+
+def budget_left(tot_task):
+    reason = budget_exhausted(tot_task)
+    if reason is not None:
+        logger.info(reason)
+        return False
+    return True
+
+
+@trace.traced('best_first', 'tot')
+def best_first(tot_task):
+    # global priority queue over the frontier of the whole tree: always expand the most promising node
+    assert tot_task.priority in PRIORITIES, f"Unsupported priority {tot_task.priority}!"
+    root = make_root(tot_task)
+    frontier = [(0, 0, root)]  # (-priority, insertion order, node)
+    pushed = 1
+    while frontier and budget_left(tot_task):
+        _, _, node = heapq.heappop(frontier)
+        if node.depth >= tot_task.max_depth:
+            continue
+        proposals = propose_candidates(tot_task, node, lambda pending: budget_exhausted(tot_task, pending) is None)
+        for new_pcd, value in proposals:
+            node, child = node.append_children(new_pcd)
+            child.update_value(value)
+            child.visit_sequence = tot_task.node_count
+            tot_task.update_count()
+            if child.V >= tot_task.end_gate:
+                logger.info('The final solution has been found!\nSolution:%s', child.y)
+                child.final_ans_flag = 1
+                return child.y, root, child
+            heapq.heappush(frontier, (-priority(tot_task, child), pushed, child))
+            pushed += 1
+
+    max_node, max_V = root.getBestV()
+    max_node.final_ans_flag = 1
+    logger.info('If no solution satisfying the required value is found, the highest value value solution is used instead.\nSolution:%s', max_node.y)
+    return max_node.y, root, max_node
@@ -1,50 +1,109 @@
-from ToT.base import Node, rand_select
+import heapq
+import logging
+from ToT.base import make_root, rand_select
+from utils import trace
+from utils.parallel import map_in_context
+from utils.dedup import step_filter
 
+logger = logging.getLogger(__name__)
 
+
+def propose_step(tot_task, node, y):
+    # y: node.y, read once by the caller (O(depth) on compact nodes)
+    new_pcd = ''
+    cnt = 3
+    while not new_pcd and cnt:
+        new_pcd = tot_task.get_next_step(y, node.depth + 1)
+        cnt -= 1
+    return new_pcd
+
+
+def add_child(tot_task, node, new_pcd):
+    node, child = node.append_children(new_pcd)
+    child.visit_sequence = tot_task.node_count
+    tot_task.update_count()
+    return child
+
+
+def expand_node_by_node(tot_task, cur_nodes):
+    candidates = []
+    for node in cur_nodes:
+        y = node.y
+        dedup = step_filter(tot_task, [child.pcd for child in node.children])
+        for i in range(tot_task.branch):
+            new_pcd = propose_step(tot_task, node, y)
+            if not new_pcd:
+                continue
+            if dedup is not None and not dedup.add(new_pcd):
+                logger.debug('Near-duplicate proposal dropped.')
+                continue
+            child = add_child(tot_task, node, new_pcd)
+            child.update_value(tot_task.get_step_value(y + new_pcd))
+            candidates.append(child)
+    return candidates
+
+
+def expand_frontier(tot_task, cur_nodes):
+    # whole level at once: all len(cur_nodes) * branch proposals concurrently, then all new values concurrently
+    paths = {id(node): node.y for node in cur_nodes}
+    jobs = [node for node in cur_nodes for i in range(tot_task.branch)]
+    proposals = map_in_context(lambda node: propose_step(tot_task, node, paths[id(node)]), jobs,
+                               tot_task.max_workers)
+    filters = {}  # {id(node): filter over its proposals}
+    candidates = []  # [(child, child.y)]
+    for node, new_pcd in zip(jobs, proposals):
+        if not new_pcd:
+            continue
+        if id(node) not in filters:
+            filters[id(node)] = step_filter(tot_task, [child.pcd for child in node.children])
+        dedup = filters[id(node)]
+        if dedup is not None and not dedup.add(new_pcd):
+            logger.debug('Near-duplicate proposal dropped.')
+            continue
+        candidates.append((add_child(tot_task, node, new_pcd), paths[id(node)] + new_pcd))
+    ys = list(dict.fromkeys(y for _, y in candidates))
+    values = dict(zip(ys, map_in_context(tot_task.get_step_value, ys, tot_task.max_workers)))
+    for child, y in candidates:
+        child.update_value(values[y])
+    return [child for child, _ in candidates]
+
+
+@trace.traced('BFS', 'tot')
 def BFS(tot_task):
-    root = Node('')
+    root = make_root(tot_task)
     cur_nodes = [root]
     for depth in range(tot_task.max_depth):
-        candidates = []
-        for node in cur_nodes:
-            for i in range(tot_task.branch):
-                new_pcd = ''
-                cnt = 3
-                while not new_pcd and cnt:
-                    new_pcd = tot_task.get_next_step(node.y, node.depth + 1)
-                    cnt -= 1
-                if not new_pcd:
-                    continue
-
-                node, child = node.append_children(new_pcd)
-                value = tot_task.get_step_value(child.y)
-                child.update_value(value)
-                child.visit_sequence = tot_task.node_count
-                tot_task.update_count()
-                candidates.append(child)
-
-        if not candidates:
-            break
-        ranked_candidates = sorted(candidates, key=lambda item: item.V, reverse=True)
-        if ranked_candidates[0].V >= tot_task.end_gate:
-            print('The final solution has been found!\n')
-            ranked_candidates[0].final_ans_flag = 1
-            return ranked_candidates[0].y, root, ranked_candidates[0]
-
-        if tot_task.select_method == 'greedy':
-            cur_nodes = ranked_candidates[:min(tot_task.select_branch, tot_task.branch, len(ranked_candidates))]
-
-        else:
-            idx_list = []
-            cur_nodes = []
-            for j in range(min(tot_task.select_branch, tot_task.branch)):
-                idx, node = rand_select(ranked_candidates, [item.V for item in ranked_candidates])
-                if idx not in idx_list:
-                    idx_list.append(idx)
-                    cur_nodes.append(node)
-            cur_nodes = sorted(cur_nodes, key=lambda item: item.V, reverse=True)
-
-    print('If no solution satisfying the required value is found, the highest value value solution is used instead.\n')
+        with trace.span('bfs_level', 'tot', depth=depth, frontier=len(cur_nodes)):
+            if tot_task.batch_frontier:
+                candidates = expand_frontier(tot_task, cur_nodes)
+            else:
+                candidates = expand_node_by_node(tot_task, cur_nodes)
+
+            if not candidates:
+                break
+            best = max(candidates, key=lambda item: item.V)
+            if best.V >= tot_task.end_gate:
+                logger.info('The final solution has been found!')
+                best.final_ans_flag = 1
+                return best.y, root, best
+
+            if tot_task.select_method == 'greedy':
+                # top-k by V without sorting the whole level
+                cur_nodes = heapq.nlargest(min(tot_task.select_branch, tot_task.branch), candidates,
+                                           key=lambda item: item.V)
+
+            else:
+                ranked_candidates = sorted(candidates, key=lambda item: item.V, reverse=True)
+                idx_list = []
+                cur_nodes = []
+                for j in range(min(tot_task.select_branch, tot_task.branch)):
+                    idx, node = rand_select(ranked_candidates, [item.V for item in ranked_candidates])
+                    if idx not in idx_list:
+                        idx_list.append(idx)
+                        cur_nodes.append(node)
+                cur_nodes = sorted(cur_nodes, key=lambda item: item.V, reverse=True)
+
+    logger.info('If no solution satisfying the required value is found, the highest value value solution is used instead.')
     max_node, max_V = root.getBestV()
     max_node.final_ans_flag = 1
     return max_node.y, root, max_node
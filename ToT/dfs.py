@@ -1,30 +1,128 @@
-from ToT.base import Node, rand_select
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ToT.base import make_root, rand_select
+from utils import trace
+from utils.parallel import submit_in_context
+from utils.dedup import step_filter
 
+logger = logging.getLogger(__name__)
 
+
+def select_children(tot_task, ranked_candidates):
+    if tot_task.select_method == 'greedy':
+        return ranked_candidates[:min(tot_task.select_branch, tot_task.branch, len(ranked_candidates))]
+
+    idx_list = []
+    selected = []
+    for j in range(min(tot_task.select_branch, tot_task.branch)):
+        idx, child = rand_select(ranked_candidates, [item.V for item in ranked_candidates])
+        if idx not in idx_list:
+            idx_list.append(idx)
+            selected.append(child)
+    return sorted(selected, key=lambda item: item.V, reverse=True)
+
+
+def propose_candidates(tot_task, node, can_call=None):
+    # up to branch next steps of node with their values, [(new_pcd, value)]; safe to run in a prefetch thread
+    # can_call(pending): checked before every model call with the number of proposals so far, the expansion
+    # stops once it returns False
+    proposals = []
+    y = node.y
+    dedup = step_filter(tot_task)
+    for i in range(tot_task.branch):
+        new_pcd = ''
+        cnt = 3
+        while not new_pcd and cnt:
+            if can_call is not None and not can_call(len(proposals)):
+                return proposals
+            new_pcd = tot_task.get_next_step(y, node.depth + 1)
+            cnt -= 1
+        if not new_pcd:
+            continue
+        if dedup is not None and not dedup.add(new_pcd):
+            logger.debug('Near-duplicate proposal dropped.')
+            continue
+        if can_call is not None and not can_call(len(proposals)):
+            return proposals
+        proposals.append((new_pcd, tot_task.get_step_value(y + new_pcd)))
+    return proposals
+
+
+@trace.traced('DFS_iterative', 'tot')
+def DFS_iterative(tot_task):
+    # same visiting order as DFS_sub with an explicit stack, so max_depth is not bound by the recursion limit.
+    # with tot_task.prefetch = k > 0, the k siblings explored next after the current subtree are expanded
+    # speculatively in background threads, so backtracking finds their children ready
+    root = make_root(tot_task)
+    stack = [root]
+    prefetched = {}  # {node: Future of propose_candidates(node)}
+    pool = ThreadPoolExecutor(max_workers=tot_task.prefetch) if tot_task.prefetch > 0 else None
+    try:
+        while stack:
+            node = stack.pop()
+            if node.depth >= tot_task.max_depth:
+                logger.info('Maximum depth limit reached!')
+                continue
+            future = prefetched.pop(node, None)
+            proposals = future.result() if future is not None else propose_candidates(tot_task, node)
+
+            candidates = []
+            for new_pcd, value in proposals:
+                node, child = node.append_children(new_pcd)
+                child.update_value(value)
+                child.visit_sequence = tot_task.node_count
+                tot_task.update_count()
+                candidates.append(child)
+            if not candidates:
+                logger.info('No suitable next step was found!')
+                continue
+            ranked_candidates = sorted(candidates, key=lambda item: item.V, reverse=True)
+            if ranked_candidates[0].V >= tot_task.end_gate:
+                ranked_candidates[0].final_ans_flag = 1
+                return ranked_candidates[0].y, root, ranked_candidates[0]
+
+            stack.extend(reversed(select_children(tot_task, ranked_candidates)))
+            if pool is not None:
+                # the top of the stack is expanded right away, prefetch the entries just below it
+                for sibling in reversed(stack[-1 - tot_task.prefetch:-1]):
+                    if sibling not in prefetched and sibling.depth < tot_task.max_depth:
+                        prefetched[sibling] = submit_in_context(pool, propose_candidates, tot_task, sibling)
+        return "", root, None
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+@trace.traced('DFS_sub', 'tot')
 def DFS_sub(tot_task, node):
     if node.depth >= tot_task.max_depth:
-        print('Maximum depth limit reached!\n')
+        logger.info('Maximum depth limit reached!')
         return "", node, None
 
     candidates = []
+    y = node.y
+    dedup = step_filter(tot_task)
     for i in range(tot_task.branch):
         new_pcd = ''
         cnt = 3
         while not new_pcd and cnt:
-            new_pcd = tot_task.get_next_step(node.y, node.depth + 1)
+            new_pcd = tot_task.get_next_step(y, node.depth + 1)
             cnt -= 1
         if not new_pcd:
             continue
+        if dedup is not None and not dedup.add(new_pcd):
+            logger.debug('Near-duplicate proposal dropped.')
+            continue
 
         node, child = node.append_children(new_pcd)
-        value = tot_task.get_step_value(child.y)
+        value = tot_task.get_step_value(y + new_pcd)
         child.update_value(value)
         child.visit_sequence = tot_task.node_count
         tot_task.update_count()
         candidates.append(child)
 
     if not candidates:
-        print('No suitable next step was found!\n')
+        logger.info('No suitable next step was found!')
         return "", node, None
     ranked_candidates = sorted(candidates, key=lambda item: item.V, reverse=True)
     if ranked_candidates[0].V >= tot_task.end_gate:
@@ -32,19 +130,7 @@ def DFS_sub(tot_task, node):
         return ranked_candidates[0].y, node, ranked_candidates[0]
 
     # Further probe
-    if tot_task.select_method == 'greedy':
-        selected = ranked_candidates[:min(tot_task.select_branch, tot_task.branch, len(ranked_candidates))]
-
-    else:
-        idx_list = []
-        selected = []
-        for j in range(min(tot_task.select_branch, tot_task.branch)):
-            idx, node = rand_select(ranked_candidates, [item.V for item in ranked_candidates])
-            if idx not in idx_list:
-                idx_list.append(idx)
-                selected.append(node)
-        selected = sorted(selected, key=lambda item: item.V, reverse=True)
-
+    selected = select_children(tot_task, ranked_candidates)
     for child in selected:
         solution, child, final_node = DFS_sub(tot_task, child)
         if solution:
@@ -53,14 +139,18 @@ def DFS_sub(tot_task, node):
     return "", node, None
 
 
+@trace.traced('DFS', 'tot')
 def DFS(tot_task):
-    root = Node('')
-    solution, root, final_node = DFS_sub(tot_task, root)
+    if tot_task.dfs_iterative or tot_task.prefetch > 0:
+        solution, root, final_node = DFS_iterative(tot_task)
+    else:
+        root = make_root(tot_task)
+        solution, root, final_node = DFS_sub(tot_task, root)
     if solution:
-        print(f'The final solution has been found!\nSolution:{solution}\n')
+        logger.info('The final solution has been found!\nSolution:%s', solution)
         return solution, root, final_node
     else:
         max_node, max_V = root.getBestV()
         max_node.final_ans_flag = 1
-        print(f'If no solution satisfying the required value is found, the highest value value solution is used instead.\nSolution:{max_node.y}\n')
+        logger.info('If no solution satisfying the required value is found, the highest value value solution is used instead.\nSolution:%s', max_node.y)
         return max_node.y, root, max_node
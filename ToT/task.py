@@ -1,11 +1,18 @@
+import logging
 import random
 from tasks.science import SearchTask
 from ToT.base import Node
 from models.get_response import *
+from utils import metrics
+from utils.metrics import MetricsCollector
 from ToT.bfs import BFS
 from ToT.dfs import DFS
+from ToT.best_first import best_first
 from utils.solution_summary_extractor import extract_summary_from_solution
 from utils.verify_MATH import exact_match_score
+from utils.step_normalizer import StepNormalizer
+
+logger = logging.getLogger(__name__)
 
 
 class ToT_Task(SearchTask):
@@ -13,7 +20,10 @@ class ToT_Task(SearchTask):
                  max_depth=8, end_gate=0.9, select_method='greedy',
                  temperature=0.7, max_tokens=2048,
                  seed=170, max_length=2048, truncation=True,
-                 do_sample=True, max_new_tokens=256, use_case_prompt=False, low=0, high=1, evaluate='', multiply_value=False, lang='zh', answer=None, verify_method='string'):
+                 do_sample=True, max_new_tokens=256, use_case_prompt=False, low=0, high=1, evaluate='', multiply_value=False, lang='zh', answer=None, verify_method='string',
+                 batch_frontier=False, max_workers=8, dfs_iterative=False, prefetch=0, priority='value',
+                 node_budget=None, call_budget=None, compact_nodes=False,
+                 dedup_threshold=None):
         super().__init__(data, propose_method, value_method)
         assert 0 <= low < high, "Inappropriate value range!"
         self.mode = 'tot'
@@ -35,17 +45,32 @@ class ToT_Task(SearchTask):
         self.select_method = select_method
         self.end_gate = end_gate
         self.node_count = 1
+        self.call_count = 0  # model calls of this task's search, cache hits excluded (best_first call_budget)
         self.multiply_value = multiply_value
         self.lang = lang
         self.answer = answer
         self.verify_method = verify_method
+        self.metrics = MetricsCollector('ToT_Task')
+        self.batch_frontier = batch_frontier  # bfs: propose and value a whole level concurrently
+        self.max_workers = max_workers  # concurrent model calls of a batched level
+        self.dfs_iterative = dfs_iterative  # dfs: explicit-stack engine instead of recursion
+        self.prefetch = prefetch  # dfs: siblings expanded speculatively in the background (implies dfs_iterative)
+        self.priority = priority  # best_first: 'value' or 'multiply' (path product of V)
+        self.node_budget = node_budget  # best_first: stop after this many nodes
+        self.call_budget = call_budget  # best_first: stop after this many model calls (call_count)
+        self.compact_nodes = compact_nodes  # build the tree from ToT.base.CompactNode
+        self.dedup_threshold = dedup_threshold  # drop near-duplicate sibling proposals, see utils/dedup.py
+        self.step_normalizer = StepNormalizer(lang)
 
     def update_count(self):
         self.node_count += 1
 
     def clear_cache(self):
         self.value_cache = {}
+        self.step_normalizer.reset()
         self.node_count = 1
+        self.call_count = 0
+        self.metrics.reset()
 
     def get_next_step(self, y, step_n):
         if self.use_case_prompt:
@@ -53,118 +78,41 @@ class ToT_Task(SearchTask):
         else:
             prompt = self.zero_single_propose_wrap(self.question, y, step_n, self.lang)
 
+        self.call_count += 1
         response = get_proposal(prompt, self.propose_method, self.temperature, self.max_tokens, self.seed,
                                 self.max_length,
                                 self.truncation, self.do_sample, self.max_new_tokens)
         if not response:
-            print('Failed to get next step！\n')
+            logger.warning('Failed to get next step！')
             return ''
 
-        if len(response) > 5:
-            response = response[:5]
-
-        p = ''
-        for _ in response:
-            p = p + _ + ' '
-        p = p.strip()
-
-        if self.lang == 'zh':
-            if '下一步:' in p:
-                stp = p.split('下一步:')[1].strip()
-                if len(stp) < 2:
-                    print('The output step is too short!\n')
-                    return ''
-                if stp in y:
-                    print('Output step repeat!\n')
-                    return ''
-
-                revised_ = '步骤' + str(step_n) + ':' + stp
-                print(f'New steps after standardization:{revised_}\n')
-                return revised_ + '\n'
-
-            elif '步骤' in p and ':' in p:
-                pre_len = len(p.split(':')[0])
-                p_ = p[pre_len:]
-                p_ = p_.split('步骤')[0].strip()
-                if len(p_) < 3:
-                    print('The output step is too short！\n')
-                    return ''
-                if p_[1:] in y:
-                    print('Output step repeat!\n')
-                    return ''
-
-                revised_ = '步骤' + str(step_n) + p_
-                print(f'New steps after standardization:{revised_}\n')
-                return revised_ + '\n'
-
-            else:
-                print('Incorrect output format!\n')
-                return ''
-        else:
-            if "Next step:" in p:
-                stp = p.split('Next step:')[1].strip()
-                if len(stp) < 2:
-                    print('The output step is too short！\n')
-                    return ''
-                if stp in y:
-                    print('Output step repeat!\n')
-                    return ''
-
-                revised_ = 'Step ' + str(step_n) + ': ' + stp
-                print(f'New steps after standardization:{revised_}\n')
-                return revised_ + '\n'
-
-            elif "Step" in p and ":" in p:
-                pre_len = len(p.split(':')[0])
-                p_ = p[pre_len:]
-                p_ = p_.split('Step')[0].strip()
-                if len(p_) < 4:
-                    print('The output step is too short！\n')
-                    return ''
-                p_ = p_[1:].strip()
-                if p_ in y:
-                    print('Output step repeat!\n')
-                    return ''
-
-                revised_ = 'Step ' + str(step_n) + ': ' + p_
-                print(f'New steps after standardization:{revised_}\n')
-                return revised_ + '\n'
-
-            else:
-                p_ = p.strip()
-                if len(p_) < 3:
-                    print('The output step is too short！\n')
-                    return ''
-                if p_ in y:
-                    print('Output step repeat!\n')
-                    return ''
-
-                revised_ = 'Step ' + str(step_n) + ': ' + p_
-                print(f'New steps after standardization:{revised_}\n')
-                return revised_ + '\n'
+        return self.step_normalizer.normalize(response, y, step_n, allow_plain=self.lang == 'en')
 
     def get_step_value(self, y):
         if y in self.value_cache.keys():
+            metrics.record_cache_hit('value')
             return self.value_cache[y]
 
-        if self.value_method == 'local':
+        if is_direct_value(self.value_method):
             if self.lang == 'zh':
                 prompt_answer = '问题:' + self.question + '\n步骤:\n' + '【答案】' + y
             else:
                 prompt_answer = 'Problem: ' + self.question + '\nSolution:\n' + y
 
+            self.call_count += 1
             value = get_value(prompt_answer, self.value_method, self.temperature, self.max_tokens, self.seed,
                               self.max_length, self.low, self.high)
-            print(f'Get a score:{value}\n')
+            logger.debug('Get a score:%s', value)
             self.value_cache.update({y: value})
             return value
 
         else:
             prompt = self.value_prompt_wrap(self.question, y)
+            self.call_count += 1
             response = get_value(prompt, self.value_method, self.temperature, self.max_tokens, self.seed,
                                  self.max_length, self.low, self.high)
             value = self.value_outputs_unwrap(response, self.low, self.high)
-            print(f'Get a score:{value}\n')
+            logger.debug('Get a score:%s', value)
             self.value_cache.update({y: value})
             return value
 
@@ -182,7 +130,7 @@ class ToT_Task(SearchTask):
                                     self.truncation, self.do_sample, 128)
 
             if not response:
-                print('Failed to get a summary!\n')
+                logger.warning('Failed to get a summary!')
                 return ''
             p = ''
             for _ in response:
@@ -191,30 +139,30 @@ class ToT_Task(SearchTask):
 
             if self.evaluate:
                 if len(p) < 1:
-                    print('Get the summary too short!\n')
+                    logger.debug('Get the summary too short!')
                     return ''
 
                 if '综上所述，最终答案是:' not in p:
                     summ = '综上所述，最终答案是:' + p
-                    print(f'Get summary:{summ}\n')
+                    logger.debug('Get summary:%s', summ)
                     return summ
                 else:
                     summ = '综上所述，最终答案是:' + p.split('综上所述，最终答案是:')[-1]
-                    print(f'Get summary:{summ}\n')
+                    logger.debug('Get summary:%s', summ)
                     return summ
 
             else:
                 if len(p) < 1:
-                    print('Get the summary too short!\n')
+                    logger.debug('Get the summary too short!')
                     return ''
 
                 if '综上所述，' not in p:
                     summ = '综上所述，' + p
-                    print(f'Get summary:{summ}\n')
+                    logger.debug('Get summary:%s', summ)
                     return summ
                 else:
                     summ = '综上所述，' + p.split('综上所述，')[-1]
-                    print(f'Get summary:{summ}\n')
+                    logger.debug('Get summary:%s', summ)
                     return summ
 
         else:
@@ -223,26 +171,30 @@ class ToT_Task(SearchTask):
                                     self.max_length,
                                     self.truncation, self.do_sample, 128)
             if not response:
-                print('Failed to get a summary!\n')
+                logger.warning('Failed to get a summary!')
                 return ''
             p = ''
             for _ in response:
                 p = p + _ + ' '
             summ = p.strip()
 
-            print(f'Get summary:{summ}\n')
+            logger.debug('Get summary:%s', summ)
             return summ
 
+    @metrics.collect
     def run(self):
         self.clear_cache()
         if self.algorithm == 'dfs':
             solution, root, final_node = DFS(self)
         elif self.algorithm == 'bfs':
             solution, root, final_node = BFS(self)
+        elif self.algorithm == 'best_first':
+            solution, root, final_node = best_first(self)
         else:
-            print('Unsupported algorithm!\n')
+            logger.warning('Unsupported algorithm!')
             return {}
 
+        metrics.set_phase('summary')
         cnt = 5
         summary = ''
         while cnt:
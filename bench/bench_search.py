@@ -0,0 +1,148 @@
+import gc
+import json
+import time
+import argparse
+import itertools
+import tracemalloc
+from models.mock_model import set_mock_model
+from MCTS.task import MCTS_Task
+from utils import trace
+from ToT.task import ToT_Task
+
+# search-engine benchmark on the deterministic mock backend, runs on a plain CPU machine:
+#   python -m bench.bench_search --branch 2 3 --iteration_limit 10 50 --latency 0
+# reports rounds/sec, python overhead per node (wall time minus simulated model latency) and memory per node
+# --trace PATH also records a span trace of all runs (tracing adds overhead, compare timings without it)
+
+QUESTION = 'A circle has radius 3. What is the area of the circle?'
+
+
+def run_mcts(branch, roll_forward_steps, iteration_limit, seed, roll_policy='greedy', sample_value='simple'):
+    task = MCTS_Task(QUESTION, propose_method='mock', value_method='mock', branch=branch,
+                     roll_forward_steps=roll_forward_steps, iteration_limit=iteration_limit, end_gate=1.01,
+                     roll_policy=roll_policy, sample_value=sample_value, evaluate='', answer='9*pi', seed=seed,
+                     profile=True)
+    final_answer, root = task.run()
+    return task, final_answer, root
+
+
+def run_tot(branch, max_depth, select_branch, algorithm, seed):
+    task = ToT_Task(QUESTION, propose_method='mock', value_method='mock', algorithm=algorithm, branch=branch,
+                    select_branch=select_branch, max_depth=max_depth, end_gate=1.01, lang='en', answer='9*pi',
+                    seed=seed)
+    final_answer, root = task.run()
+    return task, final_answer, root
+
+
+def measure(fn, mock, seed, memory):
+    mock.seed = seed
+    mock.reset()
+    gc.collect()
+    start = time.perf_counter()
+    task, final_answer, root = fn()
+    wall = time.perf_counter() - start
+    result = {'wall': wall, 'model_time': mock.sleep_time, 'nodes': task.node_count}
+    if memory:
+        # separate pass, tracemalloc slows the search down too much for timing
+        del task, final_answer, root
+        mock.reset()
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        task, final_answer, root = fn()
+        result['tree_bytes'] = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+    return task, result
+
+
+def bench_mcts(args, mock):
+    rows = []
+    for branch, steps, limit in itertools.product(args.branch, args.roll_forward_steps, args.iteration_limit):
+        for repeat in range(args.repeats):
+            seed = args.seed + repeat
+            task, res = measure(lambda: run_mcts(branch, steps, limit, seed, args.roll_policy), mock, seed,
+                                args.memory)
+            rounds = task.profiler.summary['rounds'] if task.profiler is not None else limit
+            overhead = max(0.0, res['wall'] - res['model_time'])
+            rows.append({
+                'algorithm': 'mcts', 'branch': branch, 'roll_forward_steps': steps, 'iteration_limit': limit,
+                'repeat': repeat, 'rounds': rounds, 'nodes': res['nodes'], 'wall': res['wall'],
+                'rounds_per_sec': rounds / res['wall'] if res['wall'] > 0 else 0.0,
+                'overhead_per_node_us': overhead / res['nodes'] * 1e6,
+                'bytes_per_node': res['tree_bytes'] / res['nodes'] if 'tree_bytes' in res else None,
+                'hot_phase': task.profiler.summary['hot_phase'] if task.profiler is not None else None,
+            })
+    return rows
+
+
+def bench_tot(args, mock):
+    rows = []
+    for algorithm, branch, depth in itertools.product(args.tot_algorithm, args.branch, args.max_depth):
+        for repeat in range(args.repeats):
+            seed = args.seed + repeat
+            task, res = measure(lambda: run_tot(branch, depth, args.select_branch, algorithm, seed), mock, seed,
+                                args.memory)
+            overhead = max(0.0, res['wall'] - res['model_time'])
+            rows.append({
+                'algorithm': algorithm, 'branch': branch, 'max_depth': depth, 'repeat': repeat,
+                'nodes': res['nodes'], 'wall': res['wall'],
+                'nodes_per_sec': res['nodes'] / res['wall'] if res['wall'] > 0 else 0.0,
+                'overhead_per_node_us': overhead / res['nodes'] * 1e6,
+                'bytes_per_node': res['tree_bytes'] / res['nodes'] if 'tree_bytes' in res else None,
+            })
+    return rows
+
+
+def print_rows(rows):
+    if not rows:
+        return
+    keys = list(rows[0].keys())
+    print('\t'.join(keys))
+    for row in rows:
+        print('\t'.join(f'{row[k]:.4g}' if isinstance(row[k], float) else str(row[k]) for k in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MCTS/ToT search benchmark on the mock backend')
+    parser.add_argument('--suite', type=str, nargs='+', default=['mcts', 'tot'], choices=['mcts', 'tot'])
+    parser.add_argument('--branch', type=int, nargs='+', default=[3])
+    parser.add_argument('--roll_forward_steps', type=int, nargs='+', default=[3])
+    parser.add_argument('--iteration_limit', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--roll_policy', type=str, default='greedy', choices=['greedy', 'random'])
+    parser.add_argument('--tot_algorithm', type=str, nargs='+', default=['dfs', 'bfs'])
+    parser.add_argument('--max_depth', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--select_branch', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated latency per model call (s)')
+    parser.add_argument('--reply_format', type=str, default='next_step')
+    parser.add_argument('--value_dist', type=str, default='uniform')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--memory', action='store_true', help='also measure memory per node (extra pass)')
+    parser.add_argument('--output', type=str, default=None, help='write rows as jsonl')
+    parser.add_argument('--trace', type=str, default=None, help='write a span trace (chrome trace json) here')
+    args = parser.parse_args()
+
+    if args.trace:
+        trace.start(args.trace)
+
+    mock = set_mock_model(seed=args.seed, latency=args.latency, reply_format=args.reply_format,
+                          value_dist=args.value_dist)
+    rows = []
+    if 'mcts' in args.suite:
+        mcts_rows = bench_mcts(args, mock)
+        print_rows(mcts_rows)
+        rows.extend(mcts_rows)
+    if 'tot' in args.suite:
+        tot_rows = bench_tot(args, mock)
+        print_rows(tot_rows)
+        rows.extend(tot_rows)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+    if args.trace:
+        trace.stop()
+
+
+if __name__ == '__main__':
+    main()
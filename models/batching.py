@@ -0,0 +1,104 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+from utils import deadline
+
+logger = logging.getLogger(__name__)
+
+# micro-batching dispatcher shared by all searches of a process (e.g. runners.batch --pool thread)
+# callers block in submit(); a background thread groups pending requests with the same key (generation
+# settings) and runs them as one batch once max_batch_size requests are queued or the oldest one has
+# waited max_wait seconds. a caller waits at most until the run deadline (utils/deadline.py); a request given up
+# before its batch started is dropped from the batch
+
+
+class MicroBatcher(object):
+    def __init__(self, batch_fn, max_batch_size=16, max_wait=0.01, name='batcher'):
+        # batch_fn(items, **key_kwargs) -> list of results, one per item, in order
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self.requests = queue.Queue()
+        self.pending = {}  # {key: [(item, future, enqueue time)]}
+        self.batches = 0
+        self.items = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, item, **key_kwargs):
+        return self.submit_many([item], **key_kwargs)[0]
+
+    def submit_many(self, items, **key_kwargs):
+        # enqueue all items at once so they can share a batch, results in item order
+        futures = []
+        now = time.perf_counter()
+        key = tuple(sorted(key_kwargs.items()))
+        for item in items:
+            future = Future()
+            self.requests.put((key, item, future, now))
+            futures.append(future)
+        try:
+            return [future.result(timeout=deadline.timeout()) for future in futures]
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _take(self, timeout):
+        try:
+            key, item, future, enqueued = self.requests.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self.pending.setdefault(key, []).append((item, future, enqueued))
+
+    def _run(self):
+        while True:
+            if not self.pending:
+                self._take(None)
+            # drain whatever else arrived, then wait for the oldest request's deadline or a full batch
+            while True:
+                try:
+                    key, item, future, enqueued = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                self.pending.setdefault(key, []).append((item, future, enqueued))
+            now = time.perf_counter()
+            ready = [k for k, v in self.pending.items()
+                     if len(v) >= self.max_batch_size or now - v[0][2] >= self.max_wait]
+            if not ready:
+                oldest = min(v[0][2] for v in self.pending.values())
+                self._take(max(0.0, oldest + self.max_wait - now))
+                continue
+            for key in ready:
+                batch = self.pending[key][:self.max_batch_size]
+                self.pending[key] = self.pending[key][self.max_batch_size:]
+                if not self.pending[key]:
+                    del self.pending[key]
+                self._flush(batch, dict(key))
+
+    def _flush(self, batch, key_kwargs):
+        # requests whose caller gave up (cancelled) are dropped, the rest can no longer be cancelled
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        logger.debug('%s: flushing batch of %d', self.name, len(batch))
+        try:
+            results = self.batch_fn([item for item, _, _ in batch], **key_kwargs)
+            if len(results) != len(batch):
+                raise RuntimeError(f'{self.name}: batch function returned {len(results)} results for '
+                                   f'{len(batch)} items')
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        return {'batches': self.batches, 'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0}
@@ -0,0 +1,161 @@
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# record/replay store for get_proposal / get_value
+# every (kind, prompt, params) -> response pair of a real run is appended to an indexed sqlite file with
+# zlib-compressed payloads; method='replay' then serves the recorded responses without a model.
+# a prompt sampled several times keeps all of its responses, replay cycles through them in recording order.
+# while a cassette is loaded in 'replay' mode every call is served from it, whatever method the task passes,
+# so a task configured exactly like the recorded run builds the same prompts and replays offline
+
+MODES = ['record', 'replay']
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (key, idx)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def make_key(kind, prompt, params):
+    raw = json.dumps([kind, prompt, params], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class Cassette(object):
+    def __init__(self, path, mode='record'):
+        assert mode in MODES, f"Unsupported cassette mode {mode}!"
+        self.path = path
+        self.mode = mode
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.meta = {name: json.loads(value) for name, value in self.conn.execute('SELECT name, value FROM meta')}
+        self.cursors = {}  # {key: next index to replay}
+        self.counts = {}  # {key: number of recorded responses}
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def set_meta(self, name, value):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+            self.conn.commit()
+            self.meta[name] = value
+
+    def get_meta(self, name, default=None):
+        return self.meta.get(name, default)
+
+    def record(self, kind, prompt, params, response):
+        key = make_key(kind, prompt, params)
+        payload = zlib.compress(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+        with self.lock:
+            # next index computed in sql so several recording processes can share one file
+            self.conn.execute('INSERT INTO responses (key, idx, kind, payload) '
+                              'SELECT ?, COALESCE(MAX(idx) + 1, 0), ?, ? FROM responses WHERE key = ?',
+                              (key, kind, payload, key))
+            self.conn.commit()
+
+    def replay(self, kind, prompt, params):
+        # (True, response) for a recorded pair, (False, None) on a miss
+        key = make_key(kind, prompt, params)
+        with self.lock:
+            if key not in self.counts:
+                self.counts[key] = self.conn.execute('SELECT COUNT(*) FROM responses WHERE key = ?',
+                                                     (key,)).fetchone()[0]
+            count = self.counts[key]
+            if not count:
+                self.misses += 1
+                return False, None
+            idx = self.cursors.get(key, 0)
+            self.cursors[key] = (idx + 1) % count
+            row = self.conn.execute('SELECT payload FROM responses WHERE key = ? AND idx = ?', (key, idx)).fetchone()
+            self.hits += 1
+        return True, json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def rewind(self):
+        # restart every prompt at its first recorded response
+        with self.lock:
+            self.cursors = {}
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+_cassette = None
+
+
+def use_cassette(path, mode='record'):
+    # install the process-wide cassette; mode='record' wraps live calls, mode='replay' serves method='replay'
+    global _cassette
+    if _cassette is not None:
+        _cassette.close()
+    _cassette = Cassette(path, mode) if path is not None else None
+    return _cassette
+
+
+def get_cassette():
+    return _cassette
+
+
+def replaying():
+    return _cassette is not None and _cassette.mode == 'replay'
+
+
+@contextmanager
+def cassette(path, mode='record'):
+    current = use_cassette(path, mode)
+    try:
+        yield current
+    finally:
+        use_cassette(None)
+
+
+def record_response(kind, method, prompt, params, response):
+    if _cassette is None or _cassette.mode != 'record' or method == 'replay':
+        return
+    _cassette.record(kind, prompt, params, response)
+    if kind == 'value':
+        if _cassette.get_meta('value_method') != method:
+            _cassette.set_meta('value_method', method)
+    elif _cassette.get_meta('propose_method') != method:
+        _cassette.set_meta('propose_method', method)
+
+
+def replay_response(kind, prompt, params):
+    if _cassette is None:
+        logger.warning('No cassette loaded for replay!')
+        return False, None
+    found, response = _cassette.replay(kind, prompt, params)
+    if not found:
+        logger.warning('Replay miss for <%s> call!', kind)
+    return found, response
+
+
+def recorded_method(kind):
+    # backend the cassette was recorded with, e.g. to know whether replayed values are direct scores
+    if _cassette is None:
+        return None
+    return _cassette.get_meta('value_method' if kind == 'value' else 'propose_method')
@@ -1,78 +1,153 @@
+import logging
 from models.model import *
+from models.retry import CircuitOpenError, RetryExhaustedError
+from models.mock_model import mock_inference_model, mock_value_model
+from models.cassette import record_response, replay_response, recorded_method, replaying
+from utils import metrics, trace, deadline
+
+logger = logging.getLogger(__name__)
+
+
+def breaker_key(kind, method):
+    # retry policy key (circuit breaker, latency window): value models served apart from the policy model
+    # ('local', 'server', 'mock') get their own, api backends serve both kinds from one endpoint
+    if kind == 'value' and method in DIRECT_VALUE_METHODS:
+        return f'{method}_value'
+    return method
+
+
+def _call_backend(kind, method, fn, *args, **kwargs):
+    # one logical backend call under the shared retry policy, [] on failure or once the run's deadline has passed
+    if deadline.expired():
+        logger.debug('Deadline passed, skipping <%s> %s call.', method, kind)
+        return []
+    with trace.span(f'{kind}:{method}', 'backend'), metrics.track_call(kind, method):
+        try:
+            return RETRY_POLICY.call(breaker_key(kind, method), fn, *args, on_retry=metrics.add_retry,
+                                     deadline=deadline.expires_at(), **kwargs)
+        except (CircuitOpenError, RetryExhaustedError) as e:
+            metrics.mark_failed()
+            logger.warning('Error occurred when calling <%s>!\nError type:%s', method, e)
+            return []
+
+
+DIRECT_VALUE_METHODS = ['local', 'server', 'mock']
+
+
+def is_direct_value(method):
+    # True if get_value returns the score itself rather than a reply to unwrap
+    if method == 'replay':
+        method = recorded_method('value')
+    return method in DIRECT_VALUE_METHODS
+
+
+LOCAL_METHODS = ['llama', 'mistral', 'local']
+
+
+def allows_concurrency(method, kind='proposal'):
+    # True if concurrent calls are safe: api / http backends, the mock and replays take them, the local HF models
+    # are not thread-safe and only take them through the LOCAL_BATCHING micro-batcher
+    if method in LOCAL_METHODS:
+        return (inference_batcher if kind == 'proposal' else value_batcher) is not None
+    return True
+
+
+def _replay(kind, prompt, params, default):
+    with metrics.track_call(kind, 'replay'):
+        found, response = replay_response(kind, prompt, params)
+        if not found:
+            metrics.mark_failed()
+            return default
+        return response
 
 
 # given prompt, generate proposal under instruction, unwrap is required
 def get_proposal(prompt, method='glm', temperature=0.7, max_tokens=2048, seed=170, max_length=2048, truncation=True,
                  do_sample=True, max_new_tokens=1024):
-    response = []
-    cnt = 2
+    params = {'temperature': temperature, 'max_tokens': max_tokens, 'seed': seed, 'do_sample': do_sample,
+              'max_new_tokens': max_new_tokens}
+    if method == 'replay' or replaying():
+        return _replay('proposal', prompt, params, [])
+
     if method == 'glm':
-        while not response and cnt:
-            response = glm(prompt, BASE_MODEL_GLM, temperature=temperature, max_tokens=max_tokens, seed=seed)
-            cnt -= 1
-        if not response:
-            print(f'obtain<{method}>response fail!\n')
-            return []
-        return response
+        response = _call_backend('proposal', method, glm, prompt, BASE_MODEL_GLM, temperature=temperature,
+                                 max_tokens=max_tokens, seed=seed)
 
     elif method == 'gpt':
-        while not response and cnt:
-            response = gpt(prompt, model=BASE_MODEL_GPT, temperature=temperature, max_tokens=max_tokens)
-            cnt -= 1
-        if not response:
-            print(f'obtain<{method}>response fail!\n')
-            return []
-        return response
+        response = _call_backend('proposal', method, gpt, prompt, model=BASE_MODEL_GPT, temperature=temperature,
+                                 max_tokens=max_tokens)
 
     elif method == 'llama' or method == 'mistral' or method == 'local':
-        while not response and cnt:
-            response = local_inference_model(prompt, max_length=max_length, truncation=truncation, do_sample=do_sample,
-                                             max_new_tokens=max_new_tokens, temperature=temperature)
-            cnt -= 1
-        if not response:
-            print(f'obtain<{method}>response fail!\n')
-            return []
-        return response
+        response = _call_backend('proposal', method, local_inference_model, prompt, max_length=max_length,
+                                 truncation=truncation, do_sample=do_sample, max_new_tokens=max_new_tokens,
+                                 temperature=temperature)
+
+    elif method == 'mock':
+        response = _call_backend('proposal', method, mock_inference_model, prompt, max_new_tokens=max_new_tokens)
 
     else:
-        print('This method of getting responses is not yet supported!\n')
+        logger.warning('This method of getting responses is not yet supported!')
         return []
 
+    if not response:
+        logger.warning('obtain<%s>response fail!', method)
+        return []
+    record_response('proposal', method, prompt, params, response)
+    return response
+
 
 # given prompt + answer, find its value
 # if you use api, unwrap is required. if you use local value model, the value is directly obtained
 def get_value(prompt_answer, method='glm', temperature=0.7, max_tokens=1000, seed=170, max_length=2048, low=0, high=1):
-    response = []
-    cnt = 2
+    params = {'temperature': temperature, 'max_tokens': max_tokens, 'seed': seed, 'low': low, 'high': high}
+    if method == 'replay' or replaying():
+        return _replay('value', prompt_answer, params, low if is_direct_value(method) else [])
+
     if method == 'glm':
-        while not response and cnt:
-            response = glm(prompt_answer, BASE_MODEL_GLM, temperature=temperature, max_tokens=max_tokens, seed=seed)
-            cnt -= 1
+        response = _call_backend('value', method, glm, prompt_answer, BASE_MODEL_GLM, temperature=temperature,
+                                 max_tokens=max_tokens, seed=seed)
         if not response:
-            print(f'obtain<{method}>score fail!\n')
+            logger.warning('obtain<%s>score fail!', method)
             return []
+        record_response('value', method, prompt_answer, params, response)
         return response
 
     elif method == 'gpt':
-        while not response and cnt:
-            response = gpt(prompt_answer, model=BASE_MODEL_GPT, temperature=temperature, max_tokens=max_tokens)
-            cnt -= 1
+        response = _call_backend('value', method, gpt, prompt_answer, model=BASE_MODEL_GPT, temperature=temperature,
+                                 max_tokens=max_tokens)
         if not response:
-            print(f'obtain<{method}>score fail!\n')
+            logger.warning('obtain<%s>score fail!', method)
             return []
+        record_response('value', method, prompt_answer, params, response)
         return response
 
     elif method == 'local':
-        value = low
-        while cnt:
-            try:
-                value = local_value_model(prompt_answer, max_length=max_length, low=low, high=high)
-                break
-            except Exception as e:
-                print(f'obtain<{method}>score fail!\nError:{e}\n')
-                cnt -= 1
+        value = _call_backend('value', method, local_value_model, prompt_answer, max_length=max_length, low=low,
+                              high=high, is_valid=lambda v: v is not None)
+        if value == []:
+            logger.warning('obtain<%s>score fail!', method)
+            return low
+        record_response('value', method, prompt_answer, params, value)
+        return value
+
+    elif method == 'server':
+        value = _call_backend('value', method, server_value_model, prompt_answer, max_length=max_length, low=low,
+                              high=high, is_valid=lambda v: v is not None)
+        if value == []:
+            logger.warning('obtain<%s>score fail!', method)
+            return low
+        record_response('value', method, prompt_answer, params, value)
+        return value
+
+    elif method == 'mock':
+        value = _call_backend('value', method, mock_value_model, prompt_answer, low=low, high=high,
+                              is_valid=lambda v: v is not None)
+        if value == []:
+            logger.warning('obtain<%s>score fail!', method)
+            return low
+        record_response('value', method, prompt_answer, params, value)
         return value
 
     else:
-        print('This method of getting scores is not yet supported!\n')
+        logger.warning('This method of getting scores is not yet supported!')
         return []
@@ -1,7 +1,12 @@
+import copy
+import logging
 import os
 import torch
 import torch.nn as nn
 from transformers import AutoModel, AutoTokenizer, AutoModelForCausalLM
+from utils import metrics
+
+logger = logging.getLogger(__name__)
 
 
 # get model and tokenizer
@@ -31,33 +36,20 @@ def get_inference_model_mistral(model_dir):
     return inference_tokenizer, inference_model
 
 
-# get glm model response
+# get glm model response, single attempt (retries are handled in get_response)
 def get_local_response(query, model, tokenizer, max_length=2048, truncation=True, do_sample=False, max_new_tokens=1024, temperature=0.7):
-    cnt = 2
-    all_response = ''
-    while cnt:
-        try:
-            inputs = tokenizer([query], return_tensors="pt", truncation=truncation, max_length=max_length).to('cuda')
-            output_ = model.generate(**inputs, do_sample=do_sample, max_new_tokens=max_new_tokens, temperature=temperature)
-            output = output_.tolist()[0][len(inputs["input_ids"][0]):]
-            response = tokenizer.decode(output)
-
-            print(f'obtain response:{response}\n')
-            all_response = response
-            break
-        except Exception as e:
-            print(f'Error:{e}, obtain response again...\n')
-            cnt -= 1
-    if not cnt:
-        return []
+    inputs = tokenizer([query], return_tensors="pt", truncation=truncation, max_length=max_length).to('cuda')
+    output_ = model.generate(**inputs, do_sample=do_sample, max_new_tokens=max_new_tokens, temperature=temperature)
+    output = output_.tolist()[0][len(inputs["input_ids"][0]):]
+    metrics.add_tokens(len(inputs["input_ids"][0]), len(output))
+    all_response = tokenizer.decode(output)
+    logger.debug('obtain response:%s', all_response)
     split_response = all_response.strip().split('\n')
     return split_response
 
 
 # get llama model response
 def get_local_response_llama(query, model, tokenizer, max_length=2048, truncation=True, max_new_tokens=1024, temperature=0.7, do_sample=False):
-    cnt = 2
-    all_response = ''
     # messages = [{"role": "user", "content": query}]
     # data = tokenizer.apply_chat_template(messages, return_tensors="pt").cuda()
     terminators = [
@@ -68,23 +60,18 @@ def get_local_response_llama(query, model, tokenizer, max_length=2048, truncatio
     data = tokenizer.encode_plus(message, max_length=max_length, truncation=truncation, return_tensors='pt')
     input_ids = data['input_ids'].to('cuda')
     attention_mask = data['attention_mask'].to('cuda')
-    while cnt:
-        try:
-            # query = "<s>Human: " + query + "</s><s>Assistant: "
-            # input_ids = tokenizer([query], return_tensors="pt", add_special_tokens=False).input_ids.to('cuda')
-            output = model.generate(input_ids, attention_mask=attention_mask, do_sample=do_sample, max_new_tokens=max_new_tokens, temperature=temperature, eos_token_id=terminators, pad_token_id=tokenizer.eos_token_id)
-            ori_string = tokenizer.decode(output[0], skip_special_tokens=False)
-            processed_string = ori_string.split('<|end_header_id|>')[2].strip().split('<|eot_id|>')[0].strip()
-            response = processed_string.split('<|end_of_text|>')[0].strip()
-
-            # print(f'获得回复:{response}\n')
-            all_response = response
-            break
-        except Exception as e:
-            print(f'Error:{e}, obtain response again...\n')
-            cnt -= 1
-    if not cnt:
-        return []
+    # query = "<s>Human: " + query + "</s><s>Assistant: "
+    # input_ids = tokenizer([query], return_tensors="pt", add_special_tokens=False).input_ids.to('cuda')
+    output = model.generate(input_ids, attention_mask=attention_mask, do_sample=do_sample, max_new_tokens=max_new_tokens, temperature=temperature, eos_token_id=terminators, pad_token_id=tokenizer.eos_token_id)
+    metrics.add_tokens(input_ids.shape[1], output.shape[1] - input_ids.shape[1])
+    ori_string = tokenizer.decode(output[0], skip_special_tokens=False)
+    return split_llama_response(ori_string)
+
+
+def split_llama_response(ori_string):
+    processed_string = ori_string.split('<|end_header_id|>')[2].strip().split('<|eot_id|>')[0].strip()
+    all_response = processed_string.split('<|end_of_text|>')[0].strip()
+    # print(f'获得回复:{all_response}\n')
     # split_response = all_response.split("Assistant:")[-1].strip().split('\n')
     split_response = all_response.split('\n')
     return split_response
@@ -92,29 +79,22 @@ def get_local_response_llama(query, model, tokenizer, max_length=2048, truncatio
 
 # get mistral model response
 def get_local_response_mistral(query, model, tokenizer, max_length=1024, truncation=True, max_new_tokens=1024, temperature=0.7, do_sample=False):
-    cnt = 2
-    all_response = ''
     # messages = [{"role": "user", "content": query}]
     # data = tokenizer.apply_chat_template(messages, max_length=max_length, truncation=truncation, return_tensors="pt").cuda()
     message = '[INST]' + query + '[/INST]'
     data = tokenizer.encode_plus(message, max_length=max_length, truncation=truncation, return_tensors='pt')
     input_ids = data['input_ids'].to('cuda')
     attention_mask = data['attention_mask'].to('cuda')
-    while cnt:
-        try:
-            output = model.generate(input_ids, attention_mask=attention_mask, max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
-            ori_string = tokenizer.decode(output[0])
-            processed_string = ori_string.split('[/INST]')[1].strip()
-            response = processed_string.split('</s>')[0].strip()
-
-            print(f'obtain response:{response}\n')
-            all_response = response
-            break
-        except Exception as e:
-            print(f'Error:{e}, obtain response again...\n')
-            cnt -= 1
-    if not cnt:
-        return []
+    output = model.generate(input_ids, attention_mask=attention_mask, max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    metrics.add_tokens(input_ids.shape[1], output.shape[1] - input_ids.shape[1])
+    ori_string = tokenizer.decode(output[0])
+    return split_mistral_response(ori_string)
+
+
+def split_mistral_response(ori_string):
+    processed_string = ori_string.split('[/INST]')[1].strip()
+    all_response = processed_string.split('</s>')[0].strip()
+    logger.debug('obtain response:%s', all_response)
     all_response = all_response.split('The answer is:')[0].strip()  # intermediate steps should not always include a final answer
     ans_count = all_response.split('####')
     if len(ans_count) >= 2:
@@ -122,3 +102,50 @@ def get_local_response_mistral(query, model, tokenizer, max_length=1024, truncat
     all_response = all_response.replace('[SOL]', '').replace('[ANS]', '').replace('[/ANS]', '').replace('[INST]', '').replace('[/INST]', '').replace('[ANSW]', '').replace('[/ANSW]', '')  # remove unique answer mark for mistral
     split_response = all_response.split('\n')
     return split_response
+
+
+# tokenizer for get_local_responses_batch: a copy with a pad token and left padding, so the new tokens of every
+# row start at the same position while the shared tokenizer of the single-query paths stays as loaded
+def batching_tokenizer(tokenizer):
+    tokenizer = copy.deepcopy(tokenizer)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = 'left'
+    return tokenizer
+
+
+# batched generation for models.batching: one padded generate() call for queries sharing the same settings,
+# returns [(split_response, prompt_tokens, completion_tokens)] in query order; tokenizer from batching_tokenizer()
+def get_local_responses_batch(queries, model, tokenizer, inference_type='glm', max_length=2048, truncation=True,
+                              do_sample=False, max_new_tokens=1024, temperature=0.7):
+    if inference_type == 'llama':
+        messages = ['<|start_header_id|>user<|end_header_id|>\n\n{query}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n'.format(query=q) for q in queries]
+        eos_token_id = [tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("<|eot_id|>")]
+    elif inference_type == 'mistral':
+        messages = ['[INST]' + q + '[/INST]' for q in queries]
+        eos_token_id = tokenizer.eos_token_id
+    else:
+        messages = list(queries)
+        eos_token_id = None
+    data = tokenizer(messages, padding=True, truncation=truncation, max_length=max_length, return_tensors='pt')
+    input_ids = data['input_ids'].to('cuda')
+    attention_mask = data['attention_mask'].to('cuda')
+    kwargs = {'eos_token_id': eos_token_id} if eos_token_id is not None else {}
+    output = model.generate(input_ids, attention_mask=attention_mask, do_sample=do_sample,
+                            max_new_tokens=max_new_tokens, temperature=temperature,
+                            pad_token_id=tokenizer.pad_token_id, **kwargs)
+    prompt_len = input_ids.shape[1]
+    results = []
+    for i, row in enumerate(output.tolist()):
+        new_tokens = row[prompt_len:]
+        while new_tokens and new_tokens[-1] == tokenizer.pad_token_id:
+            new_tokens.pop()
+        prompt_tokens = int(attention_mask[i].sum())
+        if inference_type == 'llama':
+            response = split_llama_response(tokenizer.decode(row[prompt_len - prompt_tokens:], skip_special_tokens=False))
+        elif inference_type == 'mistral':
+            response = split_mistral_response(tokenizer.decode(row[prompt_len - prompt_tokens:]))
+        else:
+            response = tokenizer.decode(new_tokens).strip().split('\n')
+        results.append((response, prompt_tokens, len(new_tokens)))
+    return results
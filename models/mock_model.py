@@ -0,0 +1,114 @@
+import re
+import time
+import random
+import hashlib
+import threading
+from utils import metrics
+
+# deterministic synthetic backend (method='mock') for measuring search overhead without a model
+# the k-th call with a given prompt always returns the same reply for a given seed, so runs are reproducible
+# while resampling the same prompt still yields different proposals
+
+WORDS = ['compute', 'the', 'sum', 'of', 'both', 'terms', 'then', 'divide', 'by', 'two', 'substitute', 'x', 'into',
+         'equation', 'simplify', 'expression', 'factor', 'numerator', 'denominator', 'apply', 'formula', 'area',
+         'radius', 'multiply', 'result', 'check', 'value', 'variable', 'solve', 'for', 'y', 'square', 'root']
+REPLY_FORMATS = ['next_step', 'step', 'plain', 'zh']
+VALUE_DISTS = ['uniform', 'beta', 'depth']
+STEP_PATTERN = re.compile(r'(Step \d+:|步骤\d+:)')
+
+
+class MockLLM(object):
+    def __init__(self, seed=0, latency=0.0, latency_jitter=0.0, value_latency=None, reply_format='next_step',
+                 step_words=(6, 16), end_prob=0.15, value_dist='depth', value_alpha=2.0, value_beta=2.0,
+                 value_step=0.15, value_noise=0.1):
+        assert reply_format in REPLY_FORMATS, f"Unsupported reply format {reply_format}!"
+        assert value_dist in VALUE_DISTS, f"Unsupported value distribution {value_dist}!"
+        self.seed = seed
+        self.latency = latency  # base latency of a proposal call (s)
+        self.latency_jitter = latency_jitter  # extra uniform latency in [0, jitter] (s)
+        self.value_latency = latency if value_latency is None else value_latency
+        self.reply_format = reply_format
+        self.step_words = step_words  # min/max words of a generated step
+        self.end_prob = end_prob  # probability that a proposal states a final answer
+        self.value_dist = value_dist
+        self.value_alpha = value_alpha
+        self.value_beta = value_beta
+        self.value_step = value_step  # 'depth': expected value gain per existing step
+        self.value_noise = value_noise
+        self.calls = {}  # {(kind, prompt digest): number of calls}
+        self.sleep_time = 0.0  # total simulated latency (s)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.sleep_time = 0.0
+
+    def _rng(self, kind, prompt):
+        digest = hashlib.md5(prompt.encode('utf-8')).hexdigest()
+        key = (kind, digest)
+        with self.lock:
+            k = self.calls.get(key, 0)
+            self.calls[key] = k + 1
+        return random.Random(f'{self.seed}:{kind}:{digest}:{k}')
+
+    def _sleep(self, rng, base):
+        delay = base + (rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+        if delay > 0:
+            start = time.perf_counter()
+            time.sleep(delay)
+            with self.lock:
+                self.sleep_time += time.perf_counter() - start
+
+    def generate(self, prompt, max_new_tokens=256):
+        rng = self._rng('generate', prompt)
+        self._sleep(rng, self.latency)
+        n_words = rng.randint(*self.step_words)
+        text = ' '.join(rng.choice(WORDS) for _ in range(min(n_words, max_new_tokens)))
+        if rng.random() < self.end_prob:
+            text = text + f', so the answer is {rng.randint(0, 99)}. Problem solved'
+        step_n = len(STEP_PATTERN.findall(prompt)) + 1
+        if self.reply_format == 'next_step':
+            return ['Next step: ' + text]
+        elif self.reply_format == 'step':
+            return [f'Step {step_n}: ' + text]
+        elif self.reply_format == 'zh':
+            return ['下一步:' + text]
+        return [text]
+
+    def score(self, prompt_answer, low=0, high=1):
+        rng = self._rng('score', prompt_answer)
+        self._sleep(rng, self.value_latency)
+        if self.value_dist == 'uniform':
+            value = rng.uniform(low, high)
+        elif self.value_dist == 'beta':
+            value = low + (high - low) * rng.betavariate(self.value_alpha, self.value_beta)
+        else:
+            steps = len(STEP_PATTERN.findall(prompt_answer))
+            value = low + (high - low) * (self.value_step * steps + rng.gauss(0, self.value_noise))
+        return min(high, max(low, value))
+
+
+MOCK_MODEL = MockLLM()
+
+
+def set_mock_model(**kwargs):
+    # replace the shared mock backend, e.g. set_mock_model(seed=1, latency=0.05, value_dist='beta')
+    global MOCK_MODEL
+    MOCK_MODEL = MockLLM(**kwargs)
+    return MOCK_MODEL
+
+
+def get_mock_model():
+    return MOCK_MODEL
+
+
+def mock_inference_model(query, max_new_tokens=256):
+    reply = MOCK_MODEL.generate(query, max_new_tokens=max_new_tokens)
+    metrics.add_tokens(len(query.split()), len(reply[0].split()))
+    return reply
+
+
+def mock_value_model(prompt_answer, low=0, high=1):
+    metrics.add_tokens(len(prompt_answer.split()), 0)
+    return MOCK_MODEL.score(prompt_answer, low=low, high=high)
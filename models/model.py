@@ -1,16 +1,30 @@
+import logging
 import os
-import openai
-import backoff
 import requests
 import json
-from models.inference_models import get_local_response, get_inference_model, get_inference_model_llama, get_local_response_llama, get_inference_model_mistral, get_local_response_mistral
-from models.value_models import get_local_value, get_value_model, get_value_model_prm, get_value_model_mistral, get_value_model_prm_mistral
-from transformers import AutoModel, AutoTokenizer
+from models.batching import MicroBatcher
+from models.retry import RetryPolicy
+from utils import metrics, deadline
+
+logger = logging.getLogger(__name__)
+
+# openai, torch and transformers are imported only when a backend needing them is configured or first called,
+# so api-only and mock runs (e.g. bench/bench_search.py) work without them installed
 
 # openai api settings
 API_KEY = 'sk-**'
 API_BASE = 'base'
 BASE_MODEL_GPT = "gpt-3.5-turbo"
+# USD per 1k tokens: (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+}
 
 # GLM api settings
 URL = "https://api.chatglm.cn/v1/chat/completions"
@@ -37,8 +51,37 @@ USE_PRM = False
 INFERENCE_LOCAL = False
 VALUE_LOCAL = False
 
+# value_method='server': url of a models/value_server.py instance shared by all search processes
+VALUE_SERVER_URL = 'http://127.0.0.1:8800'
+
+# micro-batching of local model calls across all searches running in this process (threads)
+# requests are flushed as one batch when BATCH_MAX_SIZE are queued or after BATCH_MAX_WAIT seconds
+LOCAL_BATCHING = False
+BATCH_MAX_SIZE = 16
+BATCH_MAX_WAIT = 0.01
+
+# retry settings, shared by every backend in get_proposal / get_value
+# one logical call makes at most RETRY_MAX_ATTEMPTS attempts within RETRY_TOTAL_TIMEOUT seconds
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+RETRY_TOTAL_TIMEOUT = 120.0
+REQUEST_TIMEOUT = 60.0  # timeout of a single http request (s)
+# a backend is skipped for BREAKER_RESET_TIMEOUT seconds after BREAKER_FAILURES consecutive failures
+BREAKER_FAILURES = 5
+BREAKER_RESET_TIMEOUT = 30.0
+# send a duplicate api request when an attempt is slower than the observed p95 latency
+HEDGE_REQUESTS = False
+HEDGE_QUANTILE = 0.95
+
+RETRY_POLICY = RetryPolicy(max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                           total_timeout=RETRY_TOTAL_TIMEOUT, failure_threshold=BREAKER_FAILURES,
+                           reset_timeout=BREAKER_RESET_TIMEOUT, hedge=HEDGE_REQUESTS, hedge_quantile=HEDGE_QUANTILE)
+
 # implement the inference model
 if INFERENCE_MODEL_DIR is not None:
+    from models.inference_models import get_inference_model, get_inference_model_llama, \
+        get_inference_model_mistral
     INFERENCE_LOCAL = True
     inference_type = LOCAL_INFERENCE_TYPES[LOCAL_INFERENCE_IDX]
     if inference_type == 'glm':
@@ -50,6 +93,8 @@ if INFERENCE_MODEL_DIR is not None:
 
 # implement the value model (reward model)
 if VALUE_BASE_MODEL_DIR is not None:
+    from models.value_models import get_value_model, get_value_model_prm, get_value_model_mistral, \
+        get_value_model_prm_mistral
     VALUE_LOCAL = True
     value_type = LOCAL_VALUE_TYPES[LOCAL_VALUE_IDX]
     if USE_PRM:
@@ -64,37 +109,42 @@ if VALUE_BASE_MODEL_DIR is not None:
             value_tokenizer, value_model = get_value_model_mistral(VALUE_BASE_MODEL_DIR, VALUE_MODEL_STATE_DICT)
 
 completion_tokens = prompt_tokens = 0
-api_key = API_KEY
-if api_key != "":
-    openai.api_key = api_key
-    print(f'api_key:{api_key}\n')
-else:
-    print("Warning: OPENAI_API_KEY is not set")
+_openai = None
+
+
+def get_openai():
+    # the openai module, configured with API_KEY / API_BASE on first use
+    global _openai
+    if _openai is None:
+        import openai
+        api_key = API_KEY
+        if api_key != "":
+            openai.api_key = api_key
+            logger.debug('api_key:%s', api_key)
+        else:
+            logger.warning("OPENAI_API_KEY is not set")
+
+        api_base = API_BASE
+        if api_base != "":
+            logger.warning("OPENAI_API_BASE is set to %s", api_base)
+            openai.api_base = api_base
+        _openai = openai
+    return _openai
+
 
-api_base = API_BASE
-if api_base != "":
-    print("Warning: OPENAI_API_BASE is set to {}".format(api_base))
-    openai.api_base = api_base
+def request_timeout():
+    # REQUEST_TIMEOUT, cut to what is left of the current deadline (see utils/deadline.py)
+    return deadline.timeout(REQUEST_TIMEOUT)
 
 
-@backoff.on_exception(backoff.expo, openai.error.OpenAIError)
-def completions_with_backoff(**kwargs):
-    return openai.ChatCompletion.create(**kwargs)
+# single attempt, retries and backoff are handled by RETRY_POLICY in get_response
+def chat_completion(**kwargs):
+    return get_openai().ChatCompletion.create(request_timeout=request_timeout(), **kwargs)
 
 
 def gpt(prompt, model=BASE_MODEL_GPT, temperature=0.7, max_tokens=1000, n=1, stop=None) -> list:
     messages = [{"role": "user", "content": prompt}]
-    out = []
-    cnt = 5
-    while cnt:
-        try:
-            out = chatgpt(messages, model=model, temperature=temperature, max_tokens=max_tokens, n=n, stop=stop)[
-                0].split('\n')
-            break
-        except Exception as e:
-            print(f"Error occurred when getting gpt reply!\nError type:{e}\n")
-            cnt -= 1
-    return out
+    return chatgpt(messages, model=model, temperature=temperature, max_tokens=max_tokens, n=n, stop=stop)[0].split('\n')
 
 
 def chatgpt(messages, model=BASE_MODEL_GPT, temperature=0.7, max_tokens=1000, n=1, stop=None) -> list:
@@ -103,25 +153,38 @@ def chatgpt(messages, model=BASE_MODEL_GPT, temperature=0.7, max_tokens=1000, n=
     while n > 0:
         cnt = min(n, 20)
         n -= cnt
-        res = completions_with_backoff(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens,
-                                       n=cnt, stop=stop)
+        res = chat_completion(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens,
+                              n=cnt, stop=stop)
         # print(f'得到GPT回复:{res}\n\n')
         outputs.extend([choice["message"]["content"] for choice in res["choices"]])
         # log completion tokens
         completion_tokens += res["usage"]["completion_tokens"]
         prompt_tokens += res["usage"]["prompt_tokens"]
+        metrics.add_tokens(res["usage"]["prompt_tokens"], res["usage"]["completion_tokens"])
     return outputs
 
 
 def gpt_usage(backend=BASE_MODEL_GPT):
     global completion_tokens, prompt_tokens
-    if backend == "gpt-4":
-        cost = completion_tokens / 1000 * 0.06 + prompt_tokens / 1000 * 0.03
-    elif backend == "gpt-3.5-turbo":
-        cost = completion_tokens / 1000 * 0.002 + prompt_tokens / 1000 * 0.0015
-    else:
-        cost = -1
-    return {"completion_tokens": completion_tokens, "prompt_tokens": prompt_tokens, "cost": cost}
+    return {"completion_tokens": completion_tokens, "prompt_tokens": prompt_tokens,
+            "cost": token_cost(backend, prompt_tokens, completion_tokens)}
+
+
+def token_cost(backend, prompt_tokens, completion_tokens):
+    # USD cost of the given token counts, -1 for models without a known price
+    if backend not in MODEL_PRICES:
+        return -1
+    prompt_price, completion_price = MODEL_PRICES[backend]
+    return completion_tokens / 1000 * completion_price + prompt_tokens / 1000 * prompt_price
+
+
+def record_glm_usage(reply):
+    # GLM3/GLM4 replies are openai-style json with a usage field
+    try:
+        usage = json.loads(reply).get('usage', {})
+    except (ValueError, AttributeError):
+        return
+    metrics.add_tokens(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
 
 
 def extract_data(text):
@@ -157,19 +220,8 @@ def get_glm_reply(query, model, temperature=0.7, max_tokens=1000, seed=175):
             'Content-Type': CONTENT_TYPE
         }
 
-        tol = 3
-        response = None
-        while tol:
-            try:
-                response = requests.post(url, headers=headers, data=json.dumps(payload))
-                break
-            except Exception as e:
-                print(f'Error occurred when getting proxy reply!\nError type:{e}\nRetrying...\n')
-                tol -= 1
-
-        if response is None:
-            print('Error occurred when getting proxy reply!\n')
-            return []
+        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=request_timeout())
+        response.raise_for_status()
 
         reply = response.content.decode('utf-8')
         replies = extract_data(reply)
@@ -190,26 +242,16 @@ def get_glm_reply(query, model, temperature=0.7, max_tokens=1000, seed=175):
             'Content-Type': CONTENT_TYPE
         }
 
-        tol = 3
-        response = None
-        while tol:
-            try:
-                response = requests.post(url, headers=headers, data=json.dumps(payload))
-                break
-            except Exception as e:
-                print(f'Error occurred when getting proxy reply!\nError type:{e}\nRetrying...\n')
-                tol -= 1
-
-        if response is None:
-            print('Error occurred when getting proxy reply!\n')
-            return []
+        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=request_timeout())
+        response.raise_for_status()
 
         reply = response.content.decode('utf-8')
         # print('reply:', reply)
+        record_glm_usage(reply)
         try:
             content = reply.split("\"content\":\"")[1].split("\",\"role\":\"assistant\"")[0]
         except Exception as e:
-            print(f'Error occurred when decoding reply!\nError type:{e}\n')
+            logger.warning('Error occurred when decoding reply!\nError type:%s', e)
             return []
         return content.split('\n')
 
@@ -228,37 +270,54 @@ def get_glm_reply(query, model, temperature=0.7, max_tokens=1000, seed=175):
             'Content-Type': CONTENT_TYPE
         }
 
-        tol = 3
-        response = None
-        while tol:
-            try:
-                response = requests.post(url, headers=headers, data=json.dumps(payload))
-                break
-            except Exception as e:
-                print(f'Error occurred when getting proxy reply!\nError type:{e}\nRetrying...\n')
-                tol -= 1
-
-        if response is None:
-            print('Error occurred when getting proxy reply!\n')
-            return []
+        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=request_timeout())
+        response.raise_for_status()
 
         reply = response.content.decode('utf-8')
         # print('reply:', reply)
+        record_glm_usage(reply)
         try:
             content = reply.split("\"content\":\"")[1].split("\",\"role\":\"assistant\"")[0]
         except Exception as e:
-            print(f'Error occurred when decoding reply!\nError type:{e}\n')
+            logger.warning('Error occurred when decoding reply!\nError type:%s', e)
             return []
         return content.split('\n')
 
     else:
-        print('Unsupported glm model!\n')
+        logger.warning('Unsupported glm model!')
         return []
 
 
+def _inference_batch(queries, **kwargs):
+    from models.inference_models import get_local_responses_batch
+    return get_local_responses_batch(queries, inference_model, inference_batch_tokenizer, inference_type, **kwargs)
+
+
+def _value_batch(prompt_answers, **kwargs):
+    from models.value_models import get_local_values_batch
+    return get_local_values_batch(prompt_answers, value_model, value_tokenizer, **kwargs)
+
+
+inference_batcher = value_batcher = None
+if LOCAL_BATCHING:
+    if INFERENCE_LOCAL:
+        from models.inference_models import batching_tokenizer
+        inference_batch_tokenizer = batching_tokenizer(inference_tokenizer)
+        inference_batcher = MicroBatcher(_inference_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT, 'inference_batcher')
+    if VALUE_LOCAL:
+        value_batcher = MicroBatcher(_value_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT, 'value_batcher')
+
+
 def local_inference_model(query, max_length=2048, truncation=True, do_sample=False, max_new_tokens=1024,
                           temperature=0.7):
     assert INFERENCE_LOCAL, "Inference model not implemented!\n"
+    from models.inference_models import get_local_response, get_local_response_llama, get_local_response_mistral
+    if inference_batcher is not None:
+        response, prompt_len, completion_len = inference_batcher.submit(
+            query, max_length=max_length, truncation=truncation, do_sample=do_sample, max_new_tokens=max_new_tokens,
+            temperature=temperature)
+        metrics.add_tokens(prompt_len, completion_len)
+        return response
     if inference_type == 'glm':
         return get_local_response(query, inference_model, inference_tokenizer, max_length=max_length,
                                   truncation=truncation,
@@ -273,4 +332,19 @@ def local_inference_model(query, max_length=2048, truncation=True, do_sample=Fal
 
 def local_value_model(prompt_answer, max_length=2048, low=0, high=1):
     assert VALUE_LOCAL, "Value model not implemented!\n"
+    from models.value_models import get_local_value
+    if value_batcher is not None:
+        value, prompt_len = value_batcher.submit(prompt_answer, max_length=max_length, low=low, high=high)
+        metrics.add_tokens(prompt_len, 0)
+        return value
     return get_local_value(prompt_answer, value_model, value_tokenizer, max_length=max_length, low=low, high=high)
+
+
+def server_value_model(prompt_answer, max_length=2048, low=0, high=1):
+    # single attempt against the shared value server (retries are handled in get_response)
+    response = requests.post(VALUE_SERVER_URL.rstrip('/') + '/score', timeout=request_timeout(),
+                             json={'texts': [prompt_answer], 'max_length': max_length, 'low': low, 'high': high})
+    response.raise_for_status()
+    result = response.json()
+    metrics.add_tokens(result['tokens'][0], 0)
+    return result['values'][0]
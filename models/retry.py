@@ -0,0 +1,213 @@
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils import trace
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryExhaustedError(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    # per-backend breaker: closed -> open after `failure_threshold` consecutive failures,
+    # open -> half-open after `reset_timeout` seconds, half-open -> closed on the first success
+    # while half-open only one probe call is let through, everyone else is rejected until its result is recorded
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout and not self.probing:
+                self.probing = True  # half-open, let one probe through
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+    def release(self):
+        # the call ended without a verdict on the backend, let the next caller probe
+        with self.lock:
+            self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+
+class LatencyWindow(object):
+    # sliding window of successful call latencies (seconds), used for the hedging threshold
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def quantile(self, q):
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[idx]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class RetryPolicy(object):
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, jitter=0.5, total_timeout=60.0,
+                 failure_threshold=5, reset_timeout=30.0, hedge=False, hedge_quantile=0.95, hedge_min_samples=20,
+                 hedge_backends=('glm', 'gpt')):
+        assert max_attempts >= 1, "max_attempts must be at least 1!"
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay  # first backoff delay (s)
+        self.max_delay = max_delay  # cap of a single backoff delay (s)
+        self.jitter = jitter  # fraction of the delay that is randomized
+        self.total_timeout = total_timeout  # deadline of one logical call, all attempts included (s), None = unbounded
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge = hedge  # send a duplicate request once an attempt exceeds the latency quantile
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_backends = tuple(hedge_backends)  # never hedge a local GPU model
+        self.breakers = {}
+        self.latencies = {}
+        self.lock = threading.Lock()
+        self._hedge_pool = None
+
+    def breaker(self, backend):
+        with self.lock:
+            if backend not in self.breakers:
+                self.breakers[backend] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[backend]
+
+    def latency(self, backend):
+        with self.lock:
+            if backend not in self.latencies:
+                self.latencies[backend] = LatencyWindow()
+            return self.latencies[backend]
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    def hedge_delay(self, backend):
+        if not self.hedge or backend not in self.hedge_backends:
+            return None
+        window = self.latency(backend)
+        if len(window) < self.hedge_min_samples:
+            return None
+        return window.quantile(self.hedge_quantile)
+
+    def call(self, backend, fn, *args, is_valid=bool, on_retry=None, deadline=None, **kwargs):
+        # run fn(*args, **kwargs) until it returns a valid result, the attempts run out,
+        # the total deadline passes or the backend breaker opens
+        # deadline: time.time() by which the caller needs the result, further bounds total_timeout
+        # a failure caused by the caller running out of time says nothing about the backend: it is neither
+        # retried nor counted by the breaker
+        breaker = self.breaker(backend)
+        caller_deadline = deadline
+        if self.total_timeout is not None:
+            deadline = min(deadline, time.time() + self.total_timeout) if deadline is not None \
+                else time.time() + self.total_timeout
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if deadline is not None and time.time() >= deadline:
+                break
+            if not breaker.allow():
+                raise CircuitOpenError(f'Circuit breaker open for backend <{backend}>')
+            if attempt and on_retry is not None:
+                on_retry(attempt, last_error)
+            start = time.time()
+            try:
+                with trace.span('attempt', 'backend', backend=backend, attempt=attempt):
+                    result = self._attempt(backend, fn, args, kwargs, deadline)
+            except Exception as e:
+                last_error = e
+            else:
+                if is_valid(result):
+                    breaker.record_success()
+                    self.latency(backend).add(time.time() - start)
+                    return result
+                last_error = None
+            if caller_deadline is not None and time.time() >= caller_deadline:
+                breaker.release()
+                break
+            breaker.record_failure()
+            if attempt + 1 < self.max_attempts:
+                delay = self.backoff(attempt)
+                if deadline is not None:
+                    delay = min(delay, max(0.0, deadline - time.time()))
+                with trace.span('backoff', 'backend', backend=backend, delay=delay):
+                    time.sleep(delay)
+        if last_error is not None:
+            raise RetryExhaustedError(f'<{backend}> failed after retries: {last_error}') from last_error
+        raise RetryExhaustedError(f'<{backend}> returned no valid response')
+
+    def _attempt(self, backend, fn, args, kwargs, deadline):
+        hedge_after = self.hedge_delay(backend)
+        if hedge_after is None:
+            return fn(*args, **kwargs)
+        if self._hedge_pool is None:
+            with self.lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedge')
+        # duplicates run in copies of the caller's context so per-call accounting still applies
+        first = self._hedge_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        done, _ = wait([first], timeout=hedge_after)
+        if done:
+            return first.result()
+        second = self._hedge_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                return result  # the slower duplicate is left to finish in the background
+        if error is not None:
+            raise error
+        raise TimeoutError(f'<{backend}> hedged request timed out')
+
+    def status(self):
+        return {backend: {'state': breaker.state, 'failures': breaker.failures,
+                          'p95': self.latency(backend).quantile(0.95)}
+                for backend, breaker in self.breakers.items()}
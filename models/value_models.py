@@ -1,9 +1,13 @@
+import logging
 import os
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '6'
 import torch
 import torch.nn as nn
 from transformers import AutoModel, AutoTokenizer, AutoModelForCausalLM
+from utils import metrics
+
+logger = logging.getLogger(__name__)
 
 
 # define your value model class
@@ -56,62 +60,62 @@ class Mistral_PRM(nn.Module):
 
 
 # get value model
-def get_value_model(base_model_dir, state_dict_file):
+def get_value_model(base_model_dir, state_dict_file, device=None):
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
     value_tokenizer = AutoTokenizer.from_pretrained(base_model_dir, trust_remote_code=True)
-    value_base_model = AutoModel.from_pretrained(base_model_dir, trust_remote_code=True).bfloat16().cuda()
+    value_base_model = AutoModel.from_pretrained(base_model_dir, trust_remote_code=True).bfloat16().to(device)
     if state_dict_file is None:
         return value_tokenizer, value_base_model
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print("device is set to: ", device, '\n')
+    logger.debug("device is set to: %s", device)
     vocab_size = value_base_model.config.padded_vocab_size
     VM = ChatGLM_VM(value_base_model, vocab_size, 1)
-    VM.load_state_dict(torch.load(state_dict_file))
+    VM.load_state_dict(torch.load(state_dict_file, map_location=device))
     VM.to(device)
     VM.eval()
     return value_tokenizer, VM
 
 
-def get_value_model_mistral(base_model_dir, state_dict_file):
+def get_value_model_mistral(base_model_dir, state_dict_file, device=None):
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
     value_tokenizer = AutoTokenizer.from_pretrained(base_model_dir, trust_remote_code=True)
     # value_tokenizer.pad_token = value_tokenizer.eos_token
     value_base_model = AutoModelForCausalLM.from_pretrained(base_model_dir, trust_remote_code=True, torch_dtype=torch.bfloat16)
     if state_dict_file is None:
         return value_tokenizer, value_base_model
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print("device is set to: ", device, '\n')
+    logger.debug("device is set to: %s", device)
     vocab_size = value_base_model.config.vocab_size
     VM = Mistral_VM(value_base_model, vocab_size)
-    VM.load_state_dict(torch.load(state_dict_file))
+    VM.load_state_dict(torch.load(state_dict_file, map_location=device))
     VM.to(device)
     VM.eval()
     return value_tokenizer, VM
 
 
 # get prm
-def get_value_model_prm(base_model_dir, state_dict_file):
+def get_value_model_prm(base_model_dir, state_dict_file, device=None):
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
     prm_tokenizer = AutoTokenizer.from_pretrained(base_model_dir, trust_remote_code=True)
-    prm_base_model = AutoModel.from_pretrained(base_model_dir, trust_remote_code=True).bfloat16().cuda()
+    prm_base_model = AutoModel.from_pretrained(base_model_dir, trust_remote_code=True).bfloat16().to(device)
     if state_dict_file is None:
         return prm_tokenizer, prm_base_model
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print("device is set to: ", device, '\n')
+    logger.debug("device is set to: %s", device)
     prm = ChatGLM_PRM(prm_base_model)
-    prm.load_state_dict(torch.load(state_dict_file))
+    prm.load_state_dict(torch.load(state_dict_file, map_location=device))
     prm.to(device)
     prm.eval()
     return prm_tokenizer, prm
 
 
-def get_value_model_prm_mistral(base_model_dir, state_dict_file):
+def get_value_model_prm_mistral(base_model_dir, state_dict_file, device=None):
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
     prm_tokenizer = AutoTokenizer.from_pretrained(base_model_dir, trust_remote_code=True)
     # prm_tokenizer.pad_token = prm_tokenizer.eos_token
     prm_base_model = AutoModelForCausalLM.from_pretrained(base_model_dir, trust_remote_code=True, torch_dtype=torch.bfloat16)
     if state_dict_file is None:
         return prm_tokenizer, prm_base_model
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print("device is set to: ", device, '\n')
+    logger.debug("device is set to: %s", device)
     prm = Mistral_PRM(prm_base_model)
-    prm.load_state_dict(torch.load(state_dict_file))
+    prm.load_state_dict(torch.load(state_dict_file, map_location=device))
     prm.to(device)
     prm.eval()
     return prm_tokenizer, prm
@@ -129,6 +133,23 @@ def get_local_value(prompt_answer, model, tokenizer, max_length=2048, low=0, hig
     input_ids = encoded_pair['input_ids'].to('cuda')
     # print(input_ids)
     attention_mask = encoded_pair['attention_mask'].to('cuda')
+    metrics.add_tokens(int(attention_mask.sum()), 0)
     value = model(input_ids, attention_mask).item()
     value = min(high, max(value, low))
     return value
+
+
+# batched local value model for models.batching, returns [(value, prompt_tokens)] in input order
+def get_local_values_batch(prompt_answers, model, tokenizer, max_length=2048, low=0, high=1, device='cuda'):
+    encoded = tokenizer(
+        list(prompt_answers),
+        padding='max_length',
+        max_length=max_length,
+        truncation=True,
+        return_tensors='pt',
+    )
+    input_ids = encoded['input_ids'].to(device)
+    attention_mask = encoded['attention_mask'].to(device)
+    with torch.no_grad():
+        values = model(input_ids, attention_mask).float().tolist()
+    return [(min(high, max(value, low)), int(mask.sum())) for value, mask in zip(values, attention_mask)]
@@ -0,0 +1,141 @@
+import json
+import logging
+import argparse
+import torch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from models.value_models import get_value_model, get_value_model_mistral, get_value_model_prm, \
+    get_value_model_prm_mistral, get_local_values_batch, ChatGLM_VM, Mistral_VM, ChatGLM_PRM, Mistral_PRM
+from models.batching import MicroBatcher
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# standalone value-model scoring service: loads the value model once and serves batched scoring over http,
+# so search workers use value_method='server' (VALUE_SERVER_URL in models/model.py) instead of each loading
+# their own copy of the weights
+#   python -m models.value_server --base_model_dir /path/to/base --state_dict VM_best_checkpoint.pt --type mistral
+# POST /score {"texts": [...], "max_length": 2048, "low": 0, "high": 1} -> {"values": [...], "tokens": [...]}
+# errors come back as {"error": ..., "detail": ...}, 400 for a malformed body and 500 if scoring fails
+# requests of all connected workers are merged by a MicroBatcher into batches of up to --batch_size texts
+# for a CPU smoke test run a small causal lm with --device cpu --type mistral and no state dict, the value
+# head is then randomly initialized (a prm has no head of its own, it reads the 'True' token probability)
+
+VALUE_TYPES = ['glm', 'mistral']
+
+
+def load_value_model(base_model_dir, state_dict_file=None, value_type='glm', use_prm=False, device=None):
+    assert value_type in VALUE_TYPES, f"Unsupported value model type {value_type}!"
+    device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+    if use_prm:
+        loader = get_value_model_prm if value_type == 'glm' else get_value_model_prm_mistral
+    else:
+        loader = get_value_model if value_type == 'glm' else get_value_model_mistral
+    tokenizer, model = loader(base_model_dir, state_dict_file, device=device)
+    if state_dict_file is None:
+        # the loaders return the bare base model, wrap it like a loaded checkpoint
+        dtype = next(model.parameters()).dtype
+        if use_prm:
+            model = ChatGLM_PRM(model) if value_type == 'glm' else Mistral_PRM(model)
+        else:
+            logger.warning('No state dict given, using a randomly initialized value head!')
+            if value_type == 'glm':
+                model = ChatGLM_VM(model, model.config.padded_vocab_size, 1)
+            else:
+                model = Mistral_VM(model, model.config.vocab_size)
+            model.LN.to(dtype=dtype)
+        model.to(device)
+        model.eval()
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer, model
+
+
+class ValueServer(object):
+    def __init__(self, model, tokenizer, device='cuda', batch_size=32, max_wait=0.01):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.batcher = MicroBatcher(self._score_batch, batch_size, max_wait, 'value_server')
+
+    def _score_batch(self, texts, max_length=2048, low=0, high=1):
+        return get_local_values_batch(texts, self.model, self.tokenizer, max_length=max_length, low=low, high=high,
+                                      device=self.device)
+
+    def score(self, texts, max_length=2048, low=0, high=1):
+        results = self.batcher.submit_many(texts, max_length=max_length, low=low, high=high)
+        return {'values': [value for value, _ in results], 'tokens': [tokens for _, tokens in results]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, body, code=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply({'ok': True, 'batches': self.server.value_server.batcher.stats()})
+        else:
+            self._reply({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._reply({'error': 'not found'}, 404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length))
+            texts = body['texts']
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError('texts must be a list of strings')
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply({'error': 'bad request', 'detail': repr(e)}, 400)
+            return
+        try:
+            result = self.server.value_server.score(texts, body.get('max_length', 2048), body.get('low', 0),
+                                                    body.get('high', 1))
+        except Exception as e:
+            logger.warning('Scoring failed: %r', e)
+            self._reply({'error': 'scoring failed', 'detail': repr(e)}, 500)
+            return
+        self._reply(result)
+
+    def log_message(self, fmt, *args):
+        logger.debug('%s ' + fmt, self.address_string(), *args)
+
+
+def serve(value_server, host='127.0.0.1', port=8800):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.value_server = value_server
+    logger.info('Value server listening on %s:%d', host, server.server_address[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched value-model scoring server')
+    parser.add_argument('--base_model_dir', type=str, required=True)
+    parser.add_argument('--state_dict', type=str, default=None)
+    parser.add_argument('--type', type=str, default='glm', choices=VALUE_TYPES)
+    parser.add_argument('--prm', action='store_true', help='load a process reward model')
+    parser.add_argument('--device', type=str, default=None, help='cuda / cpu, default cuda if available')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--max_wait', type=float, default=0.01, help='seconds to wait for a batch to fill')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--log_level', type=str, default='INFO')
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    tokenizer, model = load_value_model(args.base_model_dir, args.state_dict, args.type, args.prm, args.device)
+    device = next(model.parameters()).device
+    serve(ValueServer(model, tokenizer, device, args.batch_size, args.max_wait), args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from MCTS.task import MCTS_Task
+from ToT.task import ToT_Task
+from runners.dataset import iter_questions, question_text, question_answer
+from utils import trace
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# dataset-scale driver: streams questions from a jsonl file through a pool of concurrent searches and appends
+# every final_answer to the output jsonl as soon as it completes, e.g.
+#   python -m runners.batch --data data/math.jsonl --output runs/math_mcts.jsonl --mode mcts --workers 16 \
+#       --task_args '{"propose_method": "gpt", "value_method": "local", "iteration_limit": 20}'
+# a restarted run skips the ids already in the output file. questions that fail are logged and not written,
+# so the next run retries them.
+# --pool thread shares one backend (e.g. one local model) between all searches of the process,
+# --pool process spreads the searches over cores, each process loading its own backend
+# --trace PATH records a span trace of the run (chrome://tracing / ui.perfetto.dev); with --pool process every
+# question is traced in its worker to PATH.parts/<id>.json and the parts are merged into PATH at the end
+
+MODES = ['mcts', 'tot']
+POOLS = ['process', 'thread']
+SAMPLE_KEYS = ['value_samples', 'policy_samples']
+
+
+def make_task(mode, item, task_kwargs):
+    assert mode in MODES, f"Unsupported search mode {mode}!"
+    kwargs = dict(task_kwargs)
+    kwargs.setdefault('answer', question_answer(item))
+    if mode == 'mcts':
+        return MCTS_Task(question_text(item), **kwargs)
+    return ToT_Task(question_text(item), **kwargs)
+
+
+def solve(mode, qid, item, task_kwargs, keep_samples=False, trace_path=None):
+    # runs one question, returns the jsonl record (the tree stays in the worker)
+    if trace_path is not None:
+        with trace.tracing(trace_path):
+            return solve(mode, qid, item, task_kwargs, keep_samples)
+    task = make_task(mode, item, task_kwargs)
+    start = time.perf_counter()
+    final_answer, root = task.run()
+    record = {'id': qid}
+    record.update(final_answer)
+    if not keep_samples:
+        for key in SAMPLE_KEYS:
+            record.pop(key, None)
+    record['elapsed'] = time.perf_counter() - start
+    record['llm_calls'] = task.metrics.total().calls
+    return record
+
+
+def done_ids(path):
+    # ids already written by an earlier run; a line cut short by a crash is ignored (and trimmed before appending)
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                ids.add(str(json.loads(line)['id']))
+            except (ValueError, KeyError):
+                continue
+    return ids
+
+
+def trim_partial_line(path, chunk_size=65536):
+    # cut a last line left unterminated by a crash, so appended records start on a line of their own
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            idx = chunk.rfind(b'\n')
+            if idx != -1:
+                pos = start + idx + 1
+                break
+            pos = start
+        if pos < end:
+            logger.warning('Dropping %d bytes of a partial last record in %s', end - pos, path)
+            f.truncate(pos)
+
+
+def run_batch(data, output, mode='mcts', task_kwargs=None, workers=4, pool='process', keep_samples=False,
+              limit=None, log_level='WARNING', trace_path=None):
+    assert pool in POOLS, f"Unsupported pool {pool}!"
+    task_kwargs = task_kwargs or {}
+    trace_parts = None
+    if trace_path is not None:
+        if pool == 'process':
+            trace_parts = trace_path + '.parts'
+            os.makedirs(trace_parts, exist_ok=True)
+        else:
+            trace.start(trace_path)
+    trim_partial_line(output)
+    skip = done_ids(output)
+    if skip:
+        logger.info('Resuming, %d questions already in %s', len(skip), output)
+    if pool == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=setup_logging, initargs=(log_level,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    written = failed = submitted = 0
+    start = time.perf_counter()
+    with executor, open(output, 'a', encoding='utf-8') as out:
+        pending = {}
+        questions = iter_questions(data)
+        exhausted = False
+        while True:
+            # keep a bounded number of questions in flight so the input file is streamed, not loaded
+            while not exhausted and len(pending) < 2 * workers:
+                try:
+                    qid, item = next(questions)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if qid in skip:
+                    continue
+                if limit is not None and submitted >= limit:
+                    exhausted = True
+                    break
+                part = os.path.join(trace_parts, f'{qid}.json') if trace_parts is not None else None
+                pending[executor.submit(solve, mode, qid, item, task_kwargs, keep_samples, part)] = qid
+                submitted += 1
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                qid = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.warning('Question %s failed: %r', qid, e)
+                    continue
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                written += 1
+                if written % 10 == 0:
+                    logger.info('%d questions written, %d failed, %.1f questions/min', written, failed,
+                                written * 60 / (time.perf_counter() - start))
+    if trace_path is not None:
+        if trace_parts is not None:
+            parts = [os.path.join(trace_parts, name) for name in sorted(os.listdir(trace_parts))]
+            trace.merge(parts, trace_path)
+        else:
+            trace.stop()
+        logger.info('Trace written to %s', trace_path)
+    logger.info('Done: %d questions written, %d failed', written, failed)
+    return written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch MCTS/ToT runner over a jsonl question file')
+    parser.add_argument('--data', type=str, required=True, help='question file (jsonl)')
+    parser.add_argument('--output', type=str, required=True, help='output jsonl, appended to and resumed from')
+    parser.add_argument('--mode', type=str, default='mcts', choices=MODES)
+    parser.add_argument('--task_args', type=str, default='{}', help='task keyword arguments as json or a json file')
+    parser.add_argument('--workers', type=int, default=4, help='number of concurrent searches')
+    parser.add_argument('--pool', type=str, default='process', choices=POOLS)
+    parser.add_argument('--keep_samples', action='store_true', help='also write value/policy samples')
+    parser.add_argument('--limit', type=int, default=None, help='number of new questions to run')
+    parser.add_argument('--log_level', type=str, default='INFO')
+    parser.add_argument('--worker_log_level', type=str, default='WARNING')
+    parser.add_argument('--trace', type=str, default=None, help='write a span trace (chrome trace json) here')
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    if os.path.exists(args.task_args):
+        with open(args.task_args, 'r', encoding='utf-8') as f:
+            task_kwargs = json.load(f)
+    else:
+        task_kwargs = json.loads(args.task_args)
+    run_batch(args.data, args.output, args.mode, task_kwargs, args.workers, args.pool, args.keep_samples,
+              args.limit, args.worker_log_level, args.trace)
+
+
+if __name__ == '__main__':
+    main()
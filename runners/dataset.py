@@ -0,0 +1,41 @@
+import json
+
+# question files are jsonl, one object per line: {"id": ..., "content" | "question": ..., "answer": ...}
+QUESTION_KEYS = ['content', 'question', 'problem']
+ANSWER_KEYS = ['answer', 'real_answer', 'solution']
+
+
+def question_text(item):
+    for key in QUESTION_KEYS:
+        if key in item:
+            return item[key]
+    raise KeyError(f'No question field in item, expected one of {QUESTION_KEYS}')
+
+
+def question_answer(item):
+    for key in ANSWER_KEYS:
+        if key in item:
+            return item[key]
+    return None
+
+
+def iter_questions(path):
+    # streams (id, item); items without an id are numbered by line
+    with open(path, 'r', encoding='utf-8') as f:
+        idx = 0
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            yield str(item.get('id', idx)), item
+            idx += 1
+
+
+def load_questions(path, limit=None):
+    questions = []
+    for qid, item in iter_questions(path):
+        if limit is not None and len(questions) >= limit:
+            break
+        questions.append((qid, item))
+    return questions
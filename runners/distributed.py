@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import collections
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from runners.batch import MODES, solve, done_ids
+from runners.dataset import iter_questions
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# multi-host version of runners/batch.py: a coordinator owns the question file and the output jsonl and hands
+# out shards of questions as leases over http, workers on any host run them and post back one record per question
+#   python -m runners.distributed coordinator --data data/math.jsonl --output runs/math.jsonl --mode mcts \
+#       --task_args task.json --port 8765
+#   python -m runners.distributed worker --url http://coordinator:8765 --concurrency 4
+# a worker heartbeats its leases; a lease that is not renewed within lease_ttl (dead worker) goes back to the
+# queue. heartbeats stop renewing a lease once one question of it has run for max_task_time without a result
+# (worker stuck inside a search). an expired lease counts as a failed attempt of each of its open questions, so a
+# question that keeps crashing or hanging its worker fails after max_attempts. the first record posted for a
+# question wins, late duplicates are dropped.
+# endpoints (json bodies): POST /lease, /heartbeat, /result, GET /status
+
+
+class Coordinator(object):
+    def __init__(self, questions, output, mode='mcts', task_kwargs=None, keep_samples=False, shard_size=4,
+                 lease_ttl=120.0, max_attempts=3, max_task_time=3600.0):
+        assert mode in MODES, f"Unsupported search mode {mode}!"
+        self.output = output
+        self.mode = mode
+        self.task_kwargs = task_kwargs or {}
+        self.keep_samples = keep_samples
+        self.shard_size = shard_size
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.max_task_time = max_task_time  # seconds a lease may go without a posted result, None = unbounded
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        skip = done_ids(output)
+        self.items = {qid: item for qid, item in questions if qid not in skip}
+        self.queue = collections.deque(self.items.keys())
+        self.leases = {}  # {lease id: {'worker': name, 'qids': set, 'expires': time, 'progress': time}}
+        self.attempts = collections.Counter()
+        self.done = set()
+        self.failed = set()
+        self.next_lease = 0
+        self.out = open(output, 'a', encoding='utf-8')
+        logger.info('%d questions to run, %d already in %s', len(self.items), len(skip), output)
+        if not self.items:
+            self.finished.set()
+
+    def close(self):
+        with self.lock:
+            self.out.close()
+
+    def _fail_attempt(self, qid, error):
+        # caller holds the lock; requeue the question or give up on it after max_attempts
+        self.attempts[qid] += 1
+        logger.warning('Question %s failed (attempt %d): %s', qid, self.attempts[qid], error)
+        if self.attempts[qid] < self.max_attempts:
+            return True
+        self.failed.add(qid)
+        return False
+
+    def _expire(self, now):
+        for lease_id in [k for k, v in self.leases.items() if v['expires'] < now]:
+            lease = self.leases.pop(lease_id)
+            logger.warning('Lease %d of worker %s expired with %d open questions', lease_id, lease['worker'],
+                           len(lease['qids']))
+            open_qids = [q for q in lease['qids'] if q not in self.done and q not in self.failed]
+            self.queue.extendleft(q for q in open_qids if self._fail_attempt(q, f'lease {lease_id} expired'))
+        if len(self.done) + len(self.failed) == len(self.items):
+            self.finished.set()
+
+    def lease(self, worker):
+        with self.lock:
+            now = time.time()
+            self._expire(now)
+            if not self.queue:
+                if self.leases:
+                    return {'wait': min(5.0, self.lease_ttl / 4)}
+                return {'done': True}
+            qids = []
+            while self.queue and len(qids) < self.shard_size:
+                qid = self.queue.popleft()
+                if qid not in self.done and qid not in self.failed:
+                    qids.append(qid)
+            if not qids:
+                return {'wait': 1.0}
+            lease_id = self.next_lease
+            self.next_lease += 1
+            self.leases[lease_id] = {'worker': worker, 'qids': set(qids), 'expires': now + self.lease_ttl,
+                                     'progress': now}
+            return {'lease': lease_id, 'ttl': self.lease_ttl, 'mode': self.mode, 'task_kwargs': self.task_kwargs,
+                    'keep_samples': self.keep_samples, 'questions': [[qid, self.items[qid]] for qid in qids]}
+
+    def heartbeat(self, lease_ids):
+        with self.lock:
+            now = time.time()
+            alive = []
+            for lease_id in lease_ids:
+                lease = self.leases.get(lease_id)
+                if lease is None:
+                    continue
+                if self.max_task_time is not None and now - lease['progress'] > self.max_task_time:
+                    logger.warning('Lease %d of worker %s made no progress for %.0fs, not renewing', lease_id,
+                                   lease['worker'], now - lease['progress'])
+                    continue
+                lease['expires'] = now + self.lease_ttl
+                alive.append(lease_id)
+            return {'alive': alive}
+
+    def result(self, lease_id, qid, record=None, error=None):
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is not None:
+                lease['qids'].discard(qid)
+                lease['progress'] = time.time()
+                if not lease['qids']:
+                    del self.leases[lease_id]
+            if qid in self.done or qid in self.failed or qid not in self.items:
+                return {'accepted': False}
+            if record is not None:
+                self.out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self.out.flush()
+                self.done.add(qid)
+            elif self._fail_attempt(qid, error):
+                self.queue.append(qid)
+            if len(self.done) + len(self.failed) == len(self.items):
+                self.finished.set()
+            return {'accepted': record is not None}
+
+    def status(self):
+        with self.lock:
+            return {'total': len(self.items), 'done': len(self.done), 'failed': len(self.failed),
+                    'queued': len(self.queue), 'leases': len(self.leases),
+                    'workers': sorted(set(v['worker'] for v in self.leases.values()))}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, body, code=200):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._reply(self.server.coordinator.status())
+        else:
+            self._reply({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        coordinator = self.server.coordinator
+        if self.path == '/lease':
+            self._reply(coordinator.lease(body.get('worker', '')))
+        elif self.path == '/heartbeat':
+            self._reply(coordinator.heartbeat(body.get('leases', [])))
+        elif self.path == '/result':
+            self._reply(coordinator.result(body['lease'], body['id'], body.get('record'), body.get('error')))
+        else:
+            self._reply({'error': 'not found'}, 404)
+
+    def log_message(self, fmt, *args):
+        logger.debug('%s ' + fmt, self.address_string(), *args)
+
+
+def serve(coordinator, host='0.0.0.0', port=8765, linger=10.0):
+    # blocks until every question is done or failed, then keeps answering 'done' for linger seconds
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.coordinator = coordinator
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info('Coordinator listening on %s:%d', host, server.server_address[1])
+    try:
+        while not coordinator.finished.wait(30):
+            logger.info('Status: %s', json.dumps(coordinator.status()))
+        logger.info('All questions finished: %s', json.dumps(coordinator.status()))
+        time.sleep(linger)
+    finally:
+        server.shutdown()
+        server.server_close()
+        coordinator.close()
+    return coordinator.status()
+
+
+def _post(url, path, body, timeout=30):
+    request = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class Worker(object):
+    def __init__(self, url, name=None, concurrency=1, retry_interval=5.0, max_unreachable=6):
+        self.url = url
+        self.name = name or f'{socket.gethostname()}:{id(self)}'
+        self.concurrency = concurrency
+        self.retry_interval = retry_interval
+        self.max_unreachable = max_unreachable  # consecutive failed contacts before giving up
+        self.held = set()  # lease ids held by this worker
+        self.heartbeat_interval = 10.0  # shortened to a third of the coordinator's lease ttl
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            with self.lock:
+                leases = list(self.held)
+            if not leases:
+                continue
+            try:
+                _post(self.url, '/heartbeat', {'worker': self.name, 'leases': leases})
+            except (urllib.error.URLError, OSError) as e:
+                logger.warning('Heartbeat failed: %s', e)
+
+    def _loop(self):
+        unreachable = 0
+        while not self.stopped.is_set():
+            try:
+                reply = _post(self.url, '/lease', {'worker': self.name})
+                unreachable = 0
+            except (urllib.error.URLError, OSError) as e:
+                unreachable += 1
+                if unreachable >= self.max_unreachable:
+                    logger.warning('Coordinator unreachable, stopping: %s', e)
+                    return
+                time.sleep(self.retry_interval)
+                continue
+            if reply.get('done'):
+                return
+            if 'wait' in reply:
+                time.sleep(reply['wait'])
+                continue
+            lease_id = reply['lease']
+            with self.lock:
+                self.heartbeat_interval = min(self.heartbeat_interval, reply['ttl'] / 3)
+                self.held.add(lease_id)
+            try:
+                for qid, item in reply['questions']:
+                    body = {'worker': self.name, 'lease': lease_id, 'id': qid}
+                    try:
+                        body['record'] = solve(reply['mode'], qid, item, reply['task_kwargs'], reply['keep_samples'])
+                    except Exception as e:
+                        body['error'] = repr(e)
+                    _post(self.url, '/result', body)
+            except (urllib.error.URLError, OSError) as e:
+                # the lease expires on the coordinator and its questions are handed to someone else
+                logger.warning('Lost contact while posting results of lease %d: %s', lease_id, e)
+            finally:
+                with self.lock:
+                    self.held.discard(lease_id)
+
+    def run(self):
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self._loop) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed MCTS/ToT runs over http')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--log_level', type=str, default='INFO')
+    sub = parser.add_subparsers(dest='role', required=True)
+    coord = sub.add_parser('coordinator', parents=[common])
+    coord.add_argument('--data', type=str, required=True, help='question file (jsonl)')
+    coord.add_argument('--output', type=str, required=True, help='output jsonl, appended to and resumed from')
+    coord.add_argument('--mode', type=str, default='mcts', choices=MODES)
+    coord.add_argument('--task_args', type=str, default='{}', help='task keyword arguments as json or a json file')
+    coord.add_argument('--keep_samples', action='store_true')
+    coord.add_argument('--shard_size', type=int, default=4, help='questions per lease')
+    coord.add_argument('--lease_ttl', type=float, default=120.0, help='seconds without heartbeat before reassigning')
+    coord.add_argument('--max_attempts', type=int, default=3)
+    coord.add_argument('--max_task_time', type=float, default=3600.0,
+                       help='seconds a lease may go without a result before heartbeats stop renewing it')
+    coord.add_argument('--host', type=str, default='0.0.0.0')
+    coord.add_argument('--port', type=int, default=8765)
+    work = sub.add_parser('worker', parents=[common])
+    work.add_argument('--url', type=str, required=True)
+    work.add_argument('--name', type=str, default=None)
+    work.add_argument('--concurrency', type=int, default=1, help='searches run in parallel by this worker')
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    if args.role == 'coordinator':
+        if os.path.exists(args.task_args):
+            with open(args.task_args, 'r', encoding='utf-8') as f:
+                task_kwargs = json.load(f)
+        else:
+            task_kwargs = json.loads(args.task_args)
+        coordinator = Coordinator(iter_questions(args.data), args.output, args.mode, task_kwargs, args.keep_samples,
+                                  args.shard_size, args.lease_ttl, args.max_attempts, args.max_task_time)
+        serve(coordinator, args.host, args.port)
+    else:
+        Worker(args.url, args.name, args.concurrency).run()
+
+
+if __name__ == '__main__':
+    main()
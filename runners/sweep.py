@@ -0,0 +1,215 @@
+import os
+import csv
+import time
+import json
+import random
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from models.cassette import use_cassette, get_cassette
+from models.mock_model import set_mock_model, get_mock_model
+from MCTS.task import MCTS_Task
+from runners.dataset import load_questions, question_text, question_answer
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# hyperparameter sweep of MCTS_Task over a replay cassette (see models/cassette.py) or the mock backend:
+#   python -m runners.sweep --data data/math.jsonl --cassette runs/math.db --search random --samples 32
+# every worker process runs all configs of one question and shares that question's value cache between them,
+# so a state valued under one config is never valued again under another.
+# one row per (question, config) goes to a csv file, or parquet if the output ends with .parquet (needs pyarrow)
+
+SEARCH_SPACE = {
+    'exploration_constant': [0.4, 0.7, 1.0],
+    'alpha': [0.3, 0.5, 0.7],
+    'branch': [2, 3],
+    'roll_branch': [1, 2],
+    'end_gate': [0.8, 0.9],
+    'roll_policy': ['greedy', 'random'],
+}
+BACKENDS = ['replay', 'mock']
+
+
+def grid_configs(space):
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_configs(space, samples, seed=0):
+    # a list samples one of its items, a (low, high) tuple of floats samples uniformly from the range
+    rng = random.Random(seed)
+    configs = []
+    seen = set()
+    for _ in range(samples * 10):
+        if len(configs) >= samples:
+            break
+        config = {}
+        for key, choices in space.items():
+            if isinstance(choices, tuple):
+                config[key] = round(rng.uniform(*choices), 4)
+            else:
+                config[key] = rng.choice(choices)
+        frozen = json.dumps(config, sort_keys=True)
+        if frozen not in seen:
+            seen.add(frozen)
+            configs.append(config)
+    return configs
+
+
+def init_worker(backend, cassette_path, mock_kwargs, log_level):
+    setup_logging(log_level)
+    if backend == 'replay':
+        use_cassette(cassette_path, 'replay')
+    else:
+        set_mock_model(**mock_kwargs)
+
+
+def run_question(qid, item, configs, task_kwargs):
+    value_cache = {}  # {y: value}, shared by all configs of this question and freed with it
+    rows = []
+    for config_id, config in configs:
+        # every config replays the recording (or mock stream) from its start
+        if get_cassette() is not None:
+            get_cassette().rewind()
+        else:
+            get_mock_model().reset()
+        kwargs = dict(task_kwargs)
+        kwargs.update(config)
+        task = MCTS_Task(question_text(item), answer=question_answer(item), shared_value_cache=value_cache, **kwargs)
+        start = time.perf_counter()
+        try:
+            final_answer, root = task.run()
+            error = ''
+        except Exception as e:
+            logger.warning('Run failed on question %s with config %d: %s', qid, config_id, e)
+            final_answer, error = {}, repr(e)
+        wall = time.perf_counter() - start
+        proposal = task.metrics.total(kind='proposal')
+        value = task.metrics.total(kind='value')
+        total = task.metrics.total()
+        row = {'question_id': qid, 'config_id': config_id}
+        row.update(config)
+        row.update({
+            'accurate': bool(final_answer.get('accurate', False)),
+            'finish': final_answer.get('finish', None),
+            'llm_calls': total.calls,
+            'proposal_calls': proposal.calls,
+            'value_calls': value.calls,
+            'value_cache_hits': value.cache_hits,
+            'failed_calls': total.failures,
+            'prompt_tokens': total.prompt_tokens,
+            'completion_tokens': total.completion_tokens,
+            'backend_latency': total.latency,
+            'wall': wall,
+            'nodes': task.node_count,
+            'error': error,
+        })
+        rows.append(row)
+    return rows
+
+
+def write_results(rows, path):
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Writing parquet results needs pyarrow, install it or use a .csv output')
+        pq.write_table(pa.Table.from_pylist(rows), path)
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def summarize(rows, keys):
+    # mean accuracy / calls / latency per config, best accuracy first
+    groups = {}
+    for row in rows:
+        groups.setdefault(row['config_id'], []).append(row)
+    summary = []
+    for config_id, group in groups.items():
+        n = len(group)
+        item = {'config_id': config_id}
+        item.update({k: group[0][k] for k in keys})
+        item.update({
+            'questions': n,
+            'accuracy': sum(r['accurate'] for r in group) / n,
+            'llm_calls': sum(r['llm_calls'] for r in group) / n,
+            'value_cache_hits': sum(r['value_cache_hits'] for r in group) / n,
+            'wall': sum(r['wall'] for r in group) / n,
+        })
+        summary.append(item)
+    summary.sort(key=lambda x: (-x['accuracy'], x['llm_calls']))
+    return summary
+
+
+def sweep(questions, configs, task_kwargs, backend='replay', cassette_path=None, mock_kwargs=None, workers=None,
+          log_level='WARNING'):
+    assert backend in BACKENDS, f"Unsupported sweep backend {backend}!"
+    if backend == 'replay':
+        assert cassette_path is not None and os.path.exists(cassette_path), 'Replay sweep needs a recorded cassette!'
+    numbered = list(enumerate(configs))
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(backend, cassette_path, mock_kwargs or {}, log_level)) as pool:
+        futures = {pool.submit(run_question, qid, item, numbered, task_kwargs): qid for qid, item in questions}
+        for future in as_completed(futures):
+            rows.extend(future.result())
+            logger.info('Question %s done (%d/%d)', futures[future], len(rows) // len(numbered), len(futures))
+    rows.sort(key=lambda r: (r['config_id'], r['question_id']))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MCTS hyperparameter sweep over replayed searches')
+    parser.add_argument('--data', type=str, required=True, help='question file (jsonl)')
+    parser.add_argument('--limit', type=int, default=None, help='number of questions')
+    parser.add_argument('--backend', type=str, default='replay', choices=BACKENDS)
+    parser.add_argument('--cassette', type=str, default=None, help='recorded cassette for the replay backend')
+    parser.add_argument('--space', type=str, default=None, help='json file {param: [values]} replacing SEARCH_SPACE')
+    parser.add_argument('--search', type=str, default='grid', choices=['grid', 'random'])
+    parser.add_argument('--samples', type=int, default=16, help='configs drawn by the random search')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', type=str, default='sweep.csv', help='.csv or .parquet')
+    parser.add_argument('--propose_method', type=str, default='glm', help='method the cassette was recorded with')
+    parser.add_argument('--value_method', type=str, default='glm', help='method the cassette was recorded with')
+    parser.add_argument('--iteration_limit', type=int, default=10)
+    parser.add_argument('--roll_forward_steps', type=int, default=2)
+    parser.add_argument('--verify_method', type=str, default='string')
+    parser.add_argument('--log_level', type=str, default='INFO')
+    parser.add_argument('--worker_log_level', type=str, default='WARNING')
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    space = SEARCH_SPACE
+    if args.space is not None:
+        with open(args.space, 'r', encoding='utf-8') as f:
+            # {"alpha": [0.3, 0.5]} lists values, {"alpha": {"low": 0.2, "high": 0.8}} a range for --search random
+            space = {k: (v['low'], v['high']) if isinstance(v, dict) else v for k, v in json.load(f).items()}
+    if args.search == 'grid':
+        configs = grid_configs(space)
+    else:
+        configs = random_configs(space, args.samples, args.seed)
+    questions = load_questions(args.data, args.limit)
+    task_kwargs = {'propose_method': args.propose_method, 'value_method': args.value_method,
+                   'iteration_limit': args.iteration_limit, 'roll_forward_steps': args.roll_forward_steps,
+                   'verify_method': args.verify_method}
+    if args.backend == 'mock':
+        task_kwargs.update({'propose_method': 'mock', 'value_method': 'mock'})
+    logger.info('Sweeping %d configs over %d questions', len(configs), len(questions))
+
+    rows = sweep(questions, configs, task_kwargs, args.backend, args.cassette, {'seed': args.seed}, args.workers,
+                 args.worker_log_level)
+    if rows:
+        write_results(rows, args.output)
+    for item in summarize(rows, list(space.keys()))[:10]:
+        logger.info(json.dumps(item))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# the task prompts (tasks/) and the answer checks (utils/verify_MATH.py, utils/verify_llm.py,
+# utils/solution_summary_extractor.py) are not part of this tree; tests/fixtures holds minimal stand-ins so the
+# search code runs on the mock backend. appended to sys.path, the real modules win wherever they are installed
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+if FIXTURES not in sys.path:
+    sys.path.append(FIXTURES)
@@ -0,0 +1,35 @@
+import re
+
+# test stand-in for the task prompts: every prompt is its arguments joined, which is all the mock backend needs
+
+
+def _prompt(*parts, **kwargs):
+    return '|'.join(str(part) for part in parts)
+
+
+class SearchTask(object):
+    def __init__(self, data, propose_method='glm', value_method='glm'):
+        self.question = data
+        self.propose_method = propose_method
+        self.value_method = value_method
+        self.value_cache = {}
+
+    single_propose_prompt_wrap = staticmethod(_prompt)
+    zero_single_propose_wrap = staticmethod(_prompt)
+    zero_single_propose_wrap_mistral = staticmethod(_prompt)
+    zero_single_propose_wrap_gpt = staticmethod(_prompt)
+    zero_single_propose_wrap_use_reflection = staticmethod(_prompt)
+    zero_single_propose_wrap_use_reflection_gpt = staticmethod(_prompt)
+    single_reflection_wrap = staticmethod(_prompt)
+    single_reflection_wrap_simple = staticmethod(_prompt)
+    single_reflection_wrap_simple_mistral = staticmethod(_prompt)
+    value_prompt_wrap = staticmethod(_prompt)
+    summary_prompt_wrap = staticmethod(_prompt)
+    MATH_summary_prompt_wrap = staticmethod(_prompt)
+    evaluate_summary_prompt_wrap = staticmethod(_prompt)
+    general_evaluate_summary_prompt_wrap = staticmethod(_prompt)
+
+    @staticmethod
+    def value_outputs_unwrap(value_outputs, low=0.0, high=1.0):
+        numbers = re.findall(r'-?[0-9]+\.?[0-9]*', ''.join(value_outputs))
+        return min(max(low, float(numbers[-1])), high) if numbers else low
@@ -0,0 +1,5 @@
+# test stand-in: the tail of the solution, where the mock backend states its answer
+
+
+def extract_summary_from_solution(solution):
+    return solution[-50:]
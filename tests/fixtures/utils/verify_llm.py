@@ -0,0 +1,5 @@
+# test stand-in: no model to verify with, nothing is accepted
+
+
+def llm_verify(summary, answer):
+    return False
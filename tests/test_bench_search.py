@@ -0,0 +1,36 @@
+import argparse
+from models.mock_model import set_mock_model
+from bench.bench_search import bench_mcts, bench_tot
+
+# smoke test of the search engines on the mock backend: no model, no gpu, no api key
+# OVERHEAD_LIMIT_US is a coarse regression gate on python overhead per tree node, far above normal values so it
+# only trips on order-of-magnitude slowdowns
+
+OVERHEAD_LIMIT_US = 20000
+
+
+def bench_args(**kwargs):
+    args = {'branch': [2], 'roll_forward_steps': [2], 'iteration_limit': [3], 'roll_policy': 'greedy',
+            'tot_algorithm': ['dfs', 'bfs'], 'max_depth': [3], 'select_branch': 2, 'seed': 0, 'repeats': 1,
+            'memory': False}
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_bench_mcts():
+    mock = set_mock_model(seed=0, value_dist='uniform')
+    rows = bench_mcts(bench_args(), mock)
+    assert len(rows) == 1
+    row = rows[0]
+    assert row['rounds'] >= 1
+    assert row['nodes'] > 1
+    assert row['overhead_per_node_us'] < OVERHEAD_LIMIT_US
+
+
+def test_bench_tot():
+    mock = set_mock_model(seed=0, value_dist='uniform')
+    rows = bench_tot(bench_args(), mock)
+    assert [row['algorithm'] for row in rows] == ['dfs', 'bfs']
+    for row in rows:
+        assert row['nodes'] > 1
+        assert row['overhead_per_node_us'] < OVERHEAD_LIMIT_US
@@ -0,0 +1,26 @@
+import pytest
+from models.mock_model import set_mock_model
+from ToT.task import ToT_Task
+
+# best_first on the mock backend: the budgets hold exactly, also in the middle of an expansion
+
+
+def best_first_task(**kwargs):
+    set_mock_model(seed=5, value_dist='depth')
+    return ToT_Task('What is 1+1?', propose_method='mock', value_method='mock', algorithm='best_first', lang='en',
+                    answer='2', end_gate=2, max_depth=6, **kwargs)
+
+
+@pytest.mark.parametrize('call_budget', [1, 7, 20])
+def test_call_budget(call_budget):
+    task = best_first_task(call_budget=call_budget)
+    task.run()
+    assert task.call_count == call_budget
+    assert task.metrics.total(phase='search').calls == call_budget
+
+
+@pytest.mark.parametrize('node_budget', [2, 5, 12])
+def test_node_budget(node_budget):
+    task = best_first_task(node_budget=node_budget)
+    task.run()
+    assert task.node_count == node_budget
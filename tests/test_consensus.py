@@ -0,0 +1,78 @@
+from models.mock_model import set_mock_model
+from MCTS.base import treeNode
+from MCTS.mcts import MCTS_search
+from MCTS.task import MCTS_Task
+
+# consensus stop on a hand-built tree: the summaries come from a table, no model
+
+
+def end_leaves(root, leaves):
+    for pcd, value in leaves:
+        root.append_children(pcd)
+        root.children[pcd].update_value(value)
+        root.children[pcd].reflection = '<end>'
+    root.isFullyExpanded = True
+
+
+def consensus_task(summaries, **kwargs):
+    task = MCTS_Task('What is 1+1?', propose_method='mock', value_method='mock', iteration_limit=1, answer='2',
+                     end_gate=0.6, sample_value='full', consensus_min_leaves=3, **kwargs)
+    task.clear_cache()
+    summarized = []
+
+    def get_summary(y):
+        summarized.append(y)
+        return summaries[y]
+
+    task.get_MATH_summary = get_summary
+    return task, summarized
+
+
+def test_consensus_returns_best_leaf_of_winning_answer():
+    summaries = {'a': 'The answer is 2', 'b': 'The answer is 2', 'c': 'The answer is 3', 'd': 'The answer is 2'}
+    task, _ = consensus_task(summaries, consensus_share=0.6)
+    root = treeNode('')
+    end_leaves(root, [('a', 0.9), ('b', 0.8), ('c', 0.95), ('d', 0.7)])
+    winner = task.consensus_reached(root)
+    assert winner is root.children['a']
+
+
+def test_consensus_summarizes_only_new_leaves():
+    summaries = {'a': 'The answer is 2', 'b': 'The answer is 3', 'c': 'The answer is 4', 'd': 'The answer is 3'}
+    task, summarized = consensus_task(summaries, consensus_margin=1.0)
+    root = treeNode('')
+    end_leaves(root, [('a', 0.9), ('b', 0.8), ('c', 0.7)])
+    assert task.consensus_reached(root) is None
+    assert sorted(summarized) == ['a', 'b', 'c']
+    end_leaves(root, [('d', 0.9)])
+    assert task.consensus_reached(root) is None
+    assert sorted(summarized) == ['a', 'b', 'c', 'd']
+
+
+def test_consensus_ignores_leaves_without_answer():
+    summaries = {'a': 'no idea', 'b': 'unclear', 'c': 'The answer is 2', 'd': 'cannot tell'}
+    task, _ = consensus_task(summaries, consensus_share=0.6)
+    root = treeNode('')
+    end_leaves(root, [('a', 0.9), ('b', 0.9), ('c', 0.5), ('d', 0.9)])
+    # one leaf with an answer is below consensus_min_leaves, unparseable summaries must not win
+    assert task.consensus_reached(root) is None
+
+
+def test_progress_stop_keeps_consensus_winner():
+    # the callback stops the search in the round that first has end leaves, the round consensus is reached in
+    set_mock_model(seed=0, end_prob=1.0)
+    seen = []
+
+    def on_progress(progress):
+        seen.append(progress)
+        return bool(progress['root'].get_all_end_root_nodes_vm(2))
+
+    task = MCTS_Task('What is 1+1?', propose_method='mock', value_method='mock', iteration_limit=20, answer='2',
+                     end_gate=2, sample_value='full', consensus_share=0.01, consensus_min_leaves=1,
+                     on_progress=on_progress)
+    task.clear_cache()
+    task.set_limit_type()
+    root, node, finish = MCTS_search(task)
+    assert seen[-1]['consensus'] is not None
+    assert node is seen[-1]['consensus']
+    assert seen[-1]['node'] is node
@@ -0,0 +1,106 @@
+import json
+import time
+import socket
+import threading
+import urllib.error
+import pytest
+from http.server import ThreadingHTTPServer
+from runners.batch import solve
+from runners.distributed import Coordinator, Worker, serve, _post, _Handler
+
+# localhost run of the coordinator and two workers on the mock backend
+
+TASK_KWARGS = {'propose_method': 'mock', 'value_method': 'mock', 'iteration_limit': 2}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def questions(n):
+    return [(str(i), {'question': f'What is {i} + {i}?', 'answer': str(2 * i)}) for i in range(n)]
+
+
+def test_localhost_run_requeues_dead_lease(tmp_path):
+    output = tmp_path / 'out.jsonl'
+    coordinator = Coordinator(questions(6), str(output), 'mcts', TASK_KWARGS, shard_size=2, lease_ttl=1.0)
+    port = free_port()
+    server = threading.Thread(target=serve, args=(coordinator, '127.0.0.1', port, 0.5))
+    server.start()
+    url = f'http://127.0.0.1:{port}'
+    time.sleep(0.3)
+    # a worker that takes a lease and never comes back
+    assert 'lease' in _post(url, '/lease', {'worker': 'dead'})
+    workers = [threading.Thread(target=Worker(url, f'w{i}', 2).run) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    server.join(60)
+    status = coordinator.status()
+    assert status['done'] == 6 and status['failed'] == 0
+    ids = sorted(json.loads(line)['id'] for line in output.read_text(encoding='utf-8').splitlines())
+    assert ids == [str(i) for i in range(6)]
+
+
+def test_stuck_lease_is_not_renewed(tmp_path):
+    coordinator = Coordinator(questions(2), str(tmp_path / 'out.jsonl'), 'mcts', TASK_KWARGS, shard_size=2,
+                              lease_ttl=0.2, max_task_time=0.3)
+    lease = coordinator.lease('stuck')['lease']
+    assert coordinator.heartbeat([lease]) == {'alive': [lease]}
+    time.sleep(0.35)
+    assert coordinator.heartbeat([lease]) == {'alive': []}
+    time.sleep(0.25)
+    assert coordinator.lease('other')['questions']
+    coordinator.close()
+
+
+def test_expired_lease_counts_as_attempt(tmp_path):
+    # a question whose worker dies every time fails after max_attempts instead of being leased forever
+    coordinator = Coordinator(questions(1), str(tmp_path / 'out.jsonl'), 'mcts', TASK_KWARGS, lease_ttl=0.05,
+                              max_attempts=2)
+    for attempt in range(2):
+        reply = coordinator.lease(f'dead{attempt}')
+        assert [qid for qid, _ in reply['questions']] == ['0']
+        time.sleep(0.1)
+    assert coordinator.lease('late') == {'done': True}
+    assert coordinator.finished.is_set()
+    assert coordinator.status()['failed'] == 1
+    # a late record of the failed question is dropped
+    assert coordinator.result(reply['lease'], '0', {'id': '0'}) == {'accepted': False}
+    coordinator.close()
+
+
+def test_unknown_endpoint_is_an_error(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.coordinator = Coordinator(questions(1), str(tmp_path / 'out.jsonl'), 'mcts', TASK_KWARGS)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            _post(f'http://127.0.0.1:{server.server_address[1]}', '/nope', {})
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.coordinator.close()
+
+
+def test_failing_question_gives_up_after_max_attempts(tmp_path):
+    # no search limit at all: every attempt raises in the worker and is posted back as an error
+    task_kwargs = {'propose_method': 'mock', 'value_method': 'mock'}
+    with pytest.raises(ValueError):
+        solve('mcts', '0', questions(1)[0][1], task_kwargs, False)
+    coordinator = Coordinator(questions(2), str(tmp_path / 'out.jsonl'), 'mcts', task_kwargs, shard_size=1,
+                              max_attempts=2)
+    port = free_port()
+    server = threading.Thread(target=serve, args=(coordinator, '127.0.0.1', port, 0.5))
+    server.start()
+    time.sleep(0.3)
+    Worker(f'http://127.0.0.1:{port}', 'w0').run()
+    server.join(60)
+    status = coordinator.status()
+    assert status['done'] == 0 and status['failed'] == 2
+    assert coordinator.attempts == {'0': 2, '1': 2}
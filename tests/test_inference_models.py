@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+tokenizers = pytest.importorskip('tokenizers')
+
+from models.inference_models import batching_tokenizer
+
+
+def test_batching_tokenizer_leaves_shared_tokenizer_alone():
+    vocab = {'<unk>': 0, '</s>': 1, 'step': 2, 'one': 3}
+    word_level = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token='<unk>'))
+    word_level.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    shared = transformers.PreTrainedTokenizerFast(tokenizer_object=word_level, unk_token='<unk>', eos_token='</s>')
+    batch = batching_tokenizer(shared)
+    assert shared.pad_token is None and shared.padding_side == 'right'
+    assert batch.pad_token == '</s>' and batch.padding_side == 'left'
+    ids = batch(['step', 'step one'], padding=True)['input_ids']
+    assert ids[0] == [batch.pad_token_id, 2]
@@ -0,0 +1,45 @@
+import threading
+import pytest
+from models.mock_model import set_mock_model
+from MCTS.task import MCTS_Task
+
+# budget-only MCTS runs on the mock backend: the limits hold exactly and the search always ends
+
+
+def budget_task(seed=1, end_prob=0.15, **kwargs):
+    set_mock_model(seed=seed, end_prob=end_prob)
+    return MCTS_Task('What is 1+1?', propose_method='mock', value_method='mock', answer='2', end_gate=2, **kwargs)
+
+
+def run_with_timeout(task, seconds=30):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(answer=task.run()), daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), 'search did not stop'
+    return result['answer']
+
+
+@pytest.mark.parametrize('sample_value', ['simple', 'full'])
+@pytest.mark.parametrize('limit', [1, 7, 23])
+def test_llm_call_limit(sample_value, limit):
+    evaluate = 'math' if sample_value == 'full' else ''
+    task = budget_task(llm_call_limit=limit, sample_value=sample_value, evaluate=evaluate)
+    run_with_timeout(task)
+    assert task.budget_usage()['llm_calls'] == limit
+
+
+@pytest.mark.parametrize('limit', [1, 5, 12])
+def test_value_call_limit(limit):
+    task = budget_task(value_call_limit=limit)
+    run_with_timeout(task)
+    assert task.budget_usage()['value_calls'] == limit
+
+
+def test_all_ended_tree_stops():
+    # every proposal states an answer, so all leaves end below end_gate and rounds stop spending anything
+    task = budget_task(end_prob=1.0, llm_call_limit=1000, branch=2)
+    final_answer, root = run_with_timeout(task)
+    assert task.budget_usage()['llm_calls'] < 1000
+    assert root.children
+    assert all(child.reflection == '<end>' for child in root.children.values())
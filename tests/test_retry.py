@@ -0,0 +1,46 @@
+import time
+import pytest
+from models.retry import RetryPolicy, RetryExhaustedError, CircuitOpenError
+
+
+def failing(error, delay=0.0):
+    def fn():
+        time.sleep(delay)
+        raise error
+    return fn
+
+
+def test_caller_deadline_is_not_a_backend_failure():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.0, failure_threshold=1)
+    retries = []
+    with pytest.raises(RetryExhaustedError):
+        policy.call('slow', failing(TimeoutError('cut short'), 0.05), on_retry=lambda *a: retries.append(a),
+                    deadline=time.time() + 0.01)
+    breaker = policy.breaker('slow')
+    assert breaker.failures == 0 and breaker.state == 'closed'
+    assert retries == []
+
+
+def test_backend_error_is_counted():
+    policy = RetryPolicy(max_attempts=2, base_delay=0.0, failure_threshold=2)
+    with pytest.raises(RetryExhaustedError):
+        policy.call('broken', failing(ConnectionError('down')), deadline=time.time() + 10)
+    assert policy.breaker('broken').state == 'open'
+    with pytest.raises(CircuitOpenError):
+        policy.call('broken', lambda: 'ok')
+
+
+def test_half_open_lets_one_probe_through():
+    policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(RetryExhaustedError):
+        policy.call('flaky', failing(ConnectionError('down')))
+    time.sleep(0.06)
+    breaker = policy.breaker('flaky')
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    # the probe is out, everyone else is rejected until its result is recorded
+    with pytest.raises(CircuitOpenError):
+        policy.call('flaky', lambda: 'ok')
+    breaker.record_success()
+    assert policy.call('flaky', lambda: 'ok') == 'ok'
+    assert breaker.state == 'closed'
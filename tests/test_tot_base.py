@@ -0,0 +1,28 @@
+import sys
+import pytest
+from ToT.base import Node, CompactNode
+
+
+@pytest.mark.parametrize('node_cls', [Node, CompactNode])
+def test_get_best_v_deep_tree(node_cls):
+    root = node_cls('')
+    node = root
+    for i in range(sys.getrecursionlimit() + 100):
+        node, child = node.append_children('s')
+        child.update_value(0.5)
+        node = child
+    assert root.getBestV() == (node, 0.5)
+
+
+@pytest.mark.parametrize('node_cls', [Node, CompactNode])
+def test_get_best_v_ties_go_to_later_node(node_cls):
+    root = node_cls('')
+    values = [0.2, 0.9, 0.9, 0.1]
+    children = []
+    for value in values:
+        _, child = root.append_children('s')
+        child.update_value(value)
+        children.append(child)
+    _, grandchild = children[1].append_children('t')
+    grandchild.update_value(0.9)
+    assert root.getBestV() == (children[2], 0.9)
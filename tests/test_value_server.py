@@ -0,0 +1,79 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+tokenizers = pytest.importorskip('tokenizers')
+
+from http.server import ThreadingHTTPServer
+from models.value_server import load_value_model, ValueServer, _Handler
+
+# tiny randomly initialized mistral saved to disk and served on the CPU, no download
+# the vocabulary must reach the prm's 'True' token index 7081
+
+VOCAB_SIZE = 8192
+TEXTS = ['step one', 'step one step two', 'answer']
+
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('tiny_mistral')
+    vocab = {'<unk>': 0, '<pad>': 1, '</s>': 2, 'step': 3, 'one': 4, 'two': 5, 'answer': 6}
+    word_level = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token='<unk>'))
+    word_level.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=word_level, unk_token='<unk>',
+                                                     eos_token='</s>')
+    tokenizer.save_pretrained(path)
+    config = transformers.MistralConfig(vocab_size=VOCAB_SIZE, hidden_size=16, intermediate_size=32,
+                                        num_hidden_layers=1, num_attention_heads=2, num_key_value_heads=1,
+                                        max_position_embeddings=64)
+    torch.manual_seed(0)
+    transformers.MistralForCausalLM(config).save_pretrained(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('use_prm', [False, True])
+def test_cpu_value_server(model_dir, use_prm):
+    tokenizer, model = load_value_model(model_dir, None, 'mistral', use_prm=use_prm, device='cpu')
+    assert tokenizer.pad_token is not None
+    assert all(param.device.type == 'cpu' for param in model.parameters())
+    server = ValueServer(model, tokenizer, device='cpu', batch_size=2)
+    result = server.score(TEXTS, max_length=8, low=-1, high=1)
+    assert len(result['values']) == len(TEXTS)
+    assert all(-1 <= value <= 1 for value in result['values'])
+    if use_prm:
+        # a probability, not a raw head output
+        assert all(0 <= value <= 1 for value in result['values'])
+
+
+class FixedScores(object):
+    def score(self, texts, max_length=2048, low=0, high=1):
+        return {'values': [0.5] * len(texts), 'tokens': [1] * len(texts)}
+
+
+def post(url, data):
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize('data', [b'{not json', b'[]', b'{}', b'{"texts": "one"}', b'{"texts": [1, 2]}'])
+def test_malformed_body_is_a_bad_request(data):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.value_server = FixedScores()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/score'
+    try:
+        code, body = post(url, data)
+        assert code == 400 and body['error'] == 'bad request'
+        assert post(url, b'{"texts": ["a", "b"]}') == (200, {'values': [0.5, 0.5], 'tokens': [1, 1]})
+    finally:
+        server.shutdown()
+        server.server_close()
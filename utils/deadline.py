@@ -0,0 +1,86 @@
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# wall-clock deadline of a run, propagated like the metrics collector: the task activates it around the search
+# and the summaries, search code checks it between steps and backend calls derive their per-call timeouts from
+# the remaining time (worker threads started with utils.parallel inherit it)
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+MIN_TIMEOUT = 0.01  # smallest per-call timeout handed to a backend (s)
+
+
+class Deadline(object):
+    def __init__(self, at=None):
+        self.at = at  # time.time() at which the budget runs out, None = unbounded
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.time() + seconds if seconds is not None else None)
+
+    def remaining(self):
+        if self.at is None:
+            return None
+        return max(0.0, self.at - time.time())
+
+    def expired(self):
+        return self.at is not None and time.time() >= self.at
+
+    def timeout(self, default=None):
+        # per-call timeout: the default, cut to the remaining time
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        remaining = max(MIN_TIMEOUT, remaining)
+        return remaining if default is None else min(default, remaining)
+
+    def earliest(self, other):
+        if other is None or other.at is None:
+            return self
+        if self.at is None or other.at < self.at:
+            return other
+        return self
+
+
+def current():
+    return _deadline.get()
+
+
+@contextmanager
+def activate(deadline):
+    # nested deadlines never extend the enclosing one
+    outer = _deadline.get()
+    if deadline is None:
+        deadline = outer
+    elif outer is not None:
+        deadline = deadline.earliest(outer)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def expired():
+    deadline = _deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+def timeout(default=None):
+    deadline = _deadline.get()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def expires_at():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline.at
+
+
+def bounded(method):
+    # decorator for task.run(): activate the task's run deadline (task.run_deadline()) for the whole run
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with activate(self.run_deadline()):
+            return method(self, *args, **kwargs)
+    return wrapper
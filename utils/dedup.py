@@ -0,0 +1,83 @@
+import re
+import zlib
+import random
+
+# near-duplicate filter for proposed steps, applied before a step is valued
+# a step is dropped if its normalized text (step numbering, case, punctuation and whitespace removed) was
+# already seen, or if its estimated character n-gram jaccard similarity to a kept step reaches the threshold
+# (minhash sketch, so comparing two steps costs num_perm integer comparisons)
+
+_PREFIX = re.compile(r'^\s*(next step\s*:|step\s*\d+\s*[:：]|下一步\s*[:：]|步骤\s*\d+\s*[:：])\s*', re.IGNORECASE)
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+
+
+def normalize_step(text):
+    text = _PREFIX.sub('', text.strip())
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+class MinHasher(object):
+    def __init__(self, num_perm=32, ngram=4, seed=1):
+        rng = random.Random(seed)
+        self.ngram = ngram
+        self.perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, normalized):
+        text = normalized.replace(' ', '')
+        if len(text) <= self.ngram:
+            return {text}
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+    def signature(self, normalized):
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in self.shingles(normalized)]
+        return tuple(min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in self.perms)
+
+
+_hashers = {}
+
+
+def get_hasher(num_perm=32, ngram=4):
+    key = (num_perm, ngram)
+    if key not in _hashers:
+        _hashers[key] = MinHasher(num_perm, ngram)
+    return _hashers[key]
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class NearDuplicateFilter(object):
+    def __init__(self, threshold=0.8, existing=(), num_perm=32, ngram=4):
+        self.threshold = threshold
+        self.hasher = get_hasher(num_perm, ngram)
+        self.seen = set()  # normalized texts
+        self.signatures = []
+        self.dropped = 0
+        for text in existing:
+            self.add(text)
+
+    def add(self, text):
+        # True if text is new and was kept, False if it is a (near-)duplicate of a kept text
+        normalized = normalize_step(text)
+        if normalized in self.seen:
+            self.dropped += 1
+            return False
+        signature = self.hasher.signature(normalized)
+        for other in self.signatures:
+            if similarity(signature, other) >= self.threshold:
+                self.dropped += 1
+                return False
+        self.seen.add(normalized)
+        self.signatures.append(signature)
+        return True
+
+
+def step_filter(task, existing=()):
+    # filter for one batch of sibling proposals, None when task.dedup_threshold is None (off)
+    threshold = getattr(task, 'dedup_threshold', None)
+    if threshold is None:
+        return None
+    return NearDuplicateFilter(threshold, existing)
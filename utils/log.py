@@ -0,0 +1,62 @@
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# logging setup shared by the search code, every module logs through logging.getLogger(__name__)
+# level guide: DEBUG per-step detail (model replies, normalized steps, values), INFO per-round / per-question
+# progress, WARNING failed backend calls and fallbacks
+PACKAGES = ('MCTS', 'ToT', 'models', 'utils', 'runners', 'bench')
+DEFAULT_FORMAT = '%(message)s'
+
+_listener = None
+_handlers = []
+
+
+def setup_logging(level='INFO', stream=None, filename=None, fmt=DEFAULT_FORMAT, async_=False):
+    # configure the search packages' loggers; async_=True moves formatting and I/O onto a background
+    # thread behind a queue so a slow stdout pipe never blocks the search
+    global _listener, _handlers
+    stop_logging()
+    if filename is not None:
+        target = logging.FileHandler(filename, encoding='utf-8')
+    else:
+        target = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    target.setFormatter(logging.Formatter(fmt))
+
+    if async_:
+        log_queue = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = target
+
+    if isinstance(level, str):
+        level = getattr(logging, level.upper())
+    for name in PACKAGES:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        logger.propagate = False
+    _handlers = [handler, target]
+    return handler
+
+
+def stop_logging():
+    # flush the async queue and detach handlers installed by setup_logging
+    global _listener, _handlers
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for name in PACKAGES:
+        logger = logging.getLogger(name)
+        for handler in _handlers:
+            logger.removeHandler(handler)
+    for handler in _handlers:
+        handler.close()
+    _handlers = []
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,187 @@
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# per-call accounting of backend usage (latency, tokens, retries, cache hits)
+# a task activates its own collector around run(), search code tags the current phase
+_collector = contextvars.ContextVar('metrics_collector', default=None)
+_phase = contextvars.ContextVar('metrics_phase', default='search')
+_call = contextvars.ContextVar('metrics_call', default=None)
+
+
+class CallStats(object):
+    __slots__ = ('calls', 'failures', 'retries', 'cache_hits', 'prompt_tokens', 'completion_tokens', 'latency',
+                 'max_latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def merge(self, other):
+        for key in self.__slots__:
+            if key == 'max_latency':
+                self.max_latency = max(self.max_latency, other.max_latency)
+            else:
+                setattr(self, key, getattr(self, key) + getattr(other, key))
+
+    def to_dict(self):
+        out = {key: getattr(self, key) for key in self.__slots__}
+        out['mean_latency'] = self.latency / self.calls if self.calls else 0.0
+        lookups = self.calls + self.cache_hits
+        out['cache_hit_rate'] = self.cache_hits / lookups if lookups else 0.0
+        return out
+
+
+class MetricsCollector(object):
+    def __init__(self, name=''):
+        self.name = name
+        self.stats = {}  # {(phase, kind, backend): CallStats}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def _get(self, phase, kind, backend):
+        key = (phase, kind, backend)
+        if key not in self.stats:
+            self.stats[key] = CallStats()
+        return self.stats[key]
+
+    def record_call(self, phase, kind, backend, latency, prompt_tokens=0, completion_tokens=0, retries=0, ok=True):
+        with self.lock:
+            item = self._get(phase, kind, backend)
+            item.calls += 1
+            item.failures += 0 if ok else 1
+            item.retries += retries
+            item.prompt_tokens += prompt_tokens
+            item.completion_tokens += completion_tokens
+            item.latency += latency
+            item.max_latency = max(item.max_latency, latency)
+
+    def record_cache_hit(self, phase, kind, backend='cache'):
+        with self.lock:
+            self._get(phase, kind, backend).cache_hits += 1
+
+    def total(self, phase=None, kind=None, backend=None):
+        out = CallStats()
+        with self.lock:
+            for (p, k, b), item in self.stats.items():
+                if phase is not None and p != phase:
+                    continue
+                if kind is not None and k != kind:
+                    continue
+                if backend is not None and b != backend:
+                    continue
+                out.merge(item)
+        return out
+
+    def report(self):
+        # {'task': name, 'total': {...}, 'phases': {phase: {kind: {...}}}, 'backends': {backend: {...}}}
+        phases = {}
+        backends = {}
+        with self.lock:
+            items = list(self.stats.items())
+        for (p, k, b), item in items:
+            phases.setdefault(p, {}).setdefault(k, CallStats()).merge(item)
+            backends.setdefault(b, CallStats()).merge(item)
+        return {
+            'task': self.name,
+            'total': self.total().to_dict(),
+            'phases': {p: {k: v.to_dict() for k, v in kinds.items()} for p, kinds in phases.items()},
+            'backends': {b: v.to_dict() for b, v in backends.items()},
+        }
+
+
+def current():
+    return _collector.get()
+
+
+def current_phase():
+    return _phase.get()
+
+
+@contextmanager
+def activate(collector):
+    token = _collector.set(collector)
+    phase_token = _phase.set('search')
+    try:
+        yield collector
+    finally:
+        _phase.reset(phase_token)
+        _collector.reset(token)
+
+
+def set_phase(name):
+    # switch phase until the enclosing activate() exits
+    _phase.set(name)
+
+
+@contextmanager
+def phase(name):
+    token = _phase.set(name)
+    try:
+        yield
+    finally:
+        _phase.reset(token)
+
+
+def collect(method):
+    # decorator for task.run(): activate the task's own collector for the whole run
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with activate(self.metrics):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def track_call(kind, backend):
+    # wraps one logical backend call (all retries included)
+    record = {'prompt_tokens': 0, 'completion_tokens': 0, 'retries': 0, 'ok': True}
+    token = _call.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record['ok'] = False
+        raise
+    finally:
+        _call.reset(token)
+        collector = _collector.get()
+        if collector is not None:
+            collector.record_call(_phase.get(), kind, backend, time.perf_counter() - start, record['prompt_tokens'],
+                                  record['completion_tokens'], record['retries'], record['ok'])
+
+
+def add_tokens(prompt_tokens=0, completion_tokens=0):
+    record = _call.get()
+    if record is not None:
+        record['prompt_tokens'] += prompt_tokens
+        record['completion_tokens'] += completion_tokens
+
+
+def add_retry(*args):
+    record = _call.get()
+    if record is not None:
+        record['retries'] += 1
+
+
+def mark_failed():
+    record = _call.get()
+    if record is not None:
+        record['ok'] = False
+
+
+def record_cache_hit(kind, backend='cache'):
+    collector = _collector.get()
+    if collector is not None:
+        collector.record_cache_hit(_phase.get(), kind, backend)
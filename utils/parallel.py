@@ -0,0 +1,19 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# concurrent model calls from inside a search: every call runs in a copy of the caller's context, so metrics
+# (collector, phase) and trace spans stay attributed to the running task
+
+
+def submit_in_context(pool, fn, *args, **kwargs):
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def map_in_context(fn, items, max_workers=8):
+    # [fn(item) for item in items], run concurrently; results in input order
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        futures = [submit_in_context(pool, fn, item) for item in items]
+        return [future.result() for future in futures]
@@ -0,0 +1,86 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# turns a proposal reply into a numbered step ('Step n: ...' / '步骤n:...'), shared by MCTS and ToT
+# reply formats, tried in this order:
+#   'Next step: <step>'      -> the text after the first marker (up to a second one)
+#   '... Step k: <step>'     -> the text after the first ':' up to the next step word
+#   '<step>'                 -> the whole reply (only where plain replies are accepted)
+# a step is rejected if it is too short or repeats a step already on the path; the path's steps are parsed
+# once per path into a set of hashes instead of substring-scanning y for every proposal
+
+FORMATS = {
+    'en': {'next': 'Next step:', 'step': 'Step', 'min_next': 2, 'min_step': 4, 'min_plain': 3,
+           'line': re.compile(r'^\s*Step\s*\d+\s*:\s*')},
+    'zh': {'next': '下一步:', 'step': '步骤', 'min_next': 2, 'min_step': 3, 'min_plain': 3,
+           'line': re.compile(r'^\s*步骤\s*\d+\s*:\s*')},
+}
+MAX_PATHS = 4096  # cached step sets
+
+
+def join_reply(response, limit=None):
+    # reply lines joined by spaces in one pass
+    if limit is not None:
+        response = response[:limit]
+    return ' '.join(response).strip()
+
+
+class StepNormalizer(object):
+    def __init__(self, lang='en'):
+        assert lang in FORMATS, f"Unsupported language {lang}!"
+        self.lang = lang
+        self.fmt = FORMATS[lang]
+        self.paths = {}  # {y: set of step hashes on the path}
+
+    def reset(self):
+        self.paths = {}
+
+    def path_steps(self, y):
+        steps = self.paths.get(y)
+        if steps is None:
+            line = self.fmt['line']
+            steps = {hash(line.sub('', s).strip()) for s in y.split('\n') if s.strip()}
+            if len(self.paths) >= MAX_PATHS:
+                self.paths = {}
+            self.paths[y] = steps
+        return steps
+
+    def format_step(self, body, step_n):
+        if self.lang == 'zh':
+            return '步骤' + str(step_n) + ':' + body + '\n'
+        return 'Step ' + str(step_n) + ': ' + body + '\n'
+
+    def normalize(self, response, y, step_n, allow_plain=True, max_lines=5):
+        # normalized step for a proposal reply (list of lines), '' if rejected
+        p = join_reply(response, max_lines)
+        fmt = self.fmt
+        head, marker, rest = p.partition(fmt['next'])
+        if marker:
+            body = rest.partition(fmt['next'])[0].strip()
+            min_len = fmt['min_next']
+        elif fmt['step'] in p and ':' in p:
+            # text after the first ':' up to the next step word, without the ':' itself
+            body = p[p.index(':'):].partition(fmt['step'])[0].strip()
+            if len(body) < fmt['min_step']:
+                logger.debug('Step output too short!')
+                return ''
+            body = body[1:].strip()
+            min_len = 0
+        elif allow_plain:
+            body = p
+            min_len = fmt['min_plain']
+        else:
+            logger.info('Output format error!')
+            return ''
+
+        if len(body) < min_len:
+            logger.debug('Step output too short!')
+            return ''
+        if hash(body) in self.path_steps(y):
+            logger.debug('Step output repeated!')
+            return ''
+        revised = self.format_step(body, step_n)
+        logger.debug('Normalized new step:%s', revised)
+        return revised
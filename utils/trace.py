@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+# optional span tracing, exported as Chrome trace-event json (loads in chrome://tracing and ui.perfetto.dev)
+# disabled by default; span() then returns a shared no-op object so hot paths pay one global lookup
+_enabled = False
+_events = []
+_lock = threading.Lock()
+_origin = 0
+_path = None
+_thread_names = {}
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    __slots__ = ('name', 'cat', 'args', 'start')
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        _record({'name': self.name, 'cat': self.cat, 'ph': 'X', 'ts': (self.start - _origin) / 1000,
+                 'dur': (end - self.start) / 1000, 'args': self.args})
+        return False
+
+    def set(self, **args):
+        # attach results known only at the end of the span
+        self.args.update(args)
+
+
+def _record(event):
+    thread = threading.current_thread()
+    event['pid'] = os.getpid()
+    event['tid'] = thread.ident
+    with _lock:
+        if thread.ident not in _thread_names:
+            _thread_names[thread.ident] = thread.name
+        _events.append(event)
+
+
+def enabled():
+    return _enabled
+
+
+def start(path=None):
+    # begin collecting spans; if path is given, stop() writes the trace there
+    global _enabled, _events, _origin, _path, _thread_names
+    with _lock:
+        _events = []
+        _thread_names = {}
+        # perf_counter precision, wall-clock origin: traces of different processes line up when merged
+        _origin = time.perf_counter_ns() - time.time_ns()
+        _path = path
+        _enabled = True
+
+
+def stop():
+    global _enabled
+    with _lock:
+        _enabled = False
+    data = export()
+    if _path is not None:
+        save(_path, data)
+    return data
+
+
+@contextmanager
+def tracing(path=None):
+    start(path)
+    try:
+        yield
+    finally:
+        stop()
+
+
+def span(name, cat='search', **args):
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, cat, args)
+
+
+def instant(name, cat='search', **args):
+    if _enabled:
+        _record({'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': (time.perf_counter_ns() - _origin) / 1000,
+                 'args': args})
+
+
+def counter(name, **values):
+    # numeric time series (e.g. tree size, queue depth) shown as a track in the viewer
+    if _enabled:
+        _record({'name': name, 'ph': 'C', 'ts': (time.perf_counter_ns() - _origin) / 1000, 'args': values})
+
+
+def traced(name=None, cat='search'):
+    # decorator form of span()
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(span_name, cat, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export():
+    with _lock:
+        events = list(_events)
+        names = dict(_thread_names)
+    pid = os.getpid()
+    meta = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': f'search-{pid}'}}]
+    meta.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+                for tid, thread_name in names.items())
+    return {'traceEvents': meta + events, 'displayTimeUnit': 'ms'}
+
+
+def save(path, data=None):
+    if data is None:
+        data = export()
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+
+
+def merge(paths, out_path):
+    # merge traces written by several worker processes into one timeline
+    events = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            events.extend(json.load(f)['traceEvents'])
+    save(out_path, {'traceEvents': events, 'displayTimeUnit': 'ms'})